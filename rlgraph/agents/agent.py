@@ -25,11 +25,14 @@ import numpy as np
 from rlgraph import get_backend
 from rlgraph.components import Component, Exploration, PreprocessorStack, Synchronizable, Policy, Optimizer, \
     ValueFunction, ContainerMerger, ContainerSplitter
+from rlgraph.components.helpers.mem_checkpoint import CHECKPOINT_STATE_PREFIX, load_arrays, store_arrays
 from rlgraph.graphs.graph_builder import GraphBuilder
 from rlgraph.graphs.graph_executor import GraphExecutor
 from rlgraph.spaces import Space, ContainerSpace
 from rlgraph.utils.decorators import rlgraph_api, graph_fn
 from rlgraph.utils.input_parsing import parse_execution_spec, parse_observe_spec, parse_update_spec
+from rlgraph.utils.numpy import n_step_transform
+from rlgraph.utils.rlgraph_errors import RLGraphError
 from rlgraph.utils.specifiable import Specifiable
 
 if get_backend() == "tf":
@@ -202,6 +205,9 @@ class Agent(Specifiable):
             execution_spec=self.execution_spec,
             saver_spec=saver_spec
         )  # type: GraphExecutor
+        # Path, chunk size and chunk digests of the last memory checkpoint, used for incremental checkpoints.
+        self.memory_checkpoint_path = None
+        self.memory_checkpoint_digests = None
 
     def reset_env_buffers(self, env_id=None):
         """
@@ -433,11 +439,13 @@ class Agent(Specifiable):
             buffer_is_full = len(self.rewards_buffer[env_id]) >= self.observe_spec["buffer_size"]
 
             # If the buffer (per environment) is full OR the episode was aborted:
-            # Change terminal of last record artificially to True, insert and flush the buffer.
-            if buffer_is_full or self.terminals_buffer[env_id][-1]:
+            # With n-step post-processing, insert and keep the records lacking an n-step lookahead.
+            # Otherwise, change terminal of last record artificially to True, insert and flush the buffer.
+            if self.observe_spec["n_step"] > 1 and (buffer_is_full or self.terminals_buffer[env_id][-1]):
+                self._observe_n_step(env_id)
+            elif buffer_is_full or self.terminals_buffer[env_id][-1]:
                 self.terminals_buffer[env_id][-1] = True
 
-                # TODO: Apply n-step post-processing if necessary.
                 if self.flat_action_space is not None:
                     actions_ = {key: np.asarray(self.actions_buffer[env_id][i]) for i, key in
                                 enumerate(self.flat_action_space.keys())}
@@ -462,6 +470,48 @@ class Agent(Specifiable):
 
             self._observe_graph(preprocessed_states, actions, internals, rewards, next_states, terminals)
 
+    def _observe_n_step(self, env_id):
+        """
+        Applies n-step post-processing to the observe buffer of an environment and moves the result into the
+        graph. If the episode has not ended, the last n - 1 records lack a full n-step lookahead and remain
+        buffered for the next flush.
+
+        Args:
+            env_id (str): Environment id whose buffer to flush.
+        """
+        n_step = self.observe_spec["n_step"]
+        num_records = len(self.rewards_buffer[env_id])
+        episode_ended = bool(self.terminals_buffer[env_id][-1])
+        rewards, terminals, next_state_indices, keep = n_step_transform(
+            self.rewards_buffer[env_id], self.terminals_buffer[env_id], [num_records], n_step, self.discount,
+            [episode_ended]
+        )
+        if self.flat_action_space is not None:
+            actions_ = {key: np.asarray(self.actions_buffer[env_id][i])[keep] for i, key in
+                        enumerate(self.flat_action_space.keys())}
+        else:
+            actions_ = np.asarray(self.actions_buffer[env_id])[keep]
+        self._observe_graph(
+            preprocessed_states=np.asarray(self.states_buffer[env_id])[keep],
+            actions=actions_,
+            internals=np.asarray(self.internals_buffer[env_id])[keep],
+            rewards=rewards[keep],
+            next_states=np.asarray(self.next_states_buffer[env_id])[next_state_indices[keep]],
+            terminals=terminals[keep]
+        )
+
+        if episode_ended:
+            self.reset_env_buffers(env_id)
+        else:
+            start = len(keep)
+            for buffer in [self.states_buffer, self.internals_buffer, self.rewards_buffer,
+                           self.next_states_buffer, self.terminals_buffer]:
+                buffer[env_id] = buffer[env_id][start:]
+            if self.flat_action_space is not None:
+                self.actions_buffer[env_id] = tuple(values[start:] for values in self.actions_buffer[env_id])
+            else:
+                self.actions_buffer[env_id] = self.actions_buffer[env_id][start:]
+
     def _observe_graph(self, preprocessed_states, actions, internals, rewards, next_states, terminals):
         """
         This methods defines the actual call to the computational graph by executing
@@ -574,6 +624,68 @@ class Agent(Specifiable):
         """
         self.graph_executor.load_model(checkpoint_directory=checkpoint_directory, checkpoint_path=checkpoint_path)
 
+    def store_memory(self, path, incremental=False, chunk_size=8192):
+        """
+        Stores the contents of the agent's memory (records, index and size, plus state kept outside of
+        variables, e.g. priority trees or episode indices of define-by-run memories) as compressed, chunked files
+        so a restarted learner does not have to refill it.
+
+        Args:
+            path (str): Checkpoint directory.
+            incremental (bool): If True and the last checkpoint of this agent's memory went to `path`, only stores
+                the chunks which changed since then. Graph memories have no write counters, so changed chunks are
+                detected by comparing chunk digests.
+            chunk_size (int): Records per chunk file.
+        """
+        memory = self._get_checkpoint_memory()
+        values = self.graph_executor.read_variable_values(memory.variable_registry)
+        arrays = {}
+        for name, value in values.items():
+            # Define-by-run memories keep counters in plain attributes, the registry only holds initial values.
+            attribute = getattr(memory, name.split("/")[-1], None)
+            if get_backend() == "pytorch" and isinstance(attribute, (int, float)):
+                value = attribute
+            arrays[name] = np.asarray(value)
+        for name, value in memory.get_checkpoint_state().items():
+            arrays[CHECKPOINT_STATE_PREFIX + name] = np.asarray(value)
+        digests = {}
+        if incremental and self.memory_checkpoint_path == (path, chunk_size):
+            digests = self.memory_checkpoint_digests
+        self.memory_checkpoint_digests = store_arrays(path, arrays, chunk_size=chunk_size, digests=digests)
+        self.memory_checkpoint_path = (path, chunk_size)
+
+    def load_memory(self, path):
+        """
+        Restores the agent's memory from a checkpoint written by `store_memory`.
+
+        Args:
+            path (str): Checkpoint directory.
+        """
+        memory = self._get_checkpoint_memory()
+        arrays, _ = load_arrays(path)
+        state = {name[len(CHECKPOINT_STATE_PREFIX):]: arrays.pop(name) for name in list(arrays.keys())
+                 if name.startswith(CHECKPOINT_STATE_PREFIX)}
+        if set(arrays.keys()) != set(memory.variable_registry.keys()):
+            raise RLGraphError("Memory checkpoint in {} does not match memory variables {}.".format(
+                path, list(memory.variable_registry.keys()))
+            )
+        self.graph_executor.assign_variable_values(memory.variable_registry, arrays)
+        if get_backend() == "pytorch":
+            for name, value in arrays.items():
+                attribute_name = name.split("/")[-1]
+                if isinstance(getattr(memory, attribute_name, None), (int, float)):
+                    setattr(memory, attribute_name, value.item())
+        memory.set_checkpoint_state(state)
+        # The next checkpoint is stored in full.
+        self.memory_checkpoint_path = None
+        self.memory_checkpoint_digests = None
+
+    def _get_checkpoint_memory(self):
+        memory = getattr(self, "memory", None)
+        if memory is None:
+            raise RLGraphError("Agent {} has no memory to checkpoint.".format(type(self).__name__))
+        return memory
+
     def get_weights(self):
         """
         Returns all weights relevant for the agent's policy for syncing purposes.
@@ -1195,6 +1195,12 @@ class Component(Specifiable):
             # PyTorchVariable is used to store torch parameters (e.g. layers).
             if isinstance(variable, PyTorchVariable):
                 return variable.get_value()
+            # Preallocated tensors (e.g. memory buffers) are gathered in one `index_select` call.
+            elif isinstance(variable, torch.Tensor) and indices is not None:
+                if TraceContext.DEFINE_BY_RUN_CONTEXT == "building" and shape is not None and len(indices) == 0:
+                    return torch.zeros(shape, dtype=dtype)
+                ret = variable.index_select(0, torch.as_tensor(indices, dtype=torch.long))
+                return ret if dtype is None or ret.dtype == dtype else ret.to(dtype)
             # Lists or numpy arrays may be used to store mutable state that does not need
             # tensor operations.
             elif isinstance(variable, list) or isinstance(variable, np.ndarray):
@@ -0,0 +1,171 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+
+import numpy as np
+from six.moves import xrange as range_
+
+from rlgraph.utils.rlgraph_errors import RLGraphError
+
+# Index file of a memory checkpoint directory.
+CHECKPOINT_INDEX = "checkpoint.json"
+# Name prefix of memory state stored alongside memory variables (see `Memory.get_checkpoint_state`).
+CHECKPOINT_STATE_PREFIX = "state/"
+
+
+def written_chunks(num_rows, chunk_size, first, last):
+    """
+    Determines the chunks of a ring buffer touched by the writes with (monotonic) write counters in [first, last).
+
+    Args:
+        num_rows (int): Length of the ring buffer.
+        chunk_size (int): Rows per chunk.
+        first (int): Write counter at the last snapshot.
+        last (int): Current write counter.
+
+    Returns:
+        list: Sorted chunk ids.
+    """
+    num_chunks = (num_rows + chunk_size - 1) // chunk_size
+    if last - first >= num_rows:
+        return list(range_(num_chunks))
+    if last <= first:
+        return []
+    start = first % num_rows
+    end = start + last - first
+    ranges = [(start, end)] if end <= num_rows else [(start, num_rows), (0, end - num_rows)]
+    chunk_ids = set()
+    for range_start, range_end in ranges:
+        chunk_ids.update(range_(range_start // chunk_size, (range_end - 1) // chunk_size + 1))
+    return sorted(chunk_ids)
+
+
+def chunk_digests(array, chunk_size):
+    """
+    Computes a digest per chunk of an array, used to detect changed chunks between snapshots.
+
+    Args:
+        array (np.ndarray): Array to split along the first axis.
+        chunk_size (int): Rows per chunk.
+
+    Returns:
+        list: Digest per chunk, None for chunks which cannot be hashed (object arrays).
+    """
+    if array.dtype == object:
+        num_chunks = (len(array) + chunk_size - 1) // chunk_size if array.ndim > 0 else 1
+        return [None] * num_chunks
+    if array.ndim == 0:
+        return [hashlib.sha1(array.tobytes()).hexdigest()]
+    return [hashlib.sha1(np.ascontiguousarray(array[start:start + chunk_size]).tobytes()).hexdigest()
+            for start in range_(0, len(array), chunk_size)]
+
+
+def _chunk_file(path, name, chunk_id):
+    return os.path.join(path, "{}.{:06d}.npz".format(name.replace("/", "-"), chunk_id))
+
+
+def _atomic_save(file_name, array):
+    tmp_file = file_name + ".tmp.npz"
+    np.savez_compressed(tmp_file, data=array)
+    os.replace(tmp_file, file_name)
+
+
+def store_arrays(path, arrays, chunk_size=8192, written=None, state=None, digests=None):
+    """
+    Stores arrays as compressed chunk files (split along the first axis) plus an index file.
+
+    Args:
+        path (str): Checkpoint directory, created if necessary.
+        arrays (dict): Arrays to store by name.
+        chunk_size (int): Rows per chunk file.
+        written (Optional[dict]): Maps array names to (first, last) write counters since the previous snapshot in
+            `path`. Only chunks touched by these writes are stored again (see `written_chunks`). Arrays not
+            listed are stored in full.
+        state (Optional[dict]): JSON-serializable scalar state stored in the index file.
+        digests (Optional[dict]): For memories without write counters: Maps array names to their chunk digests at
+            the previous snapshot in `path` (as returned by this function). Only chunks whose digest changed are
+            stored again. Pass an empty dict to store all chunks and only compute digests.
+
+    Returns:
+        Optional[dict]: Chunk digests of all arrays by name if `digests` is given, else None.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    written = written or {}
+    new_digests = None if digests is None else {}
+    index = dict(chunk_size=chunk_size, arrays={}, state=state or {})
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        num_rows = len(array) if array.ndim > 0 else 1
+        if name in written:
+            chunk_ids = written_chunks(num_rows, chunk_size, *written[name])
+        else:
+            chunk_ids = range_((num_rows + chunk_size - 1) // chunk_size)
+        if digests is not None:
+            new_digests[name] = chunk_digests(array, chunk_size)
+            previous = digests.get(name)
+            if previous is not None and len(previous) == len(new_digests[name]):
+                chunk_ids = [chunk_id for chunk_id, (old, new) in enumerate(zip(previous, new_digests[name]))
+                             if new is None or old != new]
+        for chunk_id in chunk_ids:
+            _atomic_save(_chunk_file(path, name, chunk_id), array[chunk_id * chunk_size:(chunk_id + 1) * chunk_size]
+                         if array.ndim > 0 else array)
+        index["arrays"][name] = dict(shape=list(array.shape), dtype=array.dtype.str)
+
+    # The index is written last so it only ever references completely written chunks.
+    tmp_index = os.path.join(path, CHECKPOINT_INDEX + ".tmp")
+    with open(tmp_index, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_index, os.path.join(path, CHECKPOINT_INDEX))
+    return new_digests
+
+
+def load_arrays(path):
+    """
+    Loads arrays stored via `store_arrays`.
+
+    Args:
+        path (str): Checkpoint directory.
+
+    Returns:
+        tuple: Dict of arrays by name, dict of scalar state.
+    """
+    index_file = os.path.join(path, CHECKPOINT_INDEX)
+    if not os.path.exists(index_file):
+        raise RLGraphError("No memory checkpoint found in {}.".format(path))
+    with open(index_file) as f:
+        index = json.load(f)
+
+    chunk_size = index["chunk_size"]
+    arrays = {}
+    for name, spec in index["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        array = np.empty(shape=tuple(spec["shape"]), dtype=dtype)
+        num_rows = len(array) if array.ndim > 0 else 1
+        for chunk_id in range_((num_rows + chunk_size - 1) // chunk_size):
+            with np.load(_chunk_file(path, name, chunk_id), allow_pickle=dtype == object) as chunk:
+                if array.ndim > 0:
+                    array[chunk_id * chunk_size:(chunk_id + 1) * chunk_size] = chunk["data"]
+                else:
+                    array[...] = chunk["data"]
+        arrays[name] = array
+    return arrays, index["state"]
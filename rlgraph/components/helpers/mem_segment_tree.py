@@ -17,11 +17,47 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import numpy as np
 import operator
 
 from rlgraph.utils.rlgraph_errors import RLGraphError
 
 
+def np_reduce_op(reduce_op):
+    """
+    Maps a scalar reduce op of a segment tree to the equivalent element-wise NumPy ufunc.
+
+    Args:
+        reduce_op (Union(operator.add, min, max)): Scalar reduce op.
+
+    Returns:
+        np.ufunc: Element-wise version of the reduce op.
+    """
+    if reduce_op == operator.add:
+        return np.add
+    elif reduce_op == min:
+        return np.minimum
+    elif reduce_op == max:
+        return np.maximum
+    else:
+        raise RLGraphError("Unsupported reduce OP. Support ops are [add, min, max].")
+
+
+def create_segment_tree_buffer(capacity, neutral_element):
+    """
+    Creates the float64 storage array of a segment tree, initialized with the neutral element of its
+    reduce op.
+
+    Args:
+        capacity (int): Capacity of the segment tree. Must be a power of 2.
+        neutral_element (float): Neutral element of the reduce op (e.g. 0.0 for sum, inf for min).
+
+    Returns:
+        np.ndarray: Buffer of size 2 * capacity.
+    """
+    return np.full(shape=(2 * capacity,), fill_value=neutral_element, dtype=np.float64)
+
+
 class MemSegmentTree(object):
     """
     In-memory Segment tree for prioritized replay.
@@ -41,13 +77,17 @@ class MemSegmentTree(object):
         Helper to represent a segment tree.
 
         Args:
-            values (list): Storage for the segment tree.
+            values (Union[list,np.ndarray]): Storage for the segment tree. The batch methods require
+                a NumPy array (see `create_segment_tree_buffer`).
             capacity (int): Capacity of segment tree.
             operator (callable): Reduce operation of the segment tree.
         """
         self.values = values
         self.capacity = capacity
         self.operator = operator
+        self.np_operator = np_reduce_op(operator)
+        # Number of levels between the root and the leaves.
+        self.depth = self.capacity.bit_length() - 1
 
     def insert(self, index, element):
         """
@@ -72,6 +112,28 @@ class MemSegmentTree(object):
             )
             index = index >> 1
 
+    def insert_batch(self, indices, elements):
+        """
+        Inserts a batch of elements into the segment tree. Instead of walking the tree once per
+        element, all affected nodes of one level are recomputed in a single vectorized operation, so
+        the cost is O(log N) NumPy operations for the whole batch.
+
+        Args:
+            indices (ndarray): Insertion indices.
+            elements (ndarray): Elements to insert. Duplicate indices resolve to the last element.
+        """
+        indices = np.asarray(indices, dtype=np.int64) + self.capacity
+        self.values[indices] = elements
+
+        indices = np.unique(indices >> 1)
+        for _ in range(self.depth):
+            update_indices = 2 * indices
+            self.values[indices] = self.np_operator(
+                self.values[update_indices],
+                self.values[update_indices + 1]
+            )
+            indices = np.unique(indices >> 1)
+
     def get(self, index):
         """
         Reads an item from the segment tree.
@@ -107,6 +169,28 @@ class MemSegmentTree(object):
                 index = update_index + 1
         return index - self.capacity
 
+    def find_prefixsum_batch(self, prefix_sums):
+        """
+        Vectorized version of `index_of_prefixsum`: Descends the tree for all prefix sums at once,
+        one level per step.
+
+        Args:
+            prefix_sums (ndarray): Upper bounds on the prefixes we are allowed to select.
+
+        Returns:
+            ndarray: Indices satisfying the prefix sum condition.
+        """
+        prefix_sums = np.array(prefix_sums, dtype=np.float64)
+        indices = np.ones_like(prefix_sums, dtype=np.int64)
+
+        for _ in range(self.depth):
+            update_indices = 2 * indices
+            left_values = self.values[update_indices]
+            go_right = left_values <= prefix_sums
+            prefix_sums -= np.where(go_right, left_values, 0.0)
+            indices = update_indices + go_right
+        return indices - self.capacity
+
     def reduce(self, start, limit, reduce_op=operator.add):
         """
         Applies an operation to specified segment.
@@ -180,6 +264,30 @@ class MinSumSegmentTree(object):
         self.min_segment_tree = min_tree
         self.capacity = capacity
 
+    @staticmethod
+    def from_capacity(capacity):
+        """
+        Creates an array-backed sum/min segment tree pair for the given memory capacity.
+
+        Args:
+            capacity (int): Capacity of the memory. Will be rounded up to the next power of 2.
+
+        Returns:
+            MinSumSegmentTree: The merged tree.
+        """
+        priority_capacity = 1
+        while priority_capacity < capacity:
+            priority_capacity *= 2
+
+        # Create segment trees, initialize with neutral elements.
+        sum_segment_tree = MemSegmentTree(
+            create_segment_tree_buffer(priority_capacity, 0.0), priority_capacity, operator.add
+        )
+        min_segment_tree = MemSegmentTree(
+            create_segment_tree_buffer(priority_capacity, float('inf')), priority_capacity, min
+        )
+        return MinSumSegmentTree(sum_tree=sum_segment_tree, min_tree=min_segment_tree, capacity=priority_capacity)
+
     def insert(self, index, element):
         """
         Inserts an element into both segment trees by determining
@@ -201,3 +309,36 @@ class MinSumSegmentTree(object):
             self.min_segment_tree.values[index] = min(self.min_segment_tree.values[update_index],
                 self.min_segment_tree.values[update_index + 1])
             index = index >> 1
+
+    def insert_batch(self, indices, priorities):
+        """
+        Inserts a batch of priorities into both segment trees, propagating whole tree levels at once.
+
+        Args:
+            indices (ndarray): Insertion indices.
+            priorities (ndarray): Priorities to insert.
+        """
+        indices = np.asarray(indices, dtype=np.int64) + self.capacity
+        sum_values = self.sum_segment_tree.values
+        min_values = self.min_segment_tree.values
+        sum_values[indices] = priorities
+        min_values[indices] = priorities
+
+        indices = np.unique(indices >> 1)
+        for _ in range(self.sum_segment_tree.depth):
+            update_indices = 2 * indices
+            sum_values[indices] = sum_values[update_indices] + sum_values[update_indices + 1]
+            min_values[indices] = np.minimum(min_values[update_indices], min_values[update_indices + 1])
+            indices = np.unique(indices >> 1)
+
+    def find_prefixsum_batch(self, values):
+        """
+        Finds the indices for a batch of prefix sums in the sum tree.
+
+        Args:
+            values (ndarray): Prefix sums to look up.
+
+        Returns:
+            ndarray: Indices satisfying the prefix sum condition.
+        """
+        return self.sum_segment_tree.find_prefixsum_batch(values)
@@ -19,6 +19,7 @@ from __future__ import print_function
 
 from rlgraph.components.layers.preprocessing.preprocess_layer import PreprocessLayer
 
+from rlgraph.components.layers.preprocessing.atari_preprocessing import AtariPreprocessing
 from rlgraph.components.layers.preprocessing.clip import Clip
 from rlgraph.components.layers.preprocessing.concat import Concat
 from rlgraph.components.layers.preprocessing.grayscale import GrayScale
@@ -35,6 +36,7 @@ from rlgraph.components.layers.preprocessing.sequence import Sequence
 from rlgraph.components.layers.preprocessing.transpose import Transpose
 
 PreprocessLayer.__lookup_classes__ = dict(
+    ataripreprocessing=AtariPreprocessing,
     clip=Clip,
     concat=Concat,
     divide=Divide,
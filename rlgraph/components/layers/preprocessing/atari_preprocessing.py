@@ -0,0 +1,162 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import cv2
+import numpy as np
+from six.moves import xrange as range_
+
+from rlgraph import get_backend
+from rlgraph.components.layers.preprocessing.sequence import Sequence
+from rlgraph.spaces import IntBox
+from rlgraph.spaces.space_utils import sanity_check_space
+from rlgraph.utils.decorators import rlgraph_api
+from rlgraph.utils.ops import FlattenedDataOp
+from rlgraph.utils.rlgraph_errors import RLGraphError
+
+cv2.ocl.setUseOpenCL(False)
+
+if get_backend() == "tf":
+    import tensorflow as tf
+    from tensorflow.python.ops.image_ops_impl import ResizeMethod
+
+
+class AtariPreprocessing(Sequence):
+    """
+    DQN-style Atari frame preprocessing in a single layer: Gray-scales RGB frames, resizes them and stacks the last
+    `sequence_length` frames in a new last rank. Replaces a GrayScale -> ImageResize -> ConvertType -> Sequence stack.
+
+    Outputs stay uint8, which makes feeding states and storing them in replay memories 4x cheaper than float32.
+    Scaling to [0.0, 1.0] belongs at the start of the network (e.g. ConvertType and Divide layers).
+
+    With the python backend, each frame is converted into a preallocated batch of uint8 frames (without
+    intermediate arrays) and written into the ring buffer of the Sequence.
+    """
+    def __init__(self, width=84, height=84, sequence_length=4, batch_size=1, interpolation="area",
+                 scope="atari-preprocessing", **kwargs):
+        """
+        Args:
+            width (int): The width of the resized frames.
+            height (int): The height of the resized frames.
+            sequence_length (int): The number of frames to stack.
+            batch_size (int): The batch size for incoming frames so multiple inputs can be passed through at once.
+            interpolation (str): One of "bilinear", "area". Default: "area".
+        """
+        super(AtariPreprocessing, self).__init__(
+            sequence_length=sequence_length, batch_size=batch_size, add_rank=True, scope=scope, **kwargs
+        )
+        self.width = width
+        self.height = height
+
+        if interpolation == "bilinear":
+            if get_backend() == "tf":
+                self.tf_interpolation = ResizeMethod.BILINEAR
+            self.cv2_interpolation = cv2.INTER_LINEAR
+        elif interpolation == "area":
+            if get_backend() == "tf":
+                self.tf_interpolation = ResizeMethod.AREA
+            self.cv2_interpolation = cv2.INTER_AREA
+        else:
+            raise RLGraphError("Invalid interpolation algorithm {}!. Allowed are 'bilinear' and "
+                               "'area'.".format(interpolation))
+
+        # Python backend: Preallocated gray-scaled and resized frames.
+        self.gray_frame = None
+        self.frames = None
+
+    def get_frame_space(self, space):
+        """
+        Returns:
+            IntBox: The Space of single gray-scaled and resized frames.
+        """
+        return IntBox(256, shape=(self.height, self.width), dtype="uint8", add_batch_rank=space.has_batch_rank)
+
+    def get_preprocessed_space(self, space):
+        shape = [self.height, self.width, self.sequence_length]
+        # TODO move to transpose component.
+        if self.in_data_format == "channels_last" and self.out_data_format == "channels_first":
+            shape.reverse()
+        return IntBox(256, shape=tuple(shape), dtype="uint8", add_batch_rank=space.has_batch_rank)
+
+    def check_input_spaces(self, input_spaces, action_space=None):
+        super(AtariPreprocessing, self).check_input_spaces(input_spaces, action_space)
+        in_space = input_spaces["preprocessing_inputs"]
+
+        # RGB images.
+        sanity_check_space(in_space, rank=3)
+        if in_space.shape[-1] != 3:
+            raise RLGraphError("AtariPreprocessing requires RGB frames, but input shape is {}!".format(in_space.shape))
+
+    def create_variables(self, input_spaces, action_space=None):
+        # The sequence is built from converted frames.
+        super(AtariPreprocessing, self).create_variables(input_spaces=dict(
+            preprocessing_inputs=self.get_frame_space(input_spaces["preprocessing_inputs"])
+        ), action_space=action_space)
+
+    def apply_envs(self, preprocessing_inputs, env_indices):
+        return super(AtariPreprocessing, self).apply_envs(self._convert_frames(preprocessing_inputs), env_indices)
+
+    def _convert_frames(self, preprocessing_inputs):
+        """
+        Python backend: Gray-scales and resizes a batch of RGB frames into the preallocated frame batch.
+
+        Args:
+            preprocessing_inputs (np.ndarray): Batch of RGB frames.
+
+        Returns:
+            np.ndarray: The uint8 frames. Only valid until the next call.
+        """
+        preprocessing_inputs = np.asarray(preprocessing_inputs, dtype=np.uint8)
+        batch_size = len(preprocessing_inputs)
+        if self.frames is None or len(self.frames) < batch_size:
+            self.frames = np.empty((batch_size, self.height, self.width), dtype=np.uint8)
+        if self.gray_frame is None or self.gray_frame.shape != preprocessing_inputs.shape[1:3]:
+            self.gray_frame = np.empty(preprocessing_inputs.shape[1:3], dtype=np.uint8)
+        for i in range_(batch_size):
+            cv2.cvtColor(np.ascontiguousarray(preprocessing_inputs[i]), cv2.COLOR_RGB2GRAY, dst=self.gray_frame)
+            cv2.resize(
+                self.gray_frame, dsize=(self.width, self.height), dst=self.frames[i],
+                interpolation=self.cv2_interpolation
+            )
+        return self.frames[:batch_size]
+
+    @rlgraph_api(flatten_ops=True, split_ops=False)
+    def _graph_fn_apply(self, preprocessing_inputs):
+        """
+        Converts the incoming RGB frames and sequences them together with the stored older frames.
+
+        Args:
+            preprocessing_inputs (FlattenedDataOp): The FlattenedDataOp holding the batches of RGB frames.
+
+        Returns:
+            FlattenedDataOp: The FlattenedDataOp holding the uint8 frame sequences.
+        """
+        if self.backend == "python" or get_backend() == "python":
+            return self._sequence_python(self._convert_frames(preprocessing_inputs))
+        elif get_backend() == "tf":
+            frames = FlattenedDataOp()
+            for key, value in preprocessing_inputs.items():
+                weights = np.reshape((0.299, 0.587, 0.114), (1, 1, 1, 3))
+                gray_scaled = tf.reduce_sum(weights * tf.cast(value, dtype=tf.float32), axis=-1, keepdims=True)
+                resized = tf.image.resize_images(
+                    images=gray_scaled, size=(self.height, self.width), method=self.tf_interpolation
+                )
+                frames[key] = tf.cast(tf.clip_by_value(tf.round(resized[:, :, :, 0]), 0.0, 255.0), dtype=tf.uint8)
+            return self._sequence_tf(frames)
+        else:
+            raise RLGraphError("AtariPreprocessing is not supported by backend {}.".format(get_backend()))
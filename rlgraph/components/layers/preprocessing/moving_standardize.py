@@ -22,6 +22,7 @@ import numpy as np
 from rlgraph import get_backend
 from rlgraph.components.layers.preprocessing import PreprocessLayer
 from rlgraph.utils.decorators import rlgraph_api
+from rlgraph.utils.rlgraph_errors import RLGraphError
 from rlgraph.utils.util import SMALL_NUMBER
 
 if get_backend() == "tf":
@@ -33,6 +34,10 @@ elif get_backend() == "pytorch":
 class MovingStandardize(PreprocessLayer):
     """
     Standardizes inputs using a moving estimate of mean and std.
+
+    With the python backend, each batch row keeps its own sample count and estimates, so one instance can
+    standardize the states of several environments. The number of rows follows the batch size of the first inputs
+    after creation or a reset. Later inputs must keep that batch size.
     """
     def __init__(self, batch_size=1, scope="moving-standardize", **kwargs):
         """
@@ -57,9 +62,7 @@ class MovingStandardize(PreprocessLayer):
         self.in_shape = (self.batch_size, ) + in_space.shape
 
         if self.backend == "python" or get_backend() == "python" or get_backend() == "pytorch":
-            self.sample_count = 0.0
-            self.mean_est = np.zeros(self.in_shape, dtype=np.float32)
-            self.std_sum_est = np.zeros(self.in_shape, dtype=np.float32)
+            self.create_env_slots(self.batch_size)
         elif get_backend() == "tf":
             self.sample_count = self.get_variable(name="sample-count", dtype="float", initializer=0.0, trainable=False)
             self.mean_est = self.get_variable(
@@ -77,42 +80,71 @@ class MovingStandardize(PreprocessLayer):
                 initializer=tf.zeros_initializer()
             )
 
+    def create_env_slots(self, num_envs):
+        """
+        Python backend: Creates zeroed sample counts and estimates for `num_envs` batch rows.
+        """
+        self.sample_count = np.zeros(num_envs, dtype=np.float32)
+        self.mean_est = np.zeros((num_envs,) + self.in_shape[1:], dtype=np.float32)
+        self.std_sum_est = np.zeros((num_envs,) + self.in_shape[1:], dtype=np.float32)
+
+    def reset_envs(self, env_indices):
+        self.sample_count[env_indices] = 0.0
+        self.mean_est[env_indices] = 0.0
+        self.std_sum_est[env_indices] = 0.0
+
+    def apply_envs(self, preprocessing_inputs, env_indices):
+        return self._standardize(np.asarray(preprocessing_inputs, dtype=np.float32), list(env_indices))
+
+    def _standardize(self, preprocessing_inputs, rows):
+        # https://www.johndcook.com/blog/standard_deviation/
+        sample_count = self.sample_count[rows] + 1.0
+        self.sample_count[rows] = sample_count
+        sample_count = np.reshape(sample_count, (-1,) + (1,) * (preprocessing_inputs.ndim - 1))
+
+        # From zeroed estimates, the first update sets the mean to the input and leaves the std sum at 0.
+        update = preprocessing_inputs - self.mean_est[rows]
+        mean_est = self.mean_est[rows] + update / sample_count
+        std_sum_est = self.std_sum_est[rows] + update * update * (sample_count - 1.0) / sample_count
+        self.mean_est[rows] = mean_est
+        self.std_sum_est[rows] = std_sum_est
+
+        # Subtract mean.
+        result = preprocessing_inputs - mean_est
+
+        # Estimate variance via sum of variance.
+        var_estimate = np.where(
+            sample_count > 1.0, std_sum_est / np.maximum(sample_count - 1.0, 1.0), np.square(mean_est)
+        )
+        std = np.sqrt(var_estimate) + SMALL_NUMBER
+
+        standardized = result / std
+        if get_backend() == "pytorch":
+            standardized = torch.Tensor(standardized)
+        return standardized
+
     @rlgraph_api
     def _graph_fn_reset(self):
         if self.backend == "python" or get_backend() == "python" or get_backend() == "pytorch":
-            self.sample_count = 0.0
-            self.mean_est = np.zeros(self.in_shape)
-            self.std_sum_est = np.zeros(self.in_shape)
+            self.create_env_slots(len(self.sample_count))
         elif get_backend() == "tf":
             return tf.variables_initializer([self.sample_count, self.mean_est, self.std_sum_est])
 
     @rlgraph_api
     def _graph_fn_apply(self, preprocessing_inputs):
         if self.backend == "python" or get_backend() == "python" or get_backend() == "pytorch":
-            # https://www.johndcook.com/blog/standard_deviation/
             preprocessing_inputs = np.asarray(preprocessing_inputs, dtype=np.float32)
-            self.sample_count += 1.0
-            if self.sample_count == 1.0:
-                self.mean_est[...] = preprocessing_inputs
-            else:
-                update = preprocessing_inputs - self.mean_est
-                self.mean_est[...] += update / self.sample_count
-                self.std_sum_est[...] += update * update * (self.sample_count - 1.0) / self.sample_count
-
-            # Subtract mean.
-            result = preprocessing_inputs - self.mean_est
-
-            # Estimate variance via sum of variance.
-            if self.sample_count > 1.0:
-                var_estimate = self.std_sum_est / (self.sample_count - 1.0)
-            else:
-                var_estimate = np.square(self.mean_est)
-            std = np.sqrt(var_estimate) + SMALL_NUMBER
-
-            standardized = result / std
-            if get_backend() == "pytorch":
-                standardized = torch.Tensor(standardized)
-            return standardized
+            # Single input without batch rank.
+            if preprocessing_inputs.ndim < len(self.in_shape):
+                preprocessing_inputs = preprocessing_inputs[np.newaxis]
+            # One set of estimates per batch row, sized on first use.
+            if len(preprocessing_inputs) != len(self.sample_count):
+                if np.any(self.sample_count > 0.0):
+                    raise RLGraphError("Batch size changed from {} to {} without a reset.".format(
+                        len(self.sample_count), len(preprocessing_inputs)
+                    ))
+                self.create_env_slots(len(preprocessing_inputs))
+            return self._standardize(preprocessing_inputs, slice(None))
 
         elif get_backend() == "tf":
             assignments = [tf.assign_add(ref=self.sample_count, value=1.0)]
@@ -52,3 +52,27 @@ class PreprocessLayer(Layer):
     @rlgraph_api(flatten_ops=True, split_ops=True)
     def _graph_fn_apply(self, *preprocessing_inputs):
         return super(PreprocessLayer, self)._graph_fn_apply(*preprocessing_inputs)
+
+    def reset_envs(self, env_indices):
+        """
+        Python backend only: Resets the state of single environments, i.e. of the rows `env_indices` of the
+        vectorized batches this preprocessor processes. Stateless preprocessors have nothing to reset.
+
+        Args:
+            env_indices (list): Batch rows to reset.
+        """
+        pass
+
+    def apply_envs(self, preprocessing_inputs, env_indices):
+        """
+        Python backend only: Preprocesses inputs of single environments, updating only the state of their rows
+        `env_indices`. Stateless preprocessors treat the rows as a normal batch.
+
+        Args:
+            preprocessing_inputs (np.ndarray): One input per environment in `env_indices`.
+            env_indices (list): Batch rows of the inputs.
+
+        Returns:
+            np.ndarray: The preprocessed inputs.
+        """
+        return self._graph_fn_apply(preprocessing_inputs)
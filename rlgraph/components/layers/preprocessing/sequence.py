@@ -26,6 +26,7 @@ from rlgraph import get_backend
 from rlgraph.spaces.space_utils import sanity_check_space
 from rlgraph.utils.decorators import rlgraph_api
 from rlgraph.utils.ops import FlattenedDataOp, unflatten_op
+from rlgraph.utils.rlgraph_errors import RLGraphError
 from rlgraph.utils.util import get_rank, get_shape, force_list
 from rlgraph.components.layers.preprocessing import PreprocessLayer
 
@@ -39,10 +40,19 @@ class Sequence(PreprocessLayer):
     """
     Concatenate `length` state vectors. Example: Used in Atari
     problems to create the Markov property (velocity of game objects as they move across the screen).
+
+    With the python backend, each batch row is a separate sequence, so one instance can stack the states of several
+    environments. Single rows can be reset (`reset_envs`) and advanced (`apply_envs`) independently.
+
+    The python backend keeps the sequences in a preallocated ring buffer of shape `(batch, sequence_length) +
+    input_shape` with one write index per row, and copies each slot into the output. With `return_view` (and
+    `add_rank`), the buffer has `2 x sequence_length` slots and each input is written twice, `sequence_length` slots
+    apart, so the last `sequence_length` inputs of a row are always adjacent and the output can be a strided view
+    into the buffer instead of a newly stacked array.
     """
 
     def __init__(self, sequence_length=2, batch_size=1, add_rank=True, in_data_format="channels_last",
-                 out_data_format="channels_last", scope="sequence",  **kwargs):
+                 out_data_format="channels_last", return_view=False, scope="sequence",  **kwargs):
         """
         Args:
             sequence_length (int): The number of records to always concatenate together within the last rank or
@@ -56,6 +66,9 @@ class Sequence(PreprocessLayer):
             add_rank (bool): Whether to add another rank to the end of the input with dim=length-of-the-sequence.
                 If False, concatenates the sequence within the last rank.
                 Default: True.
+            return_view (bool): Python backend with `add_rank`: Whether to return a view into the ring buffer instead
+                of a copy. Views are only valid until the next call and must be copied by callers that keep them.
+                Default: False.
         """
         # Switch off split (it's switched on for all LayerComponents by default).
         # -> accept any Space -> flatten to OrderedDict -> input & return OrderedDict -> re-nest.
@@ -64,6 +77,7 @@ class Sequence(PreprocessLayer):
         self.sequence_length = sequence_length
         self.batch_size = batch_size
         self.add_rank = add_rank
+        self.return_view = return_view
 
         self.in_data_format = in_data_format
         if get_backend() == "pytorch":
@@ -78,7 +92,15 @@ class Sequence(PreprocessLayer):
         self.index = None
         # The output spaces after preprocessing (per flat-key).
         self.output_spaces = None
-        if self.backend == "python" or get_backend() == "python" or get_backend() == "pytorch":
+        if self.backend == "python" or get_backend() == "python":
+            # Python backend: The ring buffer and the index of the last written slot of each batch row.
+            self.ring_buffer = None
+            self.write_indices = None
+            # Whether all batch rows share their write index.
+            self.rows_aligned = True
+            # Batch rows whose sequence is refilled with their next input.
+            self.reset_env_indices = set()
+        elif get_backend() == "pytorch":
             self.deque = deque([], maxlen=self.sequence_length)
 
     def get_preprocessed_space(self, space):
@@ -120,11 +142,131 @@ class Sequence(PreprocessLayer):
 
     @rlgraph_api
     def _graph_fn_reset(self):
-        if self.backend == "python" or get_backend() == "python" or get_backend() == "pytorch":
+        if self.backend == "python" or get_backend() == "python":
+            # Keeps the ring buffer, it is refilled by the next input.
+            self.index = -1
+            self.reset_env_indices.clear()
+        elif get_backend() == "pytorch":
             self.index = -1
         elif get_backend() == "tf":
             return tf.variables_initializer([self.index])
 
+    def reset_envs(self, env_indices):
+        # Nothing to do if the whole sequence gets refilled anyway.
+        if self.index != -1:
+            self.reset_env_indices.update(env_indices)
+
+    def apply_envs(self, preprocessing_inputs, env_indices):
+        if self.index == -1:
+            raise RLGraphError("Sequence must process a full batch before single rows can be advanced.")
+        if self.ring_buffer is None:
+            raise RLGraphError("Single rows can only be advanced with the python backend.")
+        rows = np.asarray(env_indices, dtype=np.int64)
+        preprocessing_inputs = np.asarray(preprocessing_inputs)
+        refill = np.asarray([row in self.reset_env_indices for row in rows.tolist()], dtype=bool)
+        if np.any(refill):
+            self.ring_buffer[rows[refill]] = preprocessing_inputs[refill][:, np.newaxis]
+            self.reset_env_indices.difference_update(rows[refill].tolist())
+        self.rows_aligned = False
+        self._write(rows[~refill], preprocessing_inputs[~refill])
+        return self._read(rows)
+
+    def _fill(self, preprocessing_inputs):
+        """
+        Fills the sequences of all batch rows with their input, (re)allocating the ring buffer if the batch
+        size, shape or dtype of the inputs changed.
+        """
+        num_slots = 2 * self.sequence_length if self.return_view and self.add_rank else self.sequence_length
+        buffer_shape = (len(preprocessing_inputs), num_slots) + preprocessing_inputs.shape[1:]
+        if self.ring_buffer is None or self.ring_buffer.shape != buffer_shape or \
+                self.ring_buffer.dtype != preprocessing_inputs.dtype:
+            self.ring_buffer = np.empty(buffer_shape, dtype=preprocessing_inputs.dtype)
+            self.write_indices = np.zeros(len(preprocessing_inputs), dtype=np.int64)
+        self.ring_buffer[:] = preprocessing_inputs[:, np.newaxis]
+        self.write_indices[:] = 0
+        self.rows_aligned = True
+
+    def _write(self, rows, preprocessing_inputs):
+        """
+        Advances the sequences of the given batch rows by one input each.
+
+        Args:
+            rows (Union[slice, np.ndarray]): The batch rows to advance.
+            preprocessing_inputs (np.ndarray): One input per row.
+        """
+        # Rows usually share their write index, then the inputs are written with one (or two) slice assignments.
+        if self.rows_aligned and isinstance(rows, slice):
+            write_index = (int(self.write_indices[0]) + 1) % self.sequence_length
+            self.write_indices[:] = write_index
+            groups = [(write_index, rows, preprocessing_inputs)]
+        else:
+            write_indices = (self.write_indices[rows] + 1) % self.sequence_length
+            self.write_indices[rows] = write_indices
+            if len(write_indices) == 0:
+                return
+            if (write_indices == write_indices[0]).all():
+                groups = [(write_indices[0], rows, preprocessing_inputs)]
+            else:
+                row_indices = np.arange(len(self.write_indices))[rows]
+                groups = [(write_index, row_indices[write_indices == write_index],
+                           preprocessing_inputs[write_indices == write_index])
+                          for write_index in np.unique(write_indices)]
+        doubled = self.ring_buffer.shape[1] > self.sequence_length
+        for write_index, group_rows, group_inputs in groups:
+            self.ring_buffer[group_rows, write_index] = group_inputs
+            if doubled:
+                self.ring_buffer[group_rows, write_index + self.sequence_length] = group_inputs
+
+    def _read(self, rows):
+        """
+        Returns the sequences of the given batch rows, from oldest to newest input.
+
+        Args:
+            rows (Union[slice, np.ndarray]): The batch rows to read.
+
+        Returns:
+            np.ndarray: A view into the ring buffer if all rows are read, share their write index and
+                `return_view` is True, otherwise a copy.
+        """
+        if self.rows_aligned and isinstance(rows, slice):
+            start = int(self.write_indices[0]) + 1
+            num_rows = len(self.write_indices)
+            aligned = True
+        else:
+            starts = self.write_indices[rows] + 1
+            start = starts[0] if len(starts) > 0 else None
+            num_rows = len(starts)
+            aligned = num_rows > 0 and (starts == start).all()
+        if aligned and isinstance(rows, slice) and self.return_view and self.add_rank:
+            sequence = np.moveaxis(self.ring_buffer[:, start:start + self.sequence_length], 1, -1)
+        else:
+            in_shape = self.ring_buffer.shape[2:]
+            if self.add_rank:
+                out_shape = in_shape + (self.sequence_length,)
+            else:
+                out_shape = in_shape[:-1] + (in_shape[-1] * self.sequence_length,)
+            sequence = np.empty((num_rows,) + out_shape, dtype=self.ring_buffer.dtype)
+            if aligned:
+                groups = [(start, slice(None), rows)]
+            else:
+                row_indices = np.arange(len(self.write_indices))[rows]
+                groups = [(start, starts == start, row_indices[starts == start]) for start in np.unique(starts)]
+            # Copies each slot once, which is faster than a transposing copy of the whole window.
+            for start, group, group_rows in groups:
+                for i in range_(self.sequence_length):
+                    # Add the sequence-rank to the end of our inputs, or concat in the last rank.
+                    if self.add_rank:
+                        sequence_slot = i
+                    else:
+                        sequence_slot = slice(i * in_shape[-1], (i + 1) * in_shape[-1])
+                    sequence[group, ..., sequence_slot] = \
+                        self.ring_buffer[group_rows, (start + i) % self.sequence_length]
+
+        # TODO move into transpose component.
+        if self.in_data_format == "channels_last" and self.out_data_format == "channels_first":
+            sequence = sequence.transpose((0, 3, 2, 1))
+        return sequence
+
     @rlgraph_api(flatten_ops=True, split_ops=False)
     def _graph_fn_apply(self, preprocessing_inputs):
         """
@@ -139,26 +281,8 @@ class Sequence(PreprocessLayer):
         Returns:
             FlattenedDataOp: The FlattenedDataOp holding the sequenced SingleDataOps as values.
         """
-        # A normal (index != -1) assign op.
         if self.backend == "python" or get_backend() == "python":
-            if self.index == -1:
-                for _ in range_(self.sequence_length):
-                    self.deque.append(preprocessing_inputs)
-            else:
-                self.deque.append(preprocessing_inputs)
-            self.index = (self.index + 1) % self.sequence_length
-
-            if self.add_rank:
-                sequence = np.stack(self.deque, axis=-1)
-            # Concat the sequence items in the last rank.
-            else:
-                sequence = np.concatenate(self.deque, axis=-1)
-
-            # TODO move into transpose component.
-            if self.in_data_format == "channels_last" and self.out_data_format == "channels_first":
-                sequence = sequence.transpose((0, 3, 2, 1))
-
-            return sequence
+            return self._sequence_python(preprocessing_inputs)
         elif get_backend() == "pytorch":
             if self.index == -1:
                 for _ in range_(self.sequence_length):
@@ -199,54 +323,85 @@ class Sequence(PreprocessLayer):
 
             return sequence
         elif get_backend() == "tf":
-            # Assigns the input_ into the buffer at the current time index.
-            def normal_assign():
-                assigns = list()
-                for key_, value in preprocessing_inputs.items():
-                    assign_op = self.assign_variable(ref=self.buffer[key_][self.index], value=value)
-                    assigns.append(assign_op)
-                return assigns
-
-            # After a reset (time index is -1), fill the entire buffer with `self.sequence_length` x input_.
-            def after_reset_assign():
-                assigns = list()
-                for key_, value in preprocessing_inputs.items():
-                    multiples = (self.sequence_length,) + tuple([1] * get_rank(value))
-                    input_ = tf.expand_dims(input=value, axis=0)
-                    assign_op = self.assign_variable(
-                        ref=self.buffer[key_], value=tf.tile(input=input_, multiples=multiples)
-                    )
-                    assigns.append(assign_op)
-                return assigns
-
-            # Insert the input at the correct index or fill empty buffer entirely with input.
-            insert_inputs = tf.cond(pred=(self.index >= 0), true_fn=normal_assign, false_fn=after_reset_assign)
-
-            # Make sure the input has been inserted.
-            with tf.control_dependencies(control_inputs=force_list(insert_inputs)):
-                # Then increase index by 1.
-                index_plus_1 = self.assign_variable(ref=self.index, value=((self.index + 1) % self.sequence_length))
-
-            # Then gather the output.
-            with tf.control_dependencies(control_inputs=[index_plus_1]):
-                sequences = FlattenedDataOp()
-                # Collect the correct previous inputs from the buffer to form the output sequence.
-                for key in preprocessing_inputs.keys():
-                    n_in = [self.buffer[key][(self.index + n) % self.sequence_length]
-                            for n in range_(self.sequence_length)]
-
-                    # Add the sequence-rank to the end of our inputs.
-                    if self.add_rank:
-                        sequence = tf.stack(values=n_in, axis=-1)
-                    # Concat the sequence items in the last rank.
-                    else:
-                        sequence = tf.concat(values=n_in, axis=-1)
-
-                    # Must pass the sequence through a placeholder_with_default dummy to set back the
-                    # batch rank to '?', instead of 1 (1 would confuse the auto Space inference).
-                    sequences[key] = tf.placeholder_with_default(
-                        sequence, shape=(None,) + tuple(get_shape(sequence)[1:])
-                    )
-            # TODO implement transpose
-                return sequences
+            return self._sequence_tf(preprocessing_inputs)
 
+    def _sequence_python(self, preprocessing_inputs):
+        """
+        Python backend: Writes a batch of inputs into the ring buffer and returns the sequences.
+        """
+        preprocessing_inputs = np.asarray(preprocessing_inputs)
+        if self.index == -1:
+            self._fill(preprocessing_inputs)
+        else:
+            if len(preprocessing_inputs) != len(self.write_indices):
+                raise RLGraphError("Batch size changed from {} to {} without a reset.".format(
+                    len(self.write_indices), len(preprocessing_inputs)
+                ))
+            self._write(slice(None), preprocessing_inputs)
+            if self.reset_env_indices:
+                rows = np.asarray(sorted(self.reset_env_indices), dtype=np.int64)
+                self.ring_buffer[rows] = preprocessing_inputs[rows][:, np.newaxis]
+                # Refilled rows are aligned with the other rows again.
+                self.write_indices[rows] = (self.index + 1) % self.sequence_length
+                self.rows_aligned = False
+            if not self.rows_aligned:
+                self.rows_aligned = bool((self.write_indices == self.write_indices[0]).all())
+        self.reset_env_indices.clear()
+        self.index = (self.index + 1) % self.sequence_length
+
+        return self._read(slice(None))
+
+    def _sequence_tf(self, preprocessing_inputs):
+        """
+        TF backend: Assigns the inputs into the buffer variables and gathers the sequences.
+        """
+        # Assigns the input_ into the buffer at the current time index.
+        def normal_assign():
+            assigns = list()
+            for key_, value in preprocessing_inputs.items():
+                assign_op = self.assign_variable(ref=self.buffer[key_][self.index], value=value)
+                assigns.append(assign_op)
+            return assigns
+
+        # After a reset (time index is -1), fill the entire buffer with `self.sequence_length` x input_.
+        def after_reset_assign():
+            assigns = list()
+            for key_, value in preprocessing_inputs.items():
+                multiples = (self.sequence_length,) + tuple([1] * get_rank(value))
+                input_ = tf.expand_dims(input=value, axis=0)
+                assign_op = self.assign_variable(
+                    ref=self.buffer[key_], value=tf.tile(input=input_, multiples=multiples)
+                )
+                assigns.append(assign_op)
+            return assigns
+
+        # Insert the input at the correct index or fill empty buffer entirely with input.
+        insert_inputs = tf.cond(pred=(self.index >= 0), true_fn=normal_assign, false_fn=after_reset_assign)
+
+        # Make sure the input has been inserted.
+        with tf.control_dependencies(control_inputs=force_list(insert_inputs)):
+            # Then increase index by 1.
+            index_plus_1 = self.assign_variable(ref=self.index, value=((self.index + 1) % self.sequence_length))
+
+        # Then gather the output.
+        with tf.control_dependencies(control_inputs=[index_plus_1]):
+            sequences = FlattenedDataOp()
+            # Collect the correct previous inputs from the buffer to form the output sequence.
+            for key in preprocessing_inputs.keys():
+                n_in = [self.buffer[key][(self.index + n) % self.sequence_length]
+                        for n in range_(self.sequence_length)]
+
+                # Add the sequence-rank to the end of our inputs.
+                if self.add_rank:
+                    sequence = tf.stack(values=n_in, axis=-1)
+                # Concat the sequence items in the last rank.
+                else:
+                    sequence = tf.concat(values=n_in, axis=-1)
+
+                # Must pass the sequence through a placeholder_with_default dummy to set back the
+                # batch rank to '?', instead of 1 (1 would confuse the auto Space inference).
+                sequences[key] = tf.placeholder_with_default(
+                    sequence, shape=(None,) + tuple(get_shape(sequence)[1:])
+                )
+        # TODO implement transpose
+            return sequences
@@ -20,15 +20,13 @@ from __future__ import print_function
 from collections import OrderedDict
 
 import numpy as np
-import operator
-from six.moves import xrange as range_
 
 from rlgraph import get_backend
 from rlgraph.utils import util
 from rlgraph.utils.execution_util import define_by_run_unflatten
 from rlgraph.utils.util import SMALL_NUMBER, get_rank
 from rlgraph.components.memories.memory import Memory
-from rlgraph.components.helpers.mem_segment_tree import MemSegmentTree, MinSumSegmentTree
+from rlgraph.components.helpers.mem_segment_tree import MinSumSegmentTree
 from rlgraph.utils.decorators import rlgraph_api
 
 if get_backend() == "pytorch":
@@ -42,7 +40,18 @@ class MemPrioritizedReplay(Memory):
     API:
         update_records(indices, update) -> Updates the given indices with the given priority scores.
     """
-    def __init__(self, capacity=1000, next_states=True, alpha=1.0, beta=0.0):
+    def __init__(self, capacity=1000, next_states=True, alpha=1.0, beta=0.0, seed=None):
+        """
+        Args:
+            capacity (int): Max capacity.
+            next_states (bool): Whether to include s' in the return values of the out-Socket "get_records".
+            alpha (float): Degree to which prioritization is applied, 0.0 implies no
+                prioritization (uniform), 1.0 full prioritization.
+            beta (float): Importance weight factor, 0.0 for no importance correction, 1.0
+                for full correction.
+            seed (Optional[int]): Seed for the random generator used for sampling. Fixing it makes sampled
+                batches reproducible across runs.
+        """
         super(MemPrioritizedReplay, self).__init__()
 
         self.memory_values = []
@@ -56,24 +65,13 @@ class MemPrioritizedReplay(Memory):
         self.next_states = next_states
 
         self.default_new_weight = np.power(self.max_priority, self.alpha)
+        self.rng = np.random.default_rng(seed)
 
     def create_variables(self, input_spaces, action_space=None):
         super(MemPrioritizedReplay, self).create_variables(input_spaces, action_space)
-        self.priority_capacity = 1
-        while self.priority_capacity < self.capacity:
-            self.priority_capacity *= 2
-
-        # Create segment trees, initialize with neutral elements.
-        sum_values = [0.0 for _ in range_(2 * self.priority_capacity)]
-        sum_segment_tree = MemSegmentTree(sum_values, self.priority_capacity, operator.add)
-        min_values = [float('inf') for _ in range_(2 * self.priority_capacity)]
-        min_segment_tree = MemSegmentTree(min_values, self.priority_capacity, min)
-
-        self.merged_segment_tree = MinSumSegmentTree(
-            sum_tree=sum_segment_tree,
-            min_tree=min_segment_tree,
-            capacity=self.priority_capacity
-        )
+        # Array-backed sum and min segment trees, initialized with neutral elements.
+        self.merged_segment_tree = MinSumSegmentTree.from_capacity(self.capacity)
+        self.priority_capacity = self.merged_segment_tree.capacity
 
     @rlgraph_api(flatten_ops=True)
     def _graph_fn_insert_records(self, records):
@@ -89,9 +87,11 @@ class MemPrioritizedReplay(Memory):
             self.merged_segment_tree.insert(self.index, self.default_new_weight)
         else:
             insert_indices = np.arange(start=self.index, stop=self.index + num_records) % self.capacity
+            self.merged_segment_tree.insert_batch(
+                insert_indices, np.full(shape=(num_records,), fill_value=self.default_new_weight)
+            )
             i = 0
             for insert_index in insert_indices:
-                self.merged_segment_tree.insert(insert_index, self.default_new_weight)
                 record = dict()
                 for name, record_values in records.items():
                     record[name] = record_values[i]
@@ -107,28 +107,27 @@ class MemPrioritizedReplay(Memory):
 
     @rlgraph_api
     def _graph_fn_get_records(self, num_records=1):
-        available_records = min(num_records, self.size)
-        indices = []
-        prob_sum = self.merged_segment_tree.sum_segment_tree.get_sum(0, self.size - 1)
-        samples = np.random.random(size=(available_records,)) * prob_sum
-        for sample in samples:
-            indices.append(self.merged_segment_tree.sum_segment_tree.index_of_prefixsum(prefix_sum=sample))
-
-        sum_prob = self.merged_segment_tree.sum_segment_tree.get_sum() + SMALL_NUMBER
+        # May be passed in as a (0D) tensor.
+        available_records = min(int(num_records), self.size)
+        sum_segment_tree = self.merged_segment_tree.sum_segment_tree
+
+        # Stratified sampling: Split the total priority mass into `available_records` segments
+        # and draw one sample uniformly from each.
+        prob_sum = sum_segment_tree.get_sum(0, self.size)
+        segment_size = prob_sum / max(available_records, 1)
+        samples = (np.arange(available_records) + self.rng.random(size=(available_records,))) * segment_size
+        # Guard against float round-off walking into empty slots.
+        indices = np.minimum(self.merged_segment_tree.find_prefixsum_batch(samples), self.size - 1)
+
+        sum_prob = sum_segment_tree.get_sum() + SMALL_NUMBER
         min_prob = self.merged_segment_tree.min_segment_tree.get_min_value() / sum_prob
         max_weight = (min_prob * self.size) ** (-self.beta)
-        weights = []
-        for index in indices:
-            sample_prob = self.merged_segment_tree.sum_segment_tree.get(index) / sum_prob
-            weight = (sample_prob * self.size) ** (-self.beta)
-            weights.append(weight / max_weight)
+        sample_probs = sum_segment_tree.values[indices + self.priority_capacity] / sum_prob
+        weights = np.power(sample_probs * self.size, -self.beta) / max_weight
 
         if get_backend() == "pytorch":
             indices = torch.tensor(indices)
             weights = torch.tensor(weights)
-        else:
-            indices = np.asarray(indices)
-            weights = np.asarray(weights)
 
         records = OrderedDict()
         for name, variable in self.record_registry.items():
@@ -139,8 +138,34 @@ class MemPrioritizedReplay(Memory):
 
     @rlgraph_api(must_be_complete=False)
     def _graph_fn_update_records(self, indices, update):
-        for index, loss in zip(indices, update):
-            priority = np.power(loss, self.alpha)
-            self.merged_segment_tree.insert(index, priority)
-            self.max_priority = max(self.max_priority, priority)
+        priorities = np.power(np.asarray(update, dtype=np.float64), self.alpha)
+        self.merged_segment_tree.insert_batch(indices, priorities)
+        self.max_priority = np.max(priorities, initial=self.max_priority)
+
+    def get_checkpoint_state(self):
+        state = dict(
+            sum_tree=self.merged_segment_tree.sum_segment_tree.values,
+            min_tree=self.merged_segment_tree.min_segment_tree.values,
+            index=np.asarray(self.index),
+            size=np.asarray(self.size),
+            max_priority=np.asarray(self.max_priority)
+        )
+        # Per-record dicts are stored as one column per record key.
+        if len(self.memory_values) > 0:
+            for name in self.memory_values[0].keys():
+                state["memory-values/" + name] = np.stack(
+                    [np.asarray(record[name]) for record in self.memory_values]
+                )
+        return state
+
+    def set_checkpoint_state(self, state):
+        self.merged_segment_tree.sum_segment_tree.values[:] = state["sum_tree"]
+        self.merged_segment_tree.min_segment_tree.values[:] = state["min_tree"]
+        self.index = int(state["index"])
+        self.size = int(state["size"])
+        self.max_priority = float(state["max_priority"])
+        columns = {name[len("memory-values/"):]: column for name, column in state.items()
+                   if name.startswith("memory-values/")}
+        num_values = len(next(iter(columns.values()))) if len(columns) > 0 else 0
+        self.memory_values = [{name: column[i] for name, column in columns.items()} for i in range(num_values)]
 
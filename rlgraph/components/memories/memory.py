@@ -17,8 +17,15 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+from collections import OrderedDict
+
+from rlgraph import get_backend
 from rlgraph.components.component import Component, rlgraph_api
-from rlgraph.utils import FlattenedDataOp
+from rlgraph.utils import FlattenedDataOp, util
+from rlgraph.utils.ops import TraceContext
+
+if get_backend() == "pytorch":
+    import torch
 
 
 class Memory(Component):
@@ -60,6 +67,70 @@ class Memory(Component):
         # Number of elements present.
         self.size = self.get_variable(name="size", dtype=int, trainable=False, initializer=0)
 
+    def _create_pytorch_record_buffers(self):
+        """
+        Replaces the Python list storage of each record key with a preallocated tensor of shape
+        [capacity] + record shape, so records can be written via slice assignment and read via `index_select`
+        instead of one Python call per record.
+        """
+        for name, space in self.flat_record_space.items():
+            # Spaces inferred from define-by-run ops keep the batch dimension in their shape.
+            shape = tuple(space.shape) if space.has_batch_rank else tuple(space.shape[1:])
+            buffer = torch.zeros(
+                size=(self.capacity,) + shape, dtype=util.convert_dtype(space.dtype, to="pytorch")
+            )
+            previous = self.record_registry[name]
+            self.record_registry[name] = buffer
+            for key, variable in self.variable_registry.items():
+                if variable is previous:
+                    self.variable_registry[key] = buffer
+
+    def _write_pytorch_records(self, records, num_records):
+        """
+        Writes a batch of records into the preallocated record tensors starting at `self.index`. Contiguous
+        inserts take a single slice assignment, inserts wrapping around at capacity take two.
+
+        Args:
+            records (dict): Flat record dict mapping keys to batched values.
+            num_records (int): Number of records in the batch.
+
+        Returns:
+            int: The new index.
+        """
+        # Only the last `capacity` records survive a larger insert.
+        offset = max(0, num_records - self.capacity)
+        start = (self.index + offset) % self.capacity
+        end = start + num_records - offset
+        for key, buffer in self.record_registry.items():
+            values = torch.as_tensor(records[key], dtype=buffer.dtype)[offset:]
+            if end <= self.capacity:
+                buffer[start:end] = values
+            else:
+                split = self.capacity - start
+                buffer[start:] = values[:split]
+                buffer[:end - self.capacity] = values[split:]
+        return end % self.capacity
+
+    def _read_pytorch_records(self, start, num_records):
+        """
+        Reads `num_records` contiguous records starting at buffer position `start` (wrapping around at capacity)
+        from the preallocated record tensors.
+
+        Returns:
+            OrderedDict: Flat record dict.
+        """
+        end = start + num_records
+        records = OrderedDict()
+        for name, buffer in self.record_registry.items():
+            # Placeholder values while tracing an empty memory.
+            if num_records == 0 and TraceContext.DEFINE_BY_RUN_CONTEXT == "building":
+                records[name] = torch.zeros(self.flat_record_space[name].shape, dtype=buffer.dtype)
+            elif end <= self.capacity:
+                records[name] = buffer[start:end].clone()
+            else:
+                records[name] = torch.cat([buffer[start:], buffer[:end - self.capacity]])
+        return records
+
     @rlgraph_api(flatten_ops=True)
     def _graph_fn_insert_records(self, records):
         """
@@ -105,6 +176,25 @@ class Memory(Component):
         # Optional?
         pass
 
+    def get_checkpoint_state(self):
+        """
+        Returns state kept outside of the variable registry (e.g. in plain attributes of define-by-run
+        memories), which `Agent.store_memory` stores alongside the memory variables.
+
+        Returns:
+            dict: Arrays by name.
+        """
+        return {}
+
+    def set_checkpoint_state(self, state):
+        """
+        Restores state returned by `get_checkpoint_state`.
+
+        Args:
+            state (dict): Arrays by name.
+        """
+        pass
+
     def _read_records(self, indices):
         """
         Obtains record values for the provided indices.
@@ -61,6 +61,8 @@ class ReplayMemory(Memory):
         assert 'terminals' in self.record_space
         # Main buffer index.
         self.index = self.get_variable(name="index", dtype=int, trainable=False, initializer=0)
+        if get_backend() == "pytorch":
+            self._create_pytorch_record_buffers()
 
     @rlgraph_api(flatten_ops=True)
     def _graph_fn_insert_records(self, records):
@@ -89,11 +91,7 @@ class ReplayMemory(Memory):
             with tf.control_dependencies(control_inputs=index_updates):
                 return tf.no_op()
         elif get_backend() == "pytorch":
-            update_indices = torch.arange(self.index, self.index + num_records) % self.capacity
-            for key in self.record_registry:
-                for i, val in zip(update_indices, records[key]):
-                    self.record_registry[key][i] = val
-            self.index = (self.index + num_records) % self.capacity
+            self.index = self._write_pytorch_records(records, num_records)
             self.size = min(self.size + num_records, self.capacity)
             return None
 
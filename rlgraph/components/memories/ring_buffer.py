@@ -17,20 +17,16 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from collections import OrderedDict
+import numpy as np
 
 from rlgraph import get_backend
 from rlgraph.components.memories.memory import Memory
-from rlgraph.utils import util
 from rlgraph.utils.execution_util import define_by_run_unflatten
 from rlgraph.utils.util import get_batch_size
 from rlgraph.utils.decorators import rlgraph_api
 
 if get_backend() == "tf":
     import tensorflow as tf
-elif get_backend() == "pytorch":
-    import numpy as np
-    import torch
 
 
 class RingBuffer(Memory):
@@ -49,6 +45,9 @@ class RingBuffer(Memory):
         self.num_episodes = None
         self.episode_indices = None
         self.flat_record_space = None
+        # PyTorch: Ring position of the oldest episode end and total number of inserted records.
+        self.episode_head = None
+        self.num_inserted = None
 
     def create_variables(self, input_spaces, action_space=None):
         super(RingBuffer, self).create_variables(input_spaces, action_space)
@@ -62,6 +61,13 @@ class RingBuffer(Memory):
         # Terminal indices contiguously arranged.
         self.episode_indices = self.get_variable(name="episode-indices", shape=(self.capacity,),
                                                  dtype=int, trainable=False)
+        if get_backend() == "pytorch":
+            self._create_pytorch_record_buffers()
+            # Circular deque of episode ends, stored as absolute record counts in insertion order. Buffer
+            # positions are counts modulo capacity.
+            self.episode_indices = np.zeros(shape=(self.capacity,), dtype=np.int64)
+            self.episode_head = 0
+            self.num_inserted = 0
 
     @rlgraph_api(flatten_ops=True)
     def _graph_fn_insert_records(self, records):
@@ -135,41 +141,21 @@ class RingBuffer(Memory):
             with tf.control_dependencies(control_inputs=record_updates):
                 return tf.no_op()
         elif get_backend() == "pytorch":
-            # TODO: Unclear if we should do this in numpy and then convert to torch once we sample.
             num_records = get_batch_size(records["terminals"])
-            update_indices = torch.arange(self.index, self.index + num_records) % self.capacity
+            terminals = np.asarray(records["terminals"], dtype=bool).reshape(-1)
+            num_inserted = self.num_inserted + num_records
+            # Records older than this are overwritten by the insert.
+            oldest_remaining = num_inserted - self.capacity
 
-            # Newly inserted episodes.
-            inserted_episodes = torch.sum(records['terminals'].int(), 0)
-
-            # Episodes previously existing in the range we inserted to as indicated
-            # by count of terminals in the that slice.
-            episodes_in_insert_range = 0
-            # Count terminals in inserted range.
-            for index in update_indices:
-                episodes_in_insert_range += int(self.record_registry["terminals"][index])
-            num_episode_update = self.num_episodes - episodes_in_insert_range + inserted_episodes
-            self.episode_indices[:self.num_episodes - episodes_in_insert_range] = \
-                self.episode_indices[episodes_in_insert_range:self.num_episodes]
-
-            # Insert new episodes starting at previous count minus the ones we removed,
-            # ending at previous count minus removed + inserted.
-            slice_start = self.num_episodes - episodes_in_insert_range
-            slice_end = num_episode_update
-
-            byte_terminals = records["terminals"].byte()
-            mask = torch.masked_select(update_indices, byte_terminals)
-            self.episode_indices[slice_start:slice_end] = mask
-
-            # Update indices.
-            self.num_episodes = int(num_episode_update)
-            self.index = (self.index + num_records) % self.capacity
-            self.size = min(self.size + num_records, self.capacity)
+            # Pop episodes whose ends are overwritten, then push the new ends.
+            self._pop_episode_ends(oldest_remaining)
+            new_ends = self.num_inserted + np.flatnonzero(terminals)
+            self._push_episode_ends(new_ends[new_ends >= oldest_remaining])
 
             # Updates all the necessary sub-variables in the record.
-            for key in self.record_registry:
-                for i, val in zip(update_indices, records[key]):
-                    self.record_registry[key][i] = val
+            self.index = self._write_pytorch_records(records, num_records)
+            self.num_inserted = num_inserted
+            self.size = min(self.size + num_records, self.capacity)
 
             # The TF version returns no-op, return None so return-val inference system does not throw error.
             return None
@@ -184,14 +170,8 @@ class RingBuffer(Memory):
             return self._read_records(indices=indices)
         elif get_backend() == "pytorch":
             available_records = min(num_records, self.size)
-            indices = np.arange(self.index - available_records, self.index) % self.capacity
-            records = OrderedDict()
-
-            for name, variable in self.record_registry.items():
-                records[name] = self.read_variable(variable, indices, dtype=
-                                                   util.convert_dtype(self.flat_record_space[name].dtype, to="pytorch"),
-                                                   shape=self.flat_record_space[name].shape)
-
+            # Most recent records are contiguous (modulo wrap-around) -> read slices.
+            records = self._read_pytorch_records((self.index - available_records) % self.capacity, available_records)
             records = define_by_run_unflatten(records)
             return records
 
@@ -222,24 +202,70 @@ class RingBuffer(Memory):
             indices = tf.range(start=start, limit=limit + 1) % self.capacity
             return self._read_records(indices=indices)
         elif get_backend() == "pytorch":
-            stored_episodes = self.num_episodes
             available_episodes = min(num_episodes, self.num_episodes)
+            if available_episodes == 0:
+                return define_by_run_unflatten(self._read_pytorch_records(self.index, 0))
 
-            if stored_episodes == available_episodes:
-                start = 0
+            if available_episodes == self.num_episodes:
+                # Everything from the oldest stored record on.
+                start = self.num_inserted - self.size
             else:
-                start = self.episode_indices[stored_episodes - available_episodes - 1] + 1
+                start = self._episode_end(self.num_episodes - available_episodes - 1) + 1
+            # End is the most recent episode end.
+            limit = self._episode_end(self.num_episodes - 1)
 
-            # End index is just the pointer to the most recent episode.
-            limit = self.episode_indices[stored_episodes - 1]
-            if start >= limit:
-                limit += self.capacity - 1
-            indices = torch.arange(start, limit + 1) % self.capacity
-
-            records = OrderedDict()
-            for name, variable in self.record_registry.items():
-                records[name] = self.read_variable(variable, indices, dtype=
-                                                   util.convert_dtype(self.flat_record_space[name].dtype, to="pytorch"),
-                                                   shape=self.flat_record_space[name].shape)
+            records = self._read_pytorch_records(start % self.capacity, limit + 1 - start)
             records = define_by_run_unflatten(records)
             return records
+
+    def get_checkpoint_state(self):
+        if get_backend() != "pytorch":
+            return {}
+        # The episode deque replaces the registered episode variables.
+        return dict(
+            episode_indices=self.episode_indices,
+            episode_head=np.asarray(self.episode_head),
+            num_episodes=np.asarray(self.num_episodes),
+            num_inserted=np.asarray(self.num_inserted)
+        )
+
+    def set_checkpoint_state(self, state):
+        if get_backend() != "pytorch":
+            return
+        self.episode_indices[:] = state["episode_indices"]
+        self.episode_head = int(state["episode_head"])
+        self.num_episodes = int(state["num_episodes"])
+        self.num_inserted = int(state["num_inserted"])
+
+    def _episode_end(self, episode):
+        """
+        Returns the absolute end of the `episode`-th stored episode (0 is the oldest).
+        """
+        return int(self.episode_indices[(self.episode_head + episode) % self.capacity])
+
+    def _pop_episode_ends(self, oldest_remaining):
+        """
+        Removes all episodes ending before record count `oldest_remaining` from the front of the deque. Ends are
+        sorted, so the number of removed episodes is found by binary search over the (at most two) contiguous
+        segments of the deque.
+        """
+        if self.num_episodes == 0:
+            return
+        end = self.episode_head + self.num_episodes
+        first_segment = self.episode_indices[self.episode_head:min(end, self.capacity)]
+        num_removed = int(np.searchsorted(first_segment, oldest_remaining))
+        if num_removed == len(first_segment) and end > self.capacity:
+            num_removed += int(np.searchsorted(self.episode_indices[:end - self.capacity], oldest_remaining))
+        self.episode_head = (self.episode_head + num_removed) % self.capacity
+        self.num_episodes -= num_removed
+
+    def _push_episode_ends(self, episode_ends):
+        """
+        Appends episode ends to the back of the deque.
+        """
+        num_ends = len(episode_ends)
+        tail = (self.episode_head + self.num_episodes) % self.capacity
+        split = min(num_ends, self.capacity - tail)
+        self.episode_indices[tail:tail + split] = episode_ends[:split]
+        self.episode_indices[:num_ends - split] = episode_ends[split:]
+        self.num_episodes += num_ends
@@ -22,6 +22,7 @@ from rlgraph.components.layers.preprocessing import PreprocessLayer
 from rlgraph.utils.util import default_dict
 from rlgraph.components.neural_networks.stack import Stack
 from rlgraph.utils.decorators import rlgraph_api, graph_fn
+from rlgraph.utils.rlgraph_errors import RLGraphError
 
 if get_backend() == "tf":
     import tensorflow as tf
@@ -35,7 +36,11 @@ class PreprocessorStack(Stack):
 
     API:
         preprocess(input\_): Outputs the preprocessed input after sending it through all sub-Components of this Stack.
-        reset(): An op to trigger all PreprocessorLayers of this Stack to be reset.
+        reset(env_indices=None): An op to trigger all PreprocessorLayers of this Stack to be reset. With the python
+            backend, `env_indices` resets only the state of these batch rows (environments).
+
+    With the python backend, one stack can preprocess the states of all environments of a worker as one batch,
+    stateful layers keep one state per batch row.
     """
     def __init__(self, *preprocessors, **kwargs):
         """
@@ -59,15 +64,20 @@ class PreprocessorStack(Stack):
         super(PreprocessorStack, self).__init__(*preprocessors, **kwargs)
 
     @rlgraph_api
-    def reset(self):
+    def reset(self, env_indices=None):
         # TODO: python-Components: For now, we call each preprocessor's graph_fn directly.
         if self.backend == "python" or get_backend() == "python":
             for preprocess_layer in self.sub_components.values():  # type: PreprocessLayer
                 if preprocess_layer.scope in ["time-rank-folder_", "time-rank-unfolder_"]:
                     continue
-                preprocess_layer._graph_fn_reset()
+                if env_indices is None:
+                    preprocess_layer._graph_fn_reset()
+                else:
+                    preprocess_layer.reset_envs(env_indices)
 
         elif get_backend() == "tf":
+            if env_indices is not None:
+                raise RLGraphError("Resetting single environments is only supported by python preprocessor stacks.")
             # Connect each pre-processor's "reset" output op via our graph_fn into one op.
             resets = list()
             for preprocess_layer in self.sub_components.values():  # type: PreprocessLayer
@@ -83,6 +93,24 @@ class PreprocessorStack(Stack):
             with tf.control_dependencies(preprocessor_resets):
                 return tf.no_op()
 
+    def preprocess_envs(self, preprocessing_inputs, env_indices):
+        """
+        Python backend only: Preprocesses the states of single environments, advancing only the state of their
+        batch rows `env_indices` (e.g. after resetting them).
+
+        Args:
+            preprocessing_inputs (np.ndarray): One state per environment in `env_indices`.
+            env_indices (list): Batch rows of the states.
+
+        Returns:
+            np.ndarray: The preprocessed states.
+        """
+        for preprocess_layer in self.sub_components.values():  # type: PreprocessLayer
+            if preprocess_layer.scope in ["time-rank-folder_", "time-rank-unfolder_"]:
+                continue
+            preprocessing_inputs = preprocess_layer.apply_envs(preprocessing_inputs, env_indices)
+        return preprocessing_inputs
+
     def get_preprocessed_space(self, space):
         """
         Returns the Space obtained after pushing the input through all layers of this Stack.
@@ -25,6 +25,7 @@ from rlgraph.environments.openai_gym import OpenAIGymEnv
 from rlgraph.environments.random_env import RandomEnv
 from rlgraph.environments.vector_env import VectorEnv
 from rlgraph.environments.sequential_vector_env import SequentialVectorEnv
+from rlgraph.environments.parallel_vector_env import ParallelVectorEnv
 
 
 Environment.__lookup_classes__ = dict(
@@ -37,6 +38,8 @@ Environment.__lookup_classes__ = dict(
     openai=OpenAIGymEnv,
     openaigymenv=OpenAIGymEnv,
     openaigym=OpenAIGymEnv,
+    parallelvector=ParallelVectorEnv,
+    parallelvectorenv=ParallelVectorEnv,
     randomenv=RandomEnv,
     random=RandomEnv,
     sequentialvector=SequentialVectorEnv,
@@ -0,0 +1,348 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import deque
+import multiprocessing
+from multiprocessing import connection
+import time
+import traceback
+import weakref
+
+import numpy as np
+from six.moves import xrange as range_
+
+from rlgraph.environments import Environment, VectorEnv
+from rlgraph.spaces import ContainerSpace
+from rlgraph.utils import util
+from rlgraph.utils.rlgraph_errors import RLGraphError
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
+
+
+def _build_env(env_spec):
+    if isinstance(env_spec, dict):
+        return Environment.from_spec(env_spec)
+    elif hasattr(env_spec, '__call__'):
+        return env_spec()
+    raise ValueError("Env_spec must be either a dict containing an environment spec or a callable"
+                     "returning a new environment object.")
+
+
+def _run_env_group(env_spec, env_indices, pipe):
+    """
+    Main loop of an environment process. Steps the environments `env_indices` on commands received via `pipe` and
+    writes their states into the shared state buffers. Replies ("ok", result) or ("error", traceback).
+    """
+    try:
+        environments = [_build_env(env_spec) for _ in env_indices]
+        pipe.send(("ok", (environments[0].state_space, environments[0].action_space)))
+        block_name, buffers_shape, dtype = pipe.recv()
+        block = shared_memory.SharedMemory(name=block_name)
+        state_buffers = np.ndarray(shape=buffers_shape, dtype=dtype, buffer=block.buf)
+        state_shape = buffers_shape[2:]
+    except (EOFError, OSError):
+        # The parent exited during setup.
+        return
+    except Exception:
+        pipe.send(("error", traceback.format_exc()))
+        return
+
+    while True:
+        try:
+            command, args = pipe.recv()
+        except (EOFError, OSError):
+            # The parent exited without terminating the environments.
+            for env in environments:
+                env.terminate()
+            del state_buffers
+            block.close()
+            return
+        try:
+            # Steps and resets apply to the given group indices, None for all environments of the group.
+            if command == "step":
+                buffer_index, group_indices, actions = args
+                rewards, terminals, infos = [], [], []
+                if group_indices is None:
+                    group_indices = range_(len(environments))
+                for group_index, action in zip(group_indices, actions):
+                    state, reward, terminal, info = environments[group_index].step(action)
+                    state_buffers[buffer_index, env_indices[group_index]] = np.reshape(state, state_shape)
+                    rewards.append(reward)
+                    terminals.append(terminal)
+                    infos.append(info)
+                result = (rewards, terminals, infos)
+            elif command == "reset_envs":
+                buffer_index, group_indices = args
+                if group_indices is None:
+                    group_indices = range_(len(environments))
+                for group_index in group_indices:
+                    state = environments[group_index].reset()
+                    state_buffers[buffer_index, env_indices[group_index]] = np.reshape(state, state_shape)
+                result = None
+            elif command == "reset":
+                result = np.reshape(environments[args].reset(), state_shape)
+            elif command == "seed":
+                result = [env.seed(args) for env in environments]
+            elif command == "render":
+                result = environments[0].render()
+            elif command == "terminate":
+                for env in environments:
+                    env.terminate()
+                break
+            pipe.send(("ok", result))
+        except Exception:
+            pipe.send(("error", traceback.format_exc()))
+    del state_buffers
+    block.close()
+    pipe.send(("ok", None))
+
+
+def _release_block(block):
+    """
+    Unlinks and closes a shared memory block. Views into the block may still be alive, then the mapping is freed
+    once they are garbage collected.
+    """
+    try:
+        block.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        block.close()
+    except BufferError:
+        pass
+
+
+class ParallelVectorEnv(VectorEnv):
+    """
+    Multi-environment class which steps groups of environments in parallel worker processes.
+
+    Workers write states directly into a shared memory array of shape `(num_envs,) + state_shape`, only actions,
+    rewards, terminals and infos pass through pipes (one command per worker and step). `step` returns views of this
+    array instead of lists of states. The array is double-buffered: States returned by a step stay valid until the
+    step after next. `reset_all` returns a copy, as callers usually keep reset states across steps.
+
+    Asynchronous steps (`send` / `recv`) write into a third buffer. Environments sent together to one process
+    finish together, as each process works off its commands in order. Synchronous calls discard pending
+    asynchronous results.
+    """
+    ASYNC_BUFFER = 2
+
+    def __init__(self, num_envs, env_spec, num_processes=None, start_method="spawn"):
+        """
+        Args:
+            num_envs (int): Number of environments.
+            env_spec (Union[callable, dict]): Environment spec dict, or a picklable callable returning a new
+                environment.
+            num_processes (Optional[int]): Number of worker processes, environments are split evenly over them.
+                Defaults to one process per environment.
+            start_method (str): Multiprocessing start method. Spawning is the default, as forking a process
+                which holds a TF session is unsafe.
+        """
+        if shared_memory is None:
+            raise RLGraphError("ParallelVectorEnv requires multiprocessing.shared_memory (Python 3.8+).")
+        self.num_envs = num_envs
+        # Environments only exist in the worker processes.
+        self.environments = []
+        self.env_groups = [group for group in np.array_split(np.arange(num_envs), num_processes or num_envs)
+                           if len(group) > 0]
+        # Worker index and index within the worker's group of each environment.
+        self.env_locations = [(worker_index, group_index) for worker_index, env_indices in enumerate(self.env_groups)
+                              for group_index in range_(len(env_indices))]
+
+        # Workers share the resource tracker of this process, which unlinks the shared buffers if it dies.
+        resource_tracker.ensure_running()
+        context = multiprocessing.get_context(start_method)
+        self.pipes = []
+        self.processes = []
+        for env_indices in self.env_groups:
+            pipe, worker_pipe = context.Pipe()
+            process = context.Process(target=_run_env_group, args=(env_spec, list(env_indices), worker_pipe))
+            process.daemon = True
+            process.start()
+            worker_pipe.close()
+            self.pipes.append(pipe)
+            self.processes.append(process)
+        # Per worker: Environment indices and whether it was a reset, for each asynchronous command in flight.
+        self.pending_commands = [deque() for _ in self.pipes]
+
+        state_space, action_space = [self._receive(pipe) for pipe in self.pipes][0]
+        super(VectorEnv, self).__init__(state_space=state_space, action_space=action_space)
+        if isinstance(self.state_space, ContainerSpace):
+            raise RLGraphError("ParallelVectorEnv does not support container state spaces.")
+
+        dtype = np.dtype(util.convert_dtype(self.state_space.dtype, to="np"))
+        # Two buffers for synchronous steps, one for asynchronous steps.
+        buffers_shape = (3, num_envs) + tuple(self.state_space.shape)
+        self.block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(buffers_shape)) * dtype.itemsize))
+        self.state_buffers = np.ndarray(shape=buffers_shape, dtype=dtype, buffer=self.block.buf)
+        # Frees the block on `terminate`, or at interpreter exit if `terminate` is never called.
+        self.release_block = weakref.finalize(self, _release_block, self.block)
+        self.buffer_index = 0
+        for pipe in self.pipes:
+            pipe.send((self.block.name, buffers_shape, dtype))
+
+    @staticmethod
+    def _receive(pipe):
+        status, result = pipe.recv()
+        if status == "error":
+            raise RLGraphError("Environment process failed:\n{}".format(result))
+        return result
+
+    def _locate(self, index):
+        """
+        Returns:
+            tuple: Worker index and index within the worker's group of an environment.
+        """
+        if not 0 <= index < self.num_envs:
+            raise RLGraphError("Environment index {} out of range for {} environments.".format(index, self.num_envs))
+        return self.env_locations[index]
+
+    def _next_buffer(self):
+        self.buffer_index = 1 - self.buffer_index
+        return self.buffer_index
+
+    def _discard_pending(self):
+        for pipe, pending_commands in zip(self.pipes, self.pending_commands):
+            while pending_commands:
+                pending_commands.popleft()
+                self._receive(pipe)
+
+    def _send_async(self, command, env_ids, actions=None):
+        # Groups the environments by worker, one command per worker.
+        worker_commands = {}
+        for i, env_id in enumerate(env_ids):
+            worker_index, group_index = self._locate(env_id)
+            ids, group_indices, group_actions = worker_commands.setdefault(worker_index, ([], [], []))
+            ids.append(env_id)
+            group_indices.append(group_index)
+            if actions is not None:
+                group_actions.append(actions[i])
+        for worker_index, (ids, group_indices, group_actions) in worker_commands.items():
+            if command == "step":
+                args = (self.ASYNC_BUFFER, group_indices, group_actions)
+            else:
+                args = (self.ASYNC_BUFFER, group_indices)
+            self.pipes[worker_index].send((command, args))
+            self.pending_commands[worker_index].append((ids, command == "reset_envs"))
+
+    def send(self, actions, env_ids=None):
+        if env_ids is None:
+            env_ids = range_(self.num_envs)
+        self._send_async("step", env_ids, actions)
+
+    def send_reset(self, env_ids):
+        self._send_async("reset_envs", env_ids)
+
+    def recv(self, min_ready=1, timeout=None):
+        env_ids, rewards, terminals, infos = [], [], [], []
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            pending_pipes = [pipe for pipe, pending_commands in zip(self.pipes, self.pending_commands)
+                             if pending_commands]
+            if not pending_pipes:
+                break
+            # Once enough results are in, only collect the ones already available.
+            if len(env_ids) >= min_ready:
+                wait_timeout = 0
+            elif deadline is None:
+                wait_timeout = None
+            else:
+                wait_timeout = max(deadline - time.monotonic(), 0)
+            ready_pipes = connection.wait(pending_pipes, timeout=wait_timeout)
+            if not ready_pipes:
+                break
+            for pipe in ready_pipes:
+                worker_index = self.pipes.index(pipe)
+                ids, is_reset = self.pending_commands[worker_index].popleft()
+                result = self._receive(pipe)
+                env_ids.extend(ids)
+                if is_reset:
+                    rewards.extend([0.0] * len(ids))
+                    terminals.extend([False] * len(ids))
+                    infos.extend([None] * len(ids))
+                else:
+                    rewards.extend(result[0])
+                    terminals.extend(result[1])
+                    infos.extend(result[2])
+        # Copy the finished rows, the worker processes may write other rows of the buffer meanwhile.
+        return env_ids, self.state_buffers[self.ASYNC_BUFFER][env_ids], rewards, terminals, infos
+
+    def get_env(self):
+        # Environments only exist in the worker processes.
+        return None
+
+    def render(self):
+        self._discard_pending()
+        self.pipes[0].send(("render", None))
+        self._receive(self.pipes[0])
+
+    def seed(self, seed=None):
+        self._discard_pending()
+        for pipe in self.pipes:
+            pipe.send(("seed", seed))
+        return [env_seed for pipe in self.pipes for env_seed in self._receive(pipe)]
+
+    def reset_all(self):
+        self._discard_pending()
+        buffer_index = self._next_buffer()
+        for pipe in self.pipes:
+            pipe.send(("reset_envs", (buffer_index, None)))
+        for pipe in self.pipes:
+            self._receive(pipe)
+        return np.array(self.state_buffers[buffer_index])
+
+    def reset(self, index=0):
+        self._discard_pending()
+        worker_index, group_index = self._locate(index)
+        self.pipes[worker_index].send(("reset", group_index))
+        return self._receive(self.pipes[worker_index])
+
+    def step(self, actions):
+        self._discard_pending()
+        buffer_index = self._next_buffer()
+        for pipe, env_indices in zip(self.pipes, self.env_groups):
+            pipe.send(("step", (buffer_index, None, [actions[i] for i in env_indices])))
+        rewards, terminals, infos = [], [], []
+        for pipe in self.pipes:
+            group_rewards, group_terminals, group_infos = self._receive(pipe)
+            rewards.extend(group_rewards)
+            terminals.extend(group_terminals)
+            infos.extend(group_infos)
+        return self.state_buffers[buffer_index], rewards, terminals, infos
+
+    def terminate(self):
+        """
+        Terminates all environments and worker processes and frees the shared state buffers.
+        """
+        self._discard_pending()
+        for pipe in self.pipes:
+            pipe.send(("terminate", None))
+        for pipe, process in zip(self.pipes, self.processes):
+            self._receive(pipe)
+            process.join()
+        self.pipes = []
+        self.processes = []
+        self.state_buffers = None
+        self.release_block()
+
+    def __str__(self):
+        return "ParallelVectorEnv({} environments in {} processes)".format(self.num_envs, len(self.env_groups))
@@ -46,6 +46,8 @@ class SequentialVectorEnv(VectorEnv):
         return [env.seed(seed) for env in self.environments]
 
     def reset_all(self):
+        # Discard pending asynchronous results.
+        self.ready_results = []
         states = []
         for i, env in enumerate(self.environments):
             state, env = self.resetter.swap(self.environments[i])
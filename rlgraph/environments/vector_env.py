@@ -26,6 +26,10 @@ class VectorEnv(Environment):
     """
     Abstract multi-environment class to support stepping multiple environments
     at once.
+
+    Besides lockstep `step` calls, environments can be stepped asynchronously: `send` starts steps of some
+    environments, `recv` returns the results of whichever environments have finished, so one slow environment does
+    not stall the others.
     """
     def __init__(self, num_envs, env_spec):
         """
@@ -45,6 +49,8 @@ class VectorEnv(Environment):
                 raise ValueError("Env_spec must be either a dict containing an environment spec or a callable"
                                  "returning a new environment object.")
             self.environments.append(env)
+        # Results of asynchronous steps and resets not yet returned by `recv`.
+        self.ready_results = []
         super(VectorEnv, self).__init__(state_space=self.environments[0].state_space,
                                         action_space=self.environments[0].action_space)
 
@@ -64,7 +70,7 @@ class VectorEnv(Environment):
 
     def reset_all(self):
         """
-        Resets all environments.
+        Resets all environments. Pending asynchronous results are discarded.
 
         Returns:
             any: New states for environments.
@@ -92,5 +98,50 @@ class VectorEnv(Environment):
         """
         raise NotImplementedError
 
+    def send(self, actions, env_ids=None):
+        """
+        Starts steps of environments without waiting for their results, which are returned by `recv`. An
+        environment must not be sent a new command before its last result was received.
+
+        The default implementation steps the environments right away.
+
+        Args:
+            actions (any): One action per environment in `env_ids`.
+            env_ids (Optional[list]): Indices of the environments to step, defaults to all environments.
+        """
+        if env_ids is None:
+            env_ids = range_(self.num_envs)
+        for env_id, action in zip(env_ids, actions):
+            state, reward, terminal, info = self.environments[env_id].step(action)
+            self.ready_results.append((env_id, state, reward, terminal, info))
+
+    def send_reset(self, env_ids):
+        """
+        Starts resets of environments. Their reset states are returned by `recv` with a reward of 0 and a
+        non-terminal flag.
+
+        Args:
+            env_ids (list): Indices of the environments to reset.
+        """
+        for env_id in env_ids:
+            self.ready_results.append((env_id, self.reset(env_id), 0.0, False, None))
+
+    def recv(self, min_ready=1, timeout=None):
+        """
+        Waits until at least `min_ready` environments have finished their steps or resets (or `timeout` seconds
+        have passed) and returns the results of all finished environments.
+
+        Args:
+            min_ready (int): Min. number of results to wait for.
+            timeout (Optional[float]): Max. seconds to wait, None to wait until `min_ready` results are available.
+
+        Returns:
+            tuple: Environment indices, states, rewards, terminals and infos of the finished environments.
+        """
+        results, self.ready_results = self.ready_results, []
+        if len(results) == 0:
+            return [], [], [], [], []
+        return tuple(list(values) for values in zip(*results))
+
     def __str__(self):
         return [str(env) for env in self.environments]
@@ -18,10 +18,12 @@ from __future__ import division
 from __future__ import print_function
 
 from rlgraph.execution.environment_sample import EnvironmentSample
+from rlgraph.execution.sharded_replay import LocalShardedReplay, RateLimiter, ShardedReplay
 from rlgraph.execution.worker import Worker
 from rlgraph.execution.single_threaded_worker import SingleThreadedWorker
 
-__all__ = ["Worker", "SingleThreadedWorker", "EnvironmentSample"]
+__all__ = ["Worker", "SingleThreadedWorker", "EnvironmentSample", "ShardedReplay", "LocalShardedReplay",
+           "RateLimiter"]
 
 Worker.__lookup_classes__ = dict(
    single=SingleThreadedWorker,
@@ -0,0 +1,180 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import numpy as np
+
+
+class AdaptiveSampleController(object):
+    """
+    Adapts the sampling workload of remote sample workers online from measured throughputs, every
+    `adapt_interval` seconds:
+
+    - Sample sizes: Tasks of each worker are sized to take about `target_task_seconds` at the worker's own
+      measured env steps per second, so fast workers return larger samples and slow workers do not delay
+      their weight syncs.
+    - Task depths: A worker whose samples arrive at the driver slower than the worker produces them idles between
+      tasks, so one more of its tasks is kept in flight, up to `max_task_depth`.
+    - Number of workers: If `target_samples_per_update` is given, a worker is added (or the slowest worker retired)
+      whenever the ratio of collected env samples to records trained on leaves the tolerance band around the
+      target.
+    """
+    def __init__(self, task_depth=1, target_task_seconds=1.0, min_sample_size=16, max_sample_size=4096,
+                 max_task_depth=4, min_utilization=0.8, target_samples_per_update=None, tolerance=0.2,
+                 min_workers=1, max_workers=None, adapt_interval=10.0, smoothing=0.5):
+        """
+        Args:
+            task_depth (int): Initial number of sample tasks in flight per worker.
+            target_task_seconds (float): Target duration of a single sample task.
+            min_sample_size (int): Min. env steps per sample task.
+            max_sample_size (int): Max. env steps per sample task.
+            max_task_depth (int): Max. number of sample tasks in flight per worker.
+            min_utilization (float): Fraction of its own throughput below which a worker counts as idling.
+            target_samples_per_update (Optional[float]): Target ratio of collected env samples to records trained
+                on. If None, the number of workers is not adapted.
+            tolerance (float): Relative deviation from `target_samples_per_update` tolerated before scaling.
+            min_workers (int): Min. number of sample workers.
+            max_workers (Optional[int]): Max. number of sample workers, None for no limit.
+            adapt_interval (float): Seconds between adaptations.
+            smoothing (float): Weight of the previous estimate in the moving average of worker throughputs.
+        """
+        self.initial_task_depth = task_depth
+        self.target_task_seconds = target_task_seconds
+        self.min_sample_size = min_sample_size
+        self.max_sample_size = max_sample_size
+        self.max_task_depth = max_task_depth
+        self.min_utilization = min_utilization
+        self.target_samples_per_update = target_samples_per_update
+        self.tolerance = tolerance
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.adapt_interval = adapt_interval
+        self.smoothing = smoothing
+
+        # Per worker: Moving average of env steps per second while sampling, adapted sample size and task depth,
+        # and records collected in the current interval.
+        self.worker_throughputs = {}
+        self.sample_sizes = {}
+        self.task_depths = {}
+        self.interval_records = {}
+
+        self.interval_start = time.monotonic()
+        self.interval_samples = 0
+        self.interval_updates = 0
+        self.samples_per_update = None
+
+    def add_worker(self, worker):
+        self.task_depths[worker] = self.initial_task_depth
+        self.interval_records[worker] = 0
+
+    def remove_worker(self, worker):
+        for worker_dict in [self.worker_throughputs, self.sample_sizes, self.task_depths, self.interval_records]:
+            worker_dict.pop(worker, None)
+
+    def record_sample(self, worker, num_records, ops_per_second):
+        """
+        Records a sample completed by a worker.
+
+        Args:
+            worker (any): Worker handle.
+            num_records (int): Number of records in the sample.
+            ops_per_second (float): Env steps per second the worker measured while sampling.
+        """
+        if worker not in self.task_depths:
+            return
+        if worker in self.worker_throughputs:
+            ops_per_second = self.smoothing * self.worker_throughputs[worker] + (1.0 - self.smoothing) * ops_per_second
+        self.worker_throughputs[worker] = ops_per_second
+        self.interval_records[worker] += num_records
+        self.interval_samples += num_records
+
+    def record_updates(self, num_records):
+        """
+        Records the number of records trained on.
+        """
+        self.interval_updates += num_records
+
+    def sample_size(self, worker):
+        """
+        Returns:
+            Optional[int]: Env steps per sample task of the worker, None before its throughput is known.
+        """
+        return self.sample_sizes.get(worker)
+
+    def task_depth(self, worker):
+        return self.task_depths.get(worker, self.initial_task_depth)
+
+    def should_adapt(self):
+        return time.monotonic() - self.interval_start >= self.adapt_interval
+
+    def adapt(self):
+        """
+        Adapts sample sizes and task depths to the throughputs measured in the current interval and starts a new
+        interval.
+
+        Returns:
+            int: Number of workers to add (positive) or retire (negative).
+        """
+        elapsed = max(time.monotonic() - self.interval_start, 1e-6)
+        for worker, throughput in self.worker_throughputs.items():
+            self.sample_sizes[worker] = int(np.clip(
+                throughput * self.target_task_seconds, self.min_sample_size, self.max_sample_size
+            ))
+            utilization = self.interval_records[worker] / elapsed / max(throughput, 1e-6)
+            if utilization < self.min_utilization:
+                self.task_depths[worker] = min(self.task_depths[worker] + 1, self.max_task_depth)
+
+        num_workers_delta = 0
+        if self.interval_updates > 0:
+            self.samples_per_update = self.interval_samples / self.interval_updates
+            if self.target_samples_per_update is not None:
+                num_workers = len(self.task_depths)
+                if self.samples_per_update > self.target_samples_per_update * (1.0 + self.tolerance):
+                    num_workers_delta = -1 if num_workers > self.min_workers else 0
+                elif self.samples_per_update < self.target_samples_per_update * (1.0 - self.tolerance):
+                    if self.max_workers is None or num_workers < self.max_workers:
+                        num_workers_delta = 1
+
+        self.interval_start = time.monotonic()
+        self.interval_samples = 0
+        self.interval_updates = 0
+        for worker in self.interval_records:
+            self.interval_records[worker] = 0
+        return num_workers_delta
+
+    def retirement_candidates(self, num_workers):
+        """
+        Returns:
+            list: The `num_workers` workers with the lowest throughput.
+        """
+        workers = sorted(self.task_depths.keys(), key=lambda worker: self.worker_throughputs.get(worker, 0.0))
+        return workers[:num_workers]
+
+    def get_statistics(self):
+        """
+        Returns:
+            dict: Current number of workers, mean sample size and task depth, and the last samples-per-update ratio.
+        """
+        return dict(
+            num_workers=len(self.task_depths),
+            mean_sample_size=float(np.mean(list(self.sample_sizes.values()))) if self.sample_sizes else None,
+            mean_task_depth=float(np.mean(list(self.task_depths.values()))) if self.task_depths else None,
+            samples_per_update=self.samples_per_update
+        )
@@ -19,6 +19,23 @@ from __future__ import print_function
 
 from rlgraph.execution.ray.apex.apex_executor import ApexExecutor
 from rlgraph.execution.ray.apex.apex_memory import ApexMemory
+from rlgraph.execution.ray.apex.apex_frame_memory import ApexFrameMemory
+from rlgraph.execution.ray.apex.memmap_apex_memory import MemmapApexMemory
+from rlgraph.execution.ray.apex.multiprocessing_apex_executor import MultiprocessingApexExecutor, \
+    SharedMemoryShardedReplay
 from rlgraph.execution.ray.apex.ray_memory_actor import RayMemoryActor
+from rlgraph.execution.ray.apex.ray_sharded_replay import RayShardedReplay
+from rlgraph.execution.ray.apex.shared_apex_memory import SharedApexMemory
 
-__all__ = ["ApexExecutor", "ApexMemory", "RayMemoryActor"]
+ApexMemory.__lookup_classes__ = dict(
+    apexmemory=ApexMemory,
+    apexframememory=ApexFrameMemory,
+    framememory=ApexFrameMemory,
+    sharedapexmemory=SharedApexMemory,
+    sharedmemory=SharedApexMemory,
+    memmapapexmemory=MemmapApexMemory,
+    memmapmemory=MemmapApexMemory
+)
+
+__all__ = ["ApexExecutor", "ApexMemory", "ApexFrameMemory", "MemmapApexMemory", "MultiprocessingApexExecutor",
+           "RayMemoryActor", "RayShardedReplay", "SharedApexMemory", "SharedMemoryShardedReplay"]
@@ -17,8 +17,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import random
+import os
 
+import numpy as np
 from rlgraph.environments import Environment
 from six.moves import queue
 from threading import Thread
@@ -26,9 +27,14 @@ from threading import Thread
 from rlgraph import get_distributed_backend
 from rlgraph.agents import Agent
 from rlgraph.execution.ray import RayValueWorker
+from rlgraph.execution.ray.apex.apex_frame_memory import ApexFrameMemory
+from rlgraph.execution.ray.apex.apex_memory import ApexMemory
 from rlgraph.execution.ray.apex.ray_memory_actor import RayMemoryActor
+from rlgraph.execution.ray.apex.ray_sharded_replay import RayShardedReplay
 from rlgraph.execution.ray.ray_executor import RayExecutor
-from rlgraph.execution.ray.ray_util import create_colocated_ray_actors, RayTaskPool, RayWeight
+from rlgraph.execution.ray.ray_util import create_colocated_ray_actors, decompress_states, RayTaskPool, \
+    WeightPublisher
+from rlgraph.utils import util
 
 if get_distributed_backend() == "ray":
     import ray
@@ -64,21 +70,35 @@ class ApexExecutor(RayExecutor):
 
         # These are the Ray remote tasks which sample batches from the replay memory
         # and pass them to the learner.
-        self.prioritized_replay_tasks = RayTaskPool()
+        # Max. completed tasks collected per pool and step, and max. seconds a step blocks waiting for a task.
+        self.task_drain_size = self.executor_spec.get("task_drain_size", None)
+        self.task_wait_timeout = self.executor_spec.get("task_wait_timeout", 0.1)
+        self.prioritized_replay_tasks = RayTaskPool(drain_size=self.task_drain_size)
         self.replay_sampling_task_depth = self.executor_spec["replay_sampling_task_depth"]
         self.replay_batch_size = self.agent_config["update_spec"]["batch_size"]
         self.num_cpus_per_replay_actor = self.executor_spec.get("num_cpus_per_replay_actor",
                                                                 self.replay_sampling_task_depth)
+        # How env samples are routed to replay shards, and the target samples-per-insert ratio (None: no limit).
+        self.replay_routing = self.executor_spec.get("replay_routing", "round_robin")
+        self.samples_per_insert = self.executor_spec.get("samples_per_insert", None)
+        # Tasks held back by the rate limiter, rescheduled once it admits them.
+        self.throttled_replay_memories = []
+        self.throttled_env_workers = []
+        # Workers retired by the sample controller once their pending tasks are done.
+        self.retiring_workers = set()
 
         # How often weights are synced to remote workers.
         self.weight_sync_steps = self.executor_spec["weight_sync_steps"]
+        # Versioned weights, only sent to workers holding a stale version.
+        self.weight_publisher = WeightPublisher(encoding=self.executor_spec.get("weight_encoding", "none"))
+        self.worker_weight_versions = {}
 
         # Necessary for target network updates.
         self.weight_syncs_executed = 0
         self.steps_since_weights_synced = {}
 
         # These are the tasks actually interacting with the environment.
-        self.env_sample_tasks = RayTaskPool()
+        self.env_sample_tasks = RayTaskPool(drain_size=self.task_drain_size)
         self.env_interaction_task_depth = self.executor_spec["env_interaction_task_depth"]
         self.worker_sample_size = self.executor_spec["num_worker_samples"] + self.worker_spec["n_step_adjustment"] - 1
 
@@ -99,7 +119,9 @@ class ApexExecutor(RayExecutor):
         # Set up worker thread for performing updates.
         self.update_worker = UpdateWorker(
             agent=self.local_agent,
-            in_queue_size=self.executor_spec["learn_queue_size"]
+            in_queue_size=self.executor_spec["learn_queue_size"],
+            num_feeder_threads=self.executor_spec.get("num_feeder_threads", 1),
+            prefetch_depth=self.executor_spec.get("prefetch_depth", 2)
         )
         self.ray_init()
 
@@ -116,6 +138,11 @@ class ApexExecutor(RayExecutor):
         self.apex_replay_spec["min_sample_memory_size"] = int(min_sample_size / self.num_replay_workers)
         self.logger.info("Sampling for learning starts at: {}".format( self.apex_replay_spec["min_sample_memory_size"]))
 
+        # Frame-deduplicating memories share next-states with the state n steps ahead.
+        memory_spec = self.apex_replay_spec["memory_spec"]
+        if ApexMemory.lookup_class(memory_spec.get("type")) is ApexFrameMemory:
+            memory_spec.setdefault("n_step", self.worker_spec["n_step_adjustment"])
+
         # Set sample batch size:
         self.apex_replay_spec["sample_batch_size"] = self.agent_config["update_spec"]["batch_size"]
         self.logger.info("Sampling batch size {}".format(self.apex_replay_spec["sample_batch_size"]))
@@ -125,6 +152,13 @@ class ApexExecutor(RayExecutor):
             config=self.apex_replay_spec,
             num_agents=self.num_replay_workers
         )
+        self.sharded_replay = RayShardedReplay(
+            memory_actors=self.ray_local_replay_memories,
+            shard_capacity=shard_size,
+            routing=self.replay_routing,
+            samples_per_insert=self.samples_per_insert,
+            min_size_to_sample=min_sample_size
+        )
 
         # Create remote workers for data collection.
         self.worker_spec["worker_sample_size"] = self.worker_sample_size
@@ -145,19 +179,166 @@ class ApexExecutor(RayExecutor):
         for ray_memory in self.ray_local_replay_memories:
             for _ in range(self.replay_sampling_task_depth):
                 # This initializes remote tasks to sample from the prioritized replay memories of each worker.
-                self.prioritized_replay_tasks.add_task(ray_memory, ray_memory.get_batch.remote())
+                self._schedule_replay_task(ray_memory)
 
         # Env interaction tasks via RayWorkers which each
         # have a local agent.
-        weights = RayWeight(self.local_agent.get_weights())
+        self.weight_publisher.publish(self.local_agent.get_weights())
+        for ray_worker in self.ray_env_sample_workers:
+            self._start_sample_worker(ray_worker)
+
+    def _start_sample_worker(self, ray_worker):
+        """
+        Syncs weights to a new sample worker and schedules its first sample tasks.
+        """
+        self.worker_weight_versions[ray_worker] = 0
+        self._sync_worker_weights(ray_worker)
+        self.steps_since_weights_synced[ray_worker] = 0
+        if self.sample_controller is not None:
+            self.sample_controller.add_worker(ray_worker)
+
+        self.logger.info("Synced worker {} weights, initializing sample tasks.".format(
+            self.worker_ids[ray_worker]))
+        self._top_up_env_sample_tasks(ray_worker)
+
+    def add_sample_workers(self, num_workers):
+        """
+        Creates and starts additional sample workers.
+
+        Args:
+            num_workers (int): Number of workers to add.
+        """
+        new_workers = self.create_remote_workers(
+            RayValueWorker, num_workers, self.agent_config,
+            # *args
+            self.worker_spec, self.environment_spec, self.worker_frameskip
+        )
+        self.ray_env_sample_workers.extend(new_workers)
+        for ray_worker in new_workers:
+            self._start_sample_worker(ray_worker)
+
+    def _adapt_sample_workers(self):
+        """
+        Applies the sample controller's adaptations: Adds or retires workers and schedules tasks for increased
+        task depths.
+        """
+        num_workers_delta = self.sample_controller.adapt()
+        if num_workers_delta > 0:
+            self.add_sample_workers(num_workers_delta)
+        elif num_workers_delta < 0:
+            for ray_worker in self.sample_controller.retirement_candidates(-num_workers_delta):
+                # Retire once all pending samples are collected.
+                self.retiring_workers.add(ray_worker)
+                self.sample_controller.remove_worker(ray_worker)
+                self._retire_if_idle(ray_worker)
         for ray_worker in self.ray_env_sample_workers:
-            ray_worker.set_weights.remote(weights)
-            self.steps_since_weights_synced[ray_worker] = 0
+            self._top_up_env_sample_tasks(ray_worker)
+
+    def _retire_if_idle(self, ray_worker):
+        if ray_worker in self.retiring_workers and self.env_sample_tasks.num_pending(ray_worker) == 0:
+            self.retiring_workers.remove(ray_worker)
+            self.throttled_env_workers = [worker for worker in self.throttled_env_workers if worker != ray_worker]
+            self.retire_worker(ray_worker)
+
+    def _sync_worker_weights(self, ray_worker):
+        """
+        Sends the latest published weights to a worker unless it already holds them.
+
+        Returns:
+            bool: True if weights were sent.
+        """
+        weights = self.weight_publisher.weights_for(self.worker_weight_versions[ray_worker])
+        if weights is None:
+            return False
+        ray_worker.set_weights.remote(weights)
+        self.worker_weight_versions[ray_worker] = self.weight_publisher.version
+        return True
+
+    def _schedule_env_sample_task(self, ray_worker):
+        """
+        Schedules an env sample task unless collection is too far ahead of learning.
+        """
+        sample_size = None
+        if self.sample_controller is not None:
+            sample_size = self.sample_controller.sample_size(ray_worker)
+        if self.sharded_replay.can_insert(sample_size or self.worker_sample_size):
+            self.env_sample_tasks.add_task(ray_worker, ray_worker.execute_and_get_with_metrics.remote(sample_size))
+        else:
+            self.throttled_env_workers.append(ray_worker)
+
+    def _top_up_env_sample_tasks(self, ray_worker):
+        """
+        Schedules env sample tasks until the worker has as many tasks pending (or throttled) as its task depth.
+        """
+        if ray_worker in self.retiring_workers:
+            return
+        task_depth = self.env_interaction_task_depth
+        if self.sample_controller is not None:
+            task_depth = self.sample_controller.task_depth(ray_worker)
+        num_tasks = self.env_sample_tasks.num_pending(ray_worker) + self.throttled_env_workers.count(ray_worker)
+        for _ in range(task_depth - num_tasks):
+            self._schedule_env_sample_task(ray_worker)
+
+    def _schedule_replay_task(self, ray_memory):
+        """
+        Schedules a replay sampling task unless learning is too far ahead of collection.
+        """
+        if self.sharded_replay.can_sample(self.replay_batch_size):
+            self.sharded_replay.record_sample(self.replay_batch_size)
+            self.prioritized_replay_tasks.add_task(ray_memory, ray_memory.get_batch.remote())
+        else:
+            self.throttled_replay_memories.append(ray_memory)
+
+    def get_task_statistics(self):
+        """
+        Returns:
+            dict: Latency and queue depth statistics of env sample and replay sampling tasks.
+        """
+        statistics = dict(
+            env_sample_tasks=self.env_sample_tasks.get_statistics(),
+            replay_tasks=self.prioritized_replay_tasks.get_statistics()
+        )
+        if self.sample_controller is not None:
+            statistics["sample_controller"] = self.sample_controller.get_statistics()
+        return statistics
+
+    def store_memory(self, path, incremental=False):
+        """
+        Checkpoints all replay shards into sub-directories of `path`. Blocks until all shards are stored.
+
+        Args:
+            path (str): Checkpoint directory.
+            incremental (bool): Only store record chunks written since the last checkpoint to `path`.
+        """
+        ray.get([
+            ray_memory.store_memory.remote(os.path.join(path, "shard-{}".format(shard_id)), incremental)
+            for shard_id, ray_memory in enumerate(self.ray_local_replay_memories)
+        ])
+
+    def load_memory(self, path):
+        """
+        Restores all replay shards from a checkpoint written by `store_memory`, so learning resumes without
+        warm-up.
 
-            self.logger.info("Synced worker {} weights, initializing sample tasks.".format(
-                self.worker_ids[ray_worker]))
-            for _ in range(self.env_interaction_task_depth):
-                self.env_sample_tasks.add_task(ray_worker, ray_worker.execute_and_get_with_count.remote())
+        Args:
+            path (str): Checkpoint directory.
+        """
+        shard_sizes = ray.get([
+            ray_memory.load_memory.remote(os.path.join(path, "shard-{}".format(shard_id)))
+            for shard_id, ray_memory in enumerate(self.ray_local_replay_memories)
+        ])
+        for shard_id, shard_size in enumerate(shard_sizes):
+            self.sharded_replay.record_insert(shard_id, shard_size)
+
+    def stop(self):
+        """
+        Closes the replay memories, e.g. freeing the blocks of shared memory shards, and terminates the replay
+        actors.
+        """
+        ray.get([ray_memory.close.remote() for ray_memory in self.ray_local_replay_memories])
+        for ray_memory in self.ray_local_replay_memories:
+            ray_memory.__ray_terminate__.remote()
+        self.ray_local_replay_memories = []
 
     def _execute_step(self):
         """
@@ -174,35 +355,56 @@ class ApexExecutor(RayExecutor):
         update_steps = 0
         discarded = 0
         queue_inserts = 0
-        weights = None
+
+        # 0. Resume tasks held back by the rate limiter.
+        throttled_env_workers, self.throttled_env_workers = self.throttled_env_workers, []
+        for ray_worker in throttled_env_workers:
+            if ray_worker in self.retiring_workers:
+                self._retire_if_idle(ray_worker)
+            else:
+                self._schedule_env_sample_task(ray_worker)
+        throttled_replay_memories, self.throttled_replay_memories = self.throttled_replay_memories, []
+        for ray_memory in throttled_replay_memories:
+            self._schedule_replay_task(ray_memory)
+
+        # Block until a task is done, unless learner results are waiting to be processed.
+        if self.update_worker.output_queue.empty():
+            RayTaskPool.wait_any([self.env_sample_tasks, self.prioritized_replay_tasks],
+                                 timeout=self.task_wait_timeout)
 
         # 1. Fetch results from RayWorkers.
         completed_sample_tasks = list(self.env_sample_tasks.get_completed())
-        sample_batch_sizes = ray.get([task[1][1] for task in completed_sample_tasks])
-        for i, (ray_worker, (env_sample_obj_id, sample_size)) in enumerate(completed_sample_tasks):
-            # Randomly add env sample to a local replay actor.
-            random.choice(self.ray_local_replay_memories).observe.remote(env_sample_obj_id)
-            sample_steps = sample_batch_sizes[i]
+        sample_metrics = ray.get([task[1][1] for task in completed_sample_tasks])
+        for i, (ray_worker, (env_sample_obj_id, _)) in enumerate(completed_sample_tasks):
+            sample_steps = sample_metrics[i]["batch_size"]
+            if self.sample_controller is not None:
+                self.sample_controller.record_sample(ray_worker, sample_steps, sample_metrics[i]["ops_per_second"])
+            # Route env sample to a replay shard.
+            self.sharded_replay.insert(env_sample_obj_id, num_records=sample_steps)
             env_steps += sample_steps
+            # Lag of the weights the sample was produced with, as reported by the worker.
+            self.policy_lags.append(self.weight_publisher.version - sample_metrics[i]["policy_version"])
 
             self.steps_since_weights_synced[ray_worker] += sample_steps
             if self.steps_since_weights_synced[ray_worker] >= self.weight_sync_steps:
-                if weights is None or self.update_worker.update_done:
+                # Publish a new version only if the learner updated since the last one.
+                if self.update_worker.update_done:
                     self.update_worker.update_done = False
-                    weights = ray.put(RayWeight(self.local_agent.get_weights()))
-                # self.logger.debug("Syncing weights for worker {}".format(self.worker_ids[ray_worker]))
-                # self.logger.debug("Weights type: {}, weights = {}".format(type(weights), weights))
-                ray_worker.set_weights.remote(weights)
-                self.weight_syncs_executed += 1
+                    self.weight_publisher.publish(self.local_agent.get_weights())
+                if self._sync_worker_weights(ray_worker):
+                    self.weight_syncs_executed += 1
                 self.steps_since_weights_synced[ray_worker] = 0
 
             # Reschedule environment samples.
-            self.env_sample_tasks.add_task(ray_worker, ray_worker.execute_and_get_with_count.remote())
+            if ray_worker in self.retiring_workers:
+                self._retire_if_idle(ray_worker)
+            else:
+                self._top_up_env_sample_tasks(ray_worker)
 
         # 2. Fetch completed replay priority sampling task, move to worker, reschedule.
         for ray_memory, replay_remote_task in self.prioritized_replay_tasks.get_completed():
             # Immediately schedule new batch sampling tasks on these workers.
-            self.prioritized_replay_tasks.add_task(ray_memory, ray_memory.get_batch.remote())
+            self._schedule_replay_task(ray_memory)
 
             # Retrieve results via id.
             # self.logger.info("replay task obj id {}".format(replay_remote_task))
@@ -228,6 +430,12 @@ class ApexExecutor(RayExecutor):
             # len of loss per item is update count.
             update_steps += len(indices)
 
+        # 4. Adapt sample sizes, task depths and the number of sample workers.
+        if self.sample_controller is not None:
+            self.sample_controller.record_updates(update_steps)
+            if self.sample_controller.should_adapt():
+                self._adapt_sample_workers()
+
         return env_steps, update_steps, discarded, queue_inserts
 
 
@@ -235,17 +443,22 @@ class UpdateWorker(Thread):
     """
     Executes learning separate from the main event loop as described in the Ape-X paper.
     Communicates with the main thread via a queue.
+
+    Feeder threads prepare batches for the learner: They decompress states, convert dtypes, stack records into
+    contiguous arrays and keep up to `prefetch_depth` prepared batches ready, so the learner thread only runs
+    update steps.
     """
 
-    def __init__(self, agent, in_queue_size):
+    def __init__(self, agent, in_queue_size, num_feeder_threads=1, prefetch_depth=2):
         """
         Initializes the worker with a RLGraph agent and queues for
 
         Args:
             agent (Agent): RLGraph agent used to execute local updates.
-            input_queue (queue.Queue): Input queue the worker will use to poll samples.
-            output_queue (queue.Queue): Output queue the worker will use to push results of local
-                update computations.
+            in_queue_size (int): Max. number of sampled batches waiting for the learner.
+            num_feeder_threads (int): Number of threads preparing batches. If 0, batches are prepared on the
+                learner thread.
+            prefetch_depth (int): Max. number of prepared batches waiting for the learner.
         """
         super(UpdateWorker, self).__init__()
 
@@ -253,6 +466,16 @@ class UpdateWorker(Thread):
         self.agent = agent
         self.input_queue = queue.Queue(maxsize=in_queue_size)
         self.output_queue = queue.Queue()
+        self.state_dtype = util.convert_dtype(dtype=agent.preprocessed_state_space.dtype, to="np")
+
+        self.prefetch_queue = None
+        self.feeder_threads = []
+        if num_feeder_threads > 0:
+            self.prefetch_queue = queue.Queue(maxsize=prefetch_depth)
+            for _ in range(num_feeder_threads):
+                feeder = Thread(target=self.feed)
+                feeder.daemon = True
+                self.feeder_threads.append(feeder)
 
         # Terminate when host process terminates.
         self.daemon = True
@@ -260,14 +483,49 @@ class UpdateWorker(Thread):
         # Flag for main thread.
         self.update_done = False
 
+    def start(self):
+        for feeder in self.feeder_threads:
+            feeder.start()
+        super(UpdateWorker, self).start()
+
     def run(self):
         while True:
             self.step()
 
+    def feed(self):
+        while True:
+            memory_actor, sample_batch = self.input_queue.get()
+            if sample_batch is not None:
+                self.prefetch_queue.put((memory_actor, self.prepare_batch(sample_batch)))
+
+    def prepare_batch(self, sample_batch):
+        """
+        Converts a sampled batch into contiguous arrays of the dtypes the agent feeds.
+
+        Args:
+            sample_batch (dict): Batch sampled from a replay memory.
+
+        Returns:
+            dict: Prepared batch.
+        """
+        batch = {}
+        for key, value in sample_batch.items():
+            if key in ["states", "next_states"]:
+                # Decompressing stacks (possibly compressed) states into a new array.
+                batch[key] = np.ascontiguousarray(decompress_states(value), dtype=self.state_dtype)
+            else:
+                batch[key] = np.ascontiguousarray(value)
+        return batch
+
     def step(self):
         # Fetch input for update:
         # Replay memory used.
-        memory_actor, sample_batch = self.input_queue.get()
+        if self.prefetch_queue is not None:
+            memory_actor, sample_batch = self.prefetch_queue.get()
+        else:
+            memory_actor, sample_batch = self.input_queue.get()
+            if sample_batch is not None:
+                sample_batch = self.prepare_batch(sample_batch)
 
         if sample_batch is not None:
             loss, loss_per_item = self.agent.update(batch=sample_batch)
@@ -0,0 +1,261 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+from rlgraph.execution.ray.apex.apex_memory import ApexMemory
+from rlgraph.execution.ray.ray_util import decompress_states
+from rlgraph.utils.rlgraph_errors import RLGraphError
+
+
+class ApexFrameMemory(ApexMemory):
+    """
+    Apex prioritized replay storing each raw frame of frame-stacked states (e.g. the output of a `Sequence`
+    preprocessor) only once.
+
+    Frames live in a ring buffer. Every transition keeps the ids of the frames forming its state and next-state
+    stacks; stacks are rebuilt when sampling. Consecutive states of a trajectory share all but one frame, and
+    next-states are shared with the state `n_step` transitions ahead, so a continuous trajectory costs roughly one
+    stored frame per transition instead of `2 * stack size`.
+
+    If the frame ring is too small, frames of old transitions are overwritten before the transitions themselves.
+    These transitions are then evicted (their priority is set to 0 so they are never sampled again) and no longer
+    count towards the memory size used for importance weights.
+    """
+    column_keys = ["actions", "rewards", "terminals", "importance_weights"]
+    # Marks empty or evicted transitions.
+    no_frame = np.iinfo(np.int64).max
+
+    def __init__(self, capacity=1000, alpha=1.0, beta=1.0, frame_capacity=None, frame_axis=-1, n_step=1):
+        """
+        Args:
+            capacity (int): Max capacity (number of transitions).
+            alpha (float): Initial weight.
+            beta (float): Prioritisation factor.
+            frame_capacity (Optional[int]): Number of frames in the frame ring. Defaults to 1.25 * capacity, which
+                covers trajectory fragments of a few dozen steps. Shorter fragments need more frames per
+                transition as each fragment stores its first stacks in full.
+            frame_axis (int): Axis of a (non-batched) state along which frames are stacked.
+            n_step (int): Offset between a state and its next-state within a sample batch, i.e. the
+                n-step adjustment of the workers.
+        """
+        super(ApexFrameMemory, self).__init__(capacity=capacity, alpha=alpha, beta=beta, columnar=True)
+        self.frame_capacity = frame_capacity or capacity + capacity // 4
+        self.frame_axis = frame_axis
+        self.n_step = n_step
+
+        # Frame ring, created on first insert when frame shape and dtype are known.
+        self.frames = None
+        # Total number of frames written so far, i.e. the id of the next frame.
+        self.num_frames = 0
+        self.stack_size = None
+
+        self.state_frame_ids = None
+        self.next_state_frame_ids = None
+        # Oldest frame id referenced by each transition.
+        self.oldest_frame_ids = np.full(shape=(self.capacity,), fill_value=self.no_frame, dtype=np.int64)
+        self.min_oldest_frame_id = self.no_frame
+        # Number of stored transitions which are not evicted.
+        self.num_live = 0
+
+    def insert_batch(self, records):
+        num_records = len(records["rewards"])
+        if num_records == 0:
+            return
+        # Only the last `capacity` records survive a larger insert.
+        if num_records > self.capacity:
+            offset = num_records - self.capacity
+            self.index = (self.index + offset) % self.capacity
+            self.num_inserted += offset
+            records = {key: value[offset:] if value is not None else None for key, value in records.items()}
+
+        states = self._to_frame_stacks(records["states"])
+        next_states = self._to_frame_stacks(records["next_states"])
+        if self.frames is None:
+            self.stack_size = states.shape[-1]
+            self.frames = np.zeros(shape=(self.frame_capacity,) + states.shape[1:-1], dtype=states.dtype)
+            self.state_frame_ids = np.zeros(shape=(self.capacity, self.stack_size), dtype=np.int64)
+            self.next_state_frame_ids = np.zeros(shape=(self.capacity, self.stack_size), dtype=np.int64)
+
+        state_ids = self._insert_state_frames(states)
+        next_state_ids = self._insert_next_state_frames(states, next_states, state_ids)
+
+        self._write_column(self.state_frame_ids, state_ids)
+        self._write_column(self.next_state_frame_ids, next_state_ids)
+        oldest_ids = np.minimum(state_ids.min(axis=1), next_state_ids.min(axis=1))
+        # Overwritten transitions which were not evicted are no longer live.
+        positions = np.arange(self.index, self.index + len(oldest_ids)) % self.capacity
+        self.num_live += len(oldest_ids) - np.count_nonzero(self.oldest_frame_ids[positions] != self.no_frame)
+        self._write_column(self.oldest_frame_ids, oldest_ids)
+        self.min_oldest_frame_id = min(self.min_oldest_frame_id, oldest_ids.min())
+
+        # Writes remaining columns and priorities, advances index.
+        super(ApexFrameMemory, self).insert_batch(records)
+        self._evict_overwritten()
+
+    def _to_frame_stacks(self, states):
+        """
+        Decompresses states if necessary and moves the frame axis last.
+        """
+        return np.moveaxis(decompress_states(states), self._batch_frame_axis(), -1)
+
+    def _batch_frame_axis(self):
+        return self.frame_axis if self.frame_axis < 0 else self.frame_axis + 1
+
+    def _write_frames(self, frames):
+        """
+        Appends frames to the frame ring.
+
+        Returns:
+            int: Id of the first written frame, following ids are contiguous.
+        """
+        first_id = self.num_frames
+        positions = np.arange(first_id, first_id + len(frames)) % self.frame_capacity
+        self.frames[positions] = frames
+        self.num_frames += len(frames)
+        return first_id
+
+    def _insert_state_frames(self, states):
+        """
+        Stores the frames of a batch of state stacks. A stack continuing the previous one (shifted by one frame)
+        only adds its newest frame. Within such a run, all written frames are contiguous, so frame j of the stack
+        d steps after the run start has id `run_start_id + d + j`.
+        """
+        num_records = len(states)
+        continues = np.zeros(shape=(num_records,), dtype=bool)
+        if num_records > 1:
+            continues[1:] = np.all(
+                (states[1:, ..., :-1] == states[:-1, ..., 1:]).reshape(num_records - 1, -1), axis=1
+            )
+        num_new_frames = np.where(continues, 1, self.stack_size)
+        write_offsets = np.cumsum(num_new_frames) - num_new_frames
+
+        # Gather all new frames in write order: Full stacks for run starts, newest frame otherwise.
+        stack_indices = np.repeat(np.arange(num_records), num_new_frames)
+        frame_indices = np.arange(len(stack_indices)) - np.repeat(write_offsets, num_new_frames) + \
+            np.repeat(np.where(continues, self.stack_size - 1, 0), num_new_frames)
+        first_id = self._write_frames(states[stack_indices, ..., frame_indices])
+
+        # Position of each stack's run start.
+        run_starts = np.maximum.accumulate(np.where(continues, 0, np.arange(num_records)))
+        run_start_ids = first_id + write_offsets[run_starts]
+        return (run_start_ids + np.arange(num_records) - run_starts)[:, None] + np.arange(self.stack_size)
+
+    def _insert_next_state_frames(self, states, next_states, state_ids):
+        """
+        Stores the frames of a batch of next-state stacks, reusing the state stack `n_step` records ahead where
+        possible. Remaining stacks (trajectory ends, terminals) are chained onto the previous next-state stack
+        or stored in full.
+        """
+        num_records = len(next_states)
+        next_state_ids = np.zeros_like(state_ids)
+        shared = np.zeros(shape=(num_records,), dtype=bool)
+        num_shifted = num_records - self.n_step
+        if num_shifted > 0:
+            shared[:num_shifted] = np.all(
+                (next_states[:num_shifted] == states[self.n_step:]).reshape(num_shifted, -1), axis=1
+            )
+            next_state_ids[:num_shifted][shared[:num_shifted]] = state_ids[self.n_step:][shared[:num_shifted]]
+
+        for i in np.flatnonzero(~shared):
+            if i > 0 and np.array_equal(next_states[i, ..., :-1], next_states[i - 1, ..., 1:]):
+                new_id = self._write_frames(next_states[i, ..., -1][None])
+                next_state_ids[i, :-1] = next_state_ids[i - 1, 1:]
+                next_state_ids[i, -1] = new_id
+            else:
+                new_id = self._write_frames(np.moveaxis(next_states[i], -1, 0))
+                next_state_ids[i] = np.arange(new_id, new_id + self.stack_size)
+        return next_state_ids
+
+    def _evict_overwritten(self):
+        """
+        Removes transitions whose frames were overwritten in the frame ring from sampling.
+        """
+        threshold = self.num_frames - self.frame_capacity
+        if threshold <= self.min_oldest_frame_id:
+            return
+        evicted = np.flatnonzero(self.oldest_frame_ids < threshold)
+        self.merged_segment_tree.sum_segment_tree.insert_batch(evicted, np.zeros(shape=(len(evicted),)))
+        self.merged_segment_tree.min_segment_tree.insert_batch(evicted, np.full(len(evicted), float("inf")))
+        self.oldest_frame_ids[evicted] = self.no_frame
+        self.min_oldest_frame_id = self.oldest_frame_ids.min()
+        self.num_live -= len(evicted)
+
+    def num_live_records(self):
+        return self.num_live
+
+    def _read_columns(self, indices):
+        records = super(ApexFrameMemory, self)._read_columns(indices)
+        records["states"] = self._read_frame_stacks(self.state_frame_ids[indices])
+        records["next_states"] = self._read_frame_stacks(self.next_state_frame_ids[indices])
+        return records
+
+    def _read_frame_stacks(self, frame_ids):
+        stacks = self.frames[frame_ids % self.frame_capacity]
+        # [batch, stack, frame dims] -> frame axis in place.
+        return np.moveaxis(stacks, 1, self._batch_frame_axis())
+
+    def update_records(self, indices, update):
+        # Do not re-activate evicted transitions.
+        indices = np.asarray(indices)
+        valid = self.oldest_frame_ids[indices] != self.no_frame
+        if np.any(valid):
+            super(ApexFrameMemory, self).update_records(indices[valid], np.asarray(update)[valid])
+
+    def _checkpoint_arrays(self):
+        arrays, counters = super(ApexFrameMemory, self)._checkpoint_arrays()
+        if self.frames is not None:
+            arrays.update(
+                frames=self.frames,
+                state_frame_ids=self.state_frame_ids,
+                next_state_frame_ids=self.next_state_frame_ids
+            )
+            counters.update(
+                frames=self.num_frames,
+                state_frame_ids=self.num_inserted,
+                next_state_frame_ids=self.num_inserted
+            )
+        # Evictions touch arbitrary slots, always stored in full.
+        arrays["oldest_frame_ids"] = self.oldest_frame_ids
+        return arrays, counters
+
+    def _checkpoint_state(self):
+        state = super(ApexFrameMemory, self)._checkpoint_state()
+        state.update(
+            frame_capacity=self.frame_capacity,
+            num_frames=self.num_frames,
+            min_oldest_frame_id=int(self.min_oldest_frame_id)
+        )
+        return state
+
+    def _restore_checkpoint(self, arrays, state):
+        if state["frame_capacity"] != self.frame_capacity:
+            raise RLGraphError("Checkpoint frame capacity {} does not match memory frame capacity {}.".format(
+                state["frame_capacity"], self.frame_capacity)
+            )
+        super(ApexFrameMemory, self)._restore_checkpoint(arrays, state)
+        if "frames" in arrays:
+            self.frames = arrays["frames"]
+            self.state_frame_ids = arrays["state_frame_ids"]
+            self.next_state_frame_ids = arrays["next_state_frame_ids"]
+            self.stack_size = self.state_frame_ids.shape[1]
+        self.oldest_frame_ids = arrays["oldest_frame_ids"]
+        self.num_frames = state["num_frames"]
+        self.min_oldest_frame_id = state["min_oldest_frame_id"]
+        self.num_live = int(np.count_nonzero(self.oldest_frame_ids != self.no_frame))
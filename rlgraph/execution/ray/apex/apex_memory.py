@@ -18,55 +18,69 @@ from __future__ import division
 from __future__ import print_function
 
 import numpy as np
-import operator
+from six import string_types
 from six.moves import xrange as range_
 
 from rlgraph.utils import SMALL_NUMBER
+from rlgraph.utils.rlgraph_errors import RLGraphError
 from rlgraph.utils.specifiable import Specifiable
-from rlgraph.components.helpers.mem_segment_tree import MemSegmentTree, MinSumSegmentTree
-from rlgraph.execution.ray.ray_util import ray_decompress
+from rlgraph.components.helpers.mem_checkpoint import load_arrays, store_arrays
+from rlgraph.components.helpers.mem_segment_tree import MinSumSegmentTree
+from rlgraph.execution.ray.ray_util import decompress_states
 
 
 class ApexMemory(Specifiable):
     """
     Apex prioritized replay implementing compression.
     """
-    def __init__(self, capacity=1000, alpha=1.0, beta=1.0):
+    # Record layout, also the order of the tuples passed to `insert_records`.
+    record_keys = ["states", "actions", "rewards", "terminals", "next_states", "importance_weights"]
+    # Record keys stored as a preallocated array in columnar mode.
+    column_keys = record_keys
+
+    def __init__(self, capacity=1000, alpha=1.0, beta=1.0, columnar=False):
         """
         Args:
             capacity (int): Max capacity.
             alpha (float): Initial weight.
             beta (float): Prioritisation factor.
+            columnar (bool): If True, stores records in one preallocated array per record key instead of
+                a list of per-transition tuples. Batches are then inserted via slice assignment and read
+                via fancy indexing.
         """
         super(ApexMemory, self).__init__()
 
+        self.columnar = columnar
         self.memory_values = []
+        # Columnar storage, created on first insert when shapes and dtypes are known.
+        self.columns = None
         self.index = 0
         self.capacity = capacity
         self.size = 0
+        # Total number of records inserted, i.e. `index` without wrap-around.
+        self.num_inserted = 0
         self.max_priority = 1.0
         self.alpha = alpha
         self.beta = beta
 
         self.default_new_weight = np.power(self.max_priority, self.alpha)
-        self.priority_capacity = 1
-        while self.priority_capacity < self.capacity:
-            self.priority_capacity *= 2
-
-        # Create segment trees, initialize with neutral elements.
-        sum_values = [0.0 for _ in range_(2 * self.priority_capacity)]
-        sum_segment_tree = MemSegmentTree(sum_values, self.priority_capacity, operator.add)
-        min_values = [float('inf') for _ in range_(2 * self.priority_capacity)]
-        min_segment_tree = MemSegmentTree(min_values, self.priority_capacity, min)
-        self.merged_segment_tree = MinSumSegmentTree(
-            sum_tree=sum_segment_tree,
-            min_tree=min_segment_tree,
-            capacity=self.priority_capacity
-        )
+        # Array-backed sum and min segment trees, initialized with neutral elements.
+        self.merged_segment_tree = MinSumSegmentTree.from_capacity(self.capacity)
+        self.priority_capacity = self.merged_segment_tree.capacity
+
+        # Path and write counters of the last checkpoint, used for incremental checkpoints.
+        self.checkpoint_path = None
+        self.checkpoint_counters = None
 
     def insert_records(self, record):
         # TODO: This has the record interface, but actually expects a specific structure anyway, so
         # may as well change API?
+        if self.columnar:
+            self.insert_batch({
+                key: None if value is None else [value] for key, value in zip(self.record_keys, record)
+            })
+            return
+
         if self.index >= self.size:
             self.memory_values.append(record)
         else:
@@ -81,6 +95,86 @@ class ApexMemory(Specifiable):
         # Update indices.
         self.index = (self.index + 1) % self.capacity
         self.size = min(self.size + 1, self.capacity)
+        self.num_inserted += 1
+
+    def insert_batch(self, records):
+        """
+        Inserts a batch of records, e.g. the batch of an `EnvironmentSample`.
+
+        Args:
+            records (dict): Dict mapping each key in `record_keys` to a sequence of values. Importance
+                weights (or single weights) may be None, in which case records are inserted with max priority.
+        """
+        num_records = len(records["rewards"])
+        if num_records == 0:
+            return
+        if not self.columnar:
+            for i in range_(num_records):
+                self.insert_records(tuple(
+                    records[key][i] if records.get(key) is not None else None for key in self.record_keys
+                ))
+            return
+
+        # Only the last `capacity` records survive a larger insert.
+        offset = max(0, num_records - self.capacity)
+        num_inserts = num_records - offset
+        self.index = (self.index + offset) % self.capacity
+        if self.columns is None:
+            self.columns = self._create_columns(records)
+        for key, column in self.columns.items():
+            if records.get(key) is not None:
+                self._write_column(column, records[key][offset:])
+
+        insert_indices = np.arange(self.index, self.index + num_inserts) % self.capacity
+        weights = records.get("importance_weights")
+        if weights is not None:
+            # Missing (None) weights of single records become NaN, these use max priority as well.
+            weights = np.asarray(weights[offset:], dtype=np.float64)
+            weights = np.where(np.isnan(weights), self.max_priority, weights)
+            priorities = np.power(weights, self.alpha)
+        else:
+            priorities = np.full(shape=(num_inserts,), fill_value=self.max_priority ** self.alpha)
+        self.merged_segment_tree.insert_batch(insert_indices, priorities)
+
+        # Update indices.
+        self.index = (self.index + num_inserts) % self.capacity
+        self.size = min(self.size + num_inserts, self.capacity)
+        self.num_inserted += num_records
+
+    def _create_columns(self, records):
+        """
+        Preallocates one array of length `capacity` per record key.
+
+        Compressed states are kept as Python objects, all other keys use the dtype and shape of the
+        first batch.
+        """
+        columns = {}
+        for key in self.column_keys:
+            if key == "importance_weights":
+                columns[key] = np.ones(shape=(self.capacity,), dtype=np.float64)
+                continue
+            values = records[key]
+            if isinstance(values[0], (bytes, string_types)):
+                columns[key] = np.empty(shape=(self.capacity,), dtype=object)
+            else:
+                values = np.asarray(values)
+                columns[key] = np.zeros(shape=(self.capacity,) + values.shape[1:], dtype=values.dtype)
+        return columns
+
+    def _write_column(self, column, values):
+        """
+        Writes values into a column starting at the current index, wrapping around at capacity.
+        """
+        if values is None:
+            return
+        num_values = len(values)
+        end = self.index + num_values
+        if end <= self.capacity:
+            column[self.index:end] = values
+        else:
+            split = self.capacity - self.index
+            column[self.index:] = values[:split]
+            column[:num_values - split] = values[split:]
 
     def read_records(self, indices):
         """
@@ -92,6 +186,9 @@ class ApexMemory(Specifiable):
         Returns:
              dict: Record value dict.
         """
+        if self.columnar:
+            return self._read_columns(indices)
+
         states = []
         actions = []
         rewards = []
@@ -99,40 +196,142 @@ class ApexMemory(Specifiable):
         next_states = []
         for index in indices:
             state, action, reward, terminal, next_state, weight = self.memory_values[index]
-            states.append(ray_decompress(state))
+            states.append(state)
             actions.append(action)
             rewards.append(reward)
             terminals.append(terminal)
-            next_states.append(ray_decompress(next_state))
+            next_states.append(next_state)
 
         return dict(
-            states=np.asarray(states),
+            states=decompress_states(states),
             actions=np.asarray(actions),
             rewards=np.asarray(rewards),
             terminals=np.asarray(terminals),
-            next_states=np.asarray(next_states)
+            next_states=decompress_states(next_states)
         )
 
+    def _read_columns(self, indices):
+        records = {}
+        for key, column in self.columns.items():
+            if key == "importance_weights":
+                continue
+            if column.dtype == object:
+                records[key] = decompress_states(column[indices])
+            else:
+                records[key] = np.take(column, indices, axis=0)
+        return records
+
     def get_records(self, num_records):
-        indices = []
         prob_sum = self.merged_segment_tree.sum_segment_tree.get_sum(0, self.size)
         samples = np.random.random(size=(num_records,)) * prob_sum
-        for sample in samples:
-            indices.append(self.merged_segment_tree.sum_segment_tree.index_of_prefixsum(prefix_sum=sample))
+        indices = self.merged_segment_tree.find_prefixsum_batch(samples)
 
         sum_prob = self.merged_segment_tree.sum_segment_tree.get_sum()
         min_prob = self.merged_segment_tree.min_segment_tree.get_min_value() / sum_prob + SMALL_NUMBER
-        max_weight = (min_prob * self.size) ** (-self.beta)
-        weights = []
-        for index in indices:
-            sample_prob = self.merged_segment_tree.sum_segment_tree.get(index) / sum_prob
-            weight = (sample_prob * self.size) ** (-self.beta)
-            weights.append(weight / max_weight)
+        num_live = self.num_live_records()
+        max_weight = (min_prob * num_live) ** (-self.beta)
+        sample_probs = self.merged_segment_tree.sum_segment_tree.values[indices + self.priority_capacity] / sum_prob
+        weights = np.power(sample_probs * num_live, -self.beta) / max_weight
 
-        return self.read_records(indices=indices), np.asarray(indices), np.asarray(weights)
+        return self.read_records(indices=indices), indices, weights
+
+    def num_live_records(self):
+        """
+        Returns:
+            int: Number of records which can be sampled, used to normalize importance weights.
+        """
+        return self.size
 
     def update_records(self, indices, update):
-        for index, loss in zip(indices, update):
-            self.merged_segment_tree.insert(index, loss ** self.alpha)
-            self.max_priority = max(self.max_priority, loss)
+        update = np.asarray(update)
+        self.merged_segment_tree.insert_batch(indices, np.power(update, self.alpha))
+        self.max_priority = np.max(update, initial=self.max_priority)
 
+    def store_memory(self, path, incremental=False, chunk_size=8192):
+        """
+        Stores records, priorities and index state as compressed, chunked files.
+
+        Args:
+            path (str): Checkpoint directory.
+            incremental (bool): If True and the last checkpoint of this memory went to `path`, only stores the
+                record chunks written since then. Priorities are always stored in full.
+            chunk_size (int): Records per chunk file.
+        """
+        arrays, counters = self._checkpoint_arrays()
+        written = None
+        if incremental and self.checkpoint_path == (path, chunk_size):
+            written = {name: (self.checkpoint_counters.get(name, 0), counter) for name, counter in counters.items()}
+        store_arrays(path, arrays, chunk_size=chunk_size, written=written, state=self._checkpoint_state())
+        self.checkpoint_path = (path, chunk_size)
+        self.checkpoint_counters = counters
+
+    def load_memory(self, path):
+        """
+        Restores a memory stored via `store_memory`. Capacity and storage mode must match.
+
+        Args:
+            path (str): Checkpoint directory.
+        """
+        arrays, state = load_arrays(path)
+        if state["capacity"] != self.capacity or state["columnar"] != self.columnar:
+            raise RLGraphError("Checkpoint in {} (capacity {}, columnar {}) does not match memory (capacity {}, "
+                               "columnar {}).".format(path, state["capacity"], state["columnar"], self.capacity,
+                                                      self.columnar))
+        self._restore_checkpoint(arrays, state)
+        # The next checkpoint is stored in full.
+        self.checkpoint_path = None
+        self.checkpoint_counters = None
+
+    def _checkpoint_arrays(self):
+        """
+        Returns:
+            tuple: Dict of arrays to store, dict mapping the names of ring-buffer arrays to their write counters.
+        """
+        arrays = dict(
+            sum_tree=self.merged_segment_tree.sum_segment_tree.values,
+            min_tree=self.merged_segment_tree.min_segment_tree.values
+        )
+        counters = {}
+        if self.columnar:
+            for key, column in (self.columns or {}).items():
+                arrays["columns/" + key] = column
+                counters["columns/" + key] = self.num_inserted
+        else:
+            for i, key in enumerate(self.record_keys):
+                values = [record[i] for record in self.memory_values]
+                if any(value is None or isinstance(value, (bytes, string_types)) for value in values):
+                    column = np.empty(shape=(len(values),), dtype=object)
+                    column[:] = values
+                else:
+                    column = np.asarray(values)
+                arrays["columns/" + key] = column
+                # Records are written at the same ring positions as in columnar mode.
+                counters["columns/" + key] = self.num_inserted
+        return arrays, counters
+
+    def _checkpoint_state(self):
+        return dict(
+            capacity=self.capacity,
+            columnar=self.columnar,
+            index=self.index,
+            size=self.size,
+            num_inserted=self.num_inserted,
+            max_priority=float(self.max_priority)
+        )
+
+    def _restore_checkpoint(self, arrays, state):
+        self.merged_segment_tree.sum_segment_tree.values[:] = arrays["sum_tree"]
+        self.merged_segment_tree.min_segment_tree.values[:] = arrays["min_tree"]
+        self.index = state["index"]
+        self.size = state["size"]
+        self.num_inserted = state["num_inserted"]
+        self.max_priority = state["max_priority"]
+
+        columns = {name[len("columns/"):]: array for name, array in arrays.items() if name.startswith("columns/")}
+        if self.columnar:
+            if len(columns) > 0 and self.columns is None:
+                self.columns = self._create_columns(columns)
+            for key, column in (self.columns or {}).items():
+                column[:] = columns[key]
+        else:
+            self.memory_values = [tuple(columns[key][i] for key in self.record_keys) for i in range_(self.size)]
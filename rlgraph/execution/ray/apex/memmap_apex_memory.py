@@ -0,0 +1,170 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+from six.moves import xrange as range_
+
+from rlgraph.execution.ray.apex.apex_memory import ApexMemory
+from rlgraph.execution.ray.ray_util import decompress_states
+
+
+class MemmapApexMemory(ApexMemory):
+    """
+    Apex prioritized replay whose record columns live in `np.memmap` files, so capacity is bounded by disk instead
+    of RAM. Priorities (two float64 trees of 2 * capacity entries each) stay in memory.
+
+    Columns are split into chunks of `chunk_size` consecutive slots. Chunks touched by the most recent inserts are
+    kept in an in-memory cache (written through to the files), reads of cached chunks are served from RAM. Reads
+    of all other slots are gathered from the files in sorted index order to keep disk access sequential.
+    """
+    def __init__(self, capacity=1000, alpha=1.0, beta=1.0, directory=None, chunk_size=4096, cache_chunks=16):
+        """
+        Args:
+            capacity (int): Max capacity.
+            alpha (float): Initial weight.
+            beta (float): Prioritisation factor.
+            directory (Optional[str]): Directory for the column files. Defaults to a temporary directory which
+                is removed by `close()`.
+            chunk_size (int): Number of slots per cached chunk.
+            cache_chunks (int): Number of recently written chunks kept in memory.
+        """
+        super(MemmapApexMemory, self).__init__(capacity=capacity, alpha=alpha, beta=beta, columnar=True)
+        self.owns_directory = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix="rlgraph-replay-")
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self.chunk_size = chunk_size
+        self.cache_chunks = cache_chunks
+        # Maps chunk id -> dict of column key -> in-memory copy of the chunk, oldest first.
+        self.chunk_cache = OrderedDict()
+
+    def insert_batch(self, records):
+        # Compressed states cannot be memory mapped, store them decompressed.
+        records = dict(records)
+        for key in ["states", "next_states"]:
+            records[key] = decompress_states(records[key])
+        super(MemmapApexMemory, self).insert_batch(records)
+        # Only the last `capacity` records were written, ending at the new index.
+        num_written = min(len(records["rewards"]), self.capacity)
+        self._cache_written((self.index - num_written) % self.capacity, num_written)
+
+    def _create_columns(self, records):
+        columns = {}
+        for key in self.column_keys:
+            if key == "importance_weights":
+                shape, dtype = (), np.float64
+            else:
+                values = np.asarray(records[key])
+                shape, dtype = values.shape[1:], values.dtype
+            columns[key] = np.lib.format.open_memmap(
+                os.path.join(self.directory, "{}.npy".format(key)), mode="w+", dtype=dtype,
+                shape=(self.capacity,) + tuple(shape)
+            )
+        columns["importance_weights"][:] = 1.0
+        return columns
+
+    def _chunk_bounds(self, chunk_id):
+        return chunk_id * self.chunk_size, min((chunk_id + 1) * self.chunk_size, self.capacity)
+
+    def _cache_written(self, start, num_records):
+        """
+        Updates the cache for the chunks covering the `num_records` slots written from `start` on. Chunks already
+        cached only copy the written slots, other chunks are loaded in full.
+        """
+        if self.cache_chunks <= 0 or num_records == 0:
+            return
+        end = start + num_records
+        # Written slot ranges, split at wrap-around.
+        written = [(start, min(end, self.capacity))]
+        if end > self.capacity:
+            written.append((0, end - self.capacity))
+        num_chunks = (self.capacity + self.chunk_size - 1) // self.chunk_size
+        # Chunk ids in write order (newest last), unique across wrap-around.
+        chunk_ids = list(OrderedDict.fromkeys(
+            chunk_id % num_chunks for chunk_id in range_(start // self.chunk_size, (end - 1) // self.chunk_size + 1)
+        ))
+        for chunk_id in chunk_ids[-self.cache_chunks:]:
+            chunk_start, chunk_end = self._chunk_bounds(chunk_id)
+            chunk = self.chunk_cache.pop(chunk_id, None)
+            if chunk is None:
+                chunk = {
+                    key: np.array(column[chunk_start:chunk_end]) for key, column in self.columns.items()
+                    if key != "importance_weights"
+                }
+            else:
+                for write_start, write_end in written:
+                    low, high = max(write_start, chunk_start), min(write_end, chunk_end)
+                    if low < high:
+                        for key, values in chunk.items():
+                            values[low - chunk_start:high - chunk_start] = self.columns[key][low:high]
+            # (Re-)inserted as the most recently written chunk.
+            self.chunk_cache[chunk_id] = chunk
+            if len(self.chunk_cache) > self.cache_chunks:
+                self.chunk_cache.popitem(last=False)
+
+    def _read_columns(self, indices):
+        indices = np.asarray(indices)
+        chunk_ids = indices // self.chunk_size
+        cached = np.isin(chunk_ids, list(self.chunk_cache.keys()))
+        uncached = np.flatnonzero(~cached)
+        # Sorted reads from disk.
+        disk_order = uncached[np.argsort(indices[uncached])]
+
+        records = {}
+        for key, column in self.columns.items():
+            if key == "importance_weights":
+                continue
+            values = np.empty(shape=(len(indices),) + column.shape[1:], dtype=column.dtype)
+            if len(disk_order) > 0:
+                values[disk_order] = column[indices[disk_order]]
+            records[key] = values
+
+        for chunk_id in np.unique(chunk_ids[cached]):
+            positions = np.flatnonzero(chunk_ids == chunk_id)
+            offsets = indices[positions] - chunk_id * self.chunk_size
+            for key, chunk in self.chunk_cache[int(chunk_id)].items():
+                records[key][positions] = chunk[offsets]
+        return records
+
+    def _restore_checkpoint(self, arrays, state):
+        super(MemmapApexMemory, self)._restore_checkpoint(arrays, state)
+        self.chunk_cache.clear()
+
+    def flush(self):
+        """
+        Flushes pending writes of all column files to disk.
+        """
+        if self.columns is not None:
+            for column in self.columns.values():
+                column.flush()
+
+    def close(self):
+        """
+        Closes the column files and removes the directory if it was created by this memory.
+        """
+        self.flush()
+        self.columns = None
+        self.chunk_cache.clear()
+        if self.owns_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
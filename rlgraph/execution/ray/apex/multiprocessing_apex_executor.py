@@ -0,0 +1,478 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import traceback
+from collections import deque
+from copy import deepcopy
+from multiprocessing import connection
+
+import numpy as np
+from six.moves import xrange as range_
+
+from rlgraph.agents import Agent
+from rlgraph.environments import Environment
+from rlgraph.execution.ray import RayValueWorker
+from rlgraph.execution.ray.apex.apex_executor import UpdateWorker
+from rlgraph.execution.ray.apex.ray_memory_actor import RayMemoryActor
+from rlgraph.execution.ray.apex.shared_apex_memory import SharedApexMemory
+from rlgraph.execution.ray.ray_executor import RayExecutor
+from rlgraph.execution.ray.ray_util import worker_exploration, WeightPublisher
+from rlgraph.execution.sharded_replay import ShardedReplay
+from rlgraph.utils import util
+from rlgraph.utils.rlgraph_errors import RLGraphError
+
+
+def _run_sample_worker(agent_config, worker_spec, env_spec, frameskip, pipe, sample_queues):
+    """
+    Main loop of a sample worker process. Executes commands received via `pipe`:
+
+    - ("sample", shard_id): Collects a sample, puts it on the sample queue of the shard and replies
+        ("sampled", (batch size, policy version)).
+    - ("set_weights", weights): Sets the published weights.
+    - ("stats", None): Replies ("stats", workload statistics).
+    - ("stop", None): Exits.
+    """
+    try:
+        worker = RayValueWorker(agent_config, worker_spec, env_spec, frameskip)
+    except Exception:
+        pipe.send(("error", traceback.format_exc()))
+        return
+    pipe.send(("ready", None))
+
+    while True:
+        command, arg = pipe.recv()
+        try:
+            if command == "sample":
+                env_sample = worker.execute_and_get_timesteps(num_timesteps=worker.worker_sample_size)
+                sample_queues[arg].put(env_sample)
+                pipe.send(("sampled", (env_sample.batch_size, env_sample.metrics["policy_version"])))
+            elif command == "set_weights":
+                worker.set_weights(arg)
+            elif command == "stats":
+                pipe.send(("stats", worker.get_workload_statistics()))
+            elif command == "stop":
+                break
+        except Exception:
+            pipe.send(("error", traceback.format_exc()))
+            break
+
+
+def _run_replay_memory(apex_replay_spec, sample_queue):
+    """
+    Main loop of a replay process: Inserts env samples from `sample_queue` into a shared memory shard until
+    receiving None.
+    """
+    memory_actor = RayMemoryActor(apex_replay_spec)
+    while True:
+        env_sample = sample_queue.get()
+        if env_sample is None:
+            break
+        memory_actor.observe(env_sample)
+    memory_actor.close()
+
+
+class SharedMemoryShardedReplay(ShardedReplay):
+    """
+    Sharded replay over `SharedApexMemory` shards owned by the driver. Env samples are routed to the sample
+    queue of a replay process which decompresses and inserts them, batches and priority updates go directly
+    through shared memory. Like `RayShardedReplay`, back-pressure is non-blocking.
+    """
+    def __init__(self, memories, sample_queues, min_sample_memory_size, routing="round_robin",
+                 samples_per_insert=None, min_size_to_sample=1, error_buffer=None):
+        """
+        Args:
+            memories (list): `SharedApexMemory` per shard.
+            sample_queues (list): Sample queue of the replay process inserting into each shard.
+            min_sample_memory_size (int): Records a shard must hold before it is sampled.
+
+        See `ShardedReplay` for the remaining args.
+        """
+        super(SharedMemoryShardedReplay, self).__init__(
+            num_shards=len(memories), shard_capacity=memories[0].capacity, routing=routing,
+            samples_per_insert=samples_per_insert, min_size_to_sample=min_size_to_sample, error_buffer=error_buffer
+        )
+        self.memories = memories
+        self.sample_queues = sample_queues
+        self.min_sample_memory_size = min_sample_memory_size
+
+    def can_insert(self, num_records):
+        return self.rate_limiter.can_insert(num_records)
+
+    def can_sample(self, num_records):
+        return self.rate_limiter.can_sample(num_records)
+
+    def insert(self, env_sample, shard_id=None, timeout=None):
+        shard_id = self.route(shard_id)
+        self.sample_queues[shard_id].put(env_sample)
+        self.record_insert(shard_id, env_sample.batch_size)
+        return True
+
+    def sample_shard(self, shard_id, batch_size):
+        """
+        Samples a batch from one shard.
+
+        Returns:
+            Optional[dict]: Batch including "indices" and "importance_weights", or None if the shard is not
+                filled yet or sampling is held back by the rate limiter.
+        """
+        memory = self.memories[shard_id]
+        if memory.size < self.min_sample_memory_size or not self.rate_limiter.can_sample(batch_size):
+            return None
+        self.rate_limiter.sample(batch_size)
+        records, indices, weights = memory.get_records(batch_size)
+        # Shared memory batches are views of buffers reused by the next call.
+        batch = {key: np.array(value) for key, value in records.items()}
+        batch["indices"] = indices
+        batch["importance_weights"] = weights
+        return batch
+
+    def sample_from_all_shards(self, batch_size, timeout=None):
+        if not self.rate_limiter.can_sample(batch_size):
+            return None
+        self.rate_limiter.sample(batch_size)
+
+        shard_batches = []
+        for shard_id, num_records in enumerate(self.split_batch_size(batch_size)):
+            memory = self.memories[shard_id]
+            if num_records > 0 and memory.size >= self.min_sample_memory_size:
+                records, indices, weights = memory.get_records(int(num_records))
+                shard_batches.append((shard_id, records, indices, weights))
+        if len(shard_batches) == 0:
+            return None
+        return self.merge_shard_batches(shard_batches)
+
+    def update_priorities(self, shard_ids, indices, loss):
+        shard_ids = np.asarray(shard_ids)
+        indices = np.asarray(indices)
+        loss = np.asarray(loss)
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            self.memories[shard_id].update_records(indices[mask], loss[mask])
+
+
+class MultiprocessingApexExecutor(RayExecutor):
+    """
+    Implements Ape-X on a single machine without Ray: Sample workers and replay shards run in local processes,
+    the learner runs in a thread of the driver process.
+
+    Sample worker processes run `RayValueWorker`s and receive commands and weights via pipes. Samples are
+    passed on queues to replay processes, which insert them into `SharedApexMemory` shards. The driver samples
+    learner batches and updates priorities directly in shared memory. Reads the same `ray_spec` as the
+    `ApexExecutor` and reports the same metrics.
+    """
+    def __init__(self, environment_spec, agent_config, discard_queued_samples=False):
+        """
+        Args:
+            environment_spec (dict): Environment spec. Each worker process will instantiate
+                an environment using this spec.
+            agent_config (dict): Config dict containing agent and execution specs.
+            discard_queued_samples (bool): If true, discard samples if the learner queue is full instead
+                of blocking until free.
+        """
+        ray_spec = agent_config["execution_spec"].pop("ray_spec")
+        self.apex_replay_spec = ray_spec.pop("apex_replay_spec")
+        self.worker_spec = ray_spec.pop("worker_spec")
+        self.discard_queued_samples = discard_queued_samples
+        super(MultiprocessingApexExecutor, self).__init__(executor_spec=ray_spec.pop("executor_spec"),
+                                                          environment_spec=environment_spec,
+                                                          worker_spec=self.worker_spec)
+
+        # Must specify an agent type.
+        assert "type" in agent_config
+        self.agent_config = agent_config
+
+        # Processes are spawned by default, as forking a process holding a TF session is unsafe.
+        self.mp_context = multiprocessing.get_context(self.executor_spec.get("start_method", "spawn"))
+        self.task_wait_timeout = self.executor_spec.get("task_wait_timeout", 0.1)
+        self.replay_batch_size = self.agent_config["update_spec"]["batch_size"]
+        self.replay_routing = self.executor_spec.get("replay_routing", "round_robin")
+        self.samples_per_insert = self.executor_spec.get("samples_per_insert", None)
+        self.throttled_env_workers = []
+
+        # How often weights are synced to workers.
+        self.weight_sync_steps = self.executor_spec["weight_sync_steps"]
+        self.weight_publisher = WeightPublisher(encoding=self.executor_spec.get("weight_encoding", "none"))
+        self.worker_weight_versions = {}
+        self.weight_syncs_executed = 0
+        self.steps_since_weights_synced = {}
+
+        self.env_interaction_task_depth = self.executor_spec["env_interaction_task_depth"]
+        self.worker_sample_size = self.executor_spec["num_worker_samples"] + self.worker_spec["n_step_adjustment"] - 1
+        # Samples are pickled through local queues, compressing them costs more than it saves.
+        self.worker_spec.setdefault("state_codec", "none")
+
+        # Worker id -> pipe, pending shard ids of scheduled samples and process.
+        self.worker_pipes = {}
+        self.pending_shard_ids = {}
+        self.worker_processes = []
+        self.replay_processes = []
+        self.replay_memories = []
+        self.sample_queues = []
+
+        assert not ray_spec, "ERROR: ray_spec still contains items: {}".format(ray_spec)
+        self.logger.info("Setting up execution for multiprocessing Apex executor.")
+        self.setup_execution()
+
+    def setup_execution(self):
+        # Create local worker agent according to spec.
+        environment = Environment.from_spec(self.environment_spec)
+        self.agent_config["state_space"] = environment.state_space
+        self.agent_config["action_space"] = environment.action_space
+        self.local_agent = Agent.from_spec(self.agent_config)
+
+        # Set up worker thread for performing updates.
+        self.update_worker = UpdateWorker(
+            agent=self.local_agent,
+            in_queue_size=self.executor_spec["learn_queue_size"],
+            num_feeder_threads=self.executor_spec.get("num_feeder_threads", 1),
+            prefetch_depth=self.executor_spec.get("prefetch_depth", 2)
+        )
+
+        self.num_replay_workers = self.executor_spec["num_replay_workers"]
+        self.num_sample_workers = self.executor_spec["num_sample_workers"]
+
+        # Shared memory shards are owned by the driver, replay processes attach to them.
+        self.logger.info("Initializing {} shared memory replay shards.".format(self.num_replay_workers))
+        memory_spec = self.apex_replay_spec["memory_spec"]
+        shard_size = int(memory_spec["capacity"] / self.num_replay_workers)
+        min_sample_size = self.apex_replay_spec["min_sample_memory_size"]
+        state_space = self.local_agent.preprocessed_state_space
+        action_space = self.local_agent.action_space
+        shared_memory_spec = dict(
+            type="shared_apex_memory",
+            capacity=shard_size,
+            alpha=memory_spec.get("alpha", 1.0),
+            beta=memory_spec.get("beta", 1.0),
+            state_shape=state_space.shape,
+            state_dtype=util.convert_dtype(state_space.dtype, to="np"),
+            action_shape=action_space.shape,
+            action_dtype=util.convert_dtype(action_space.dtype, to="np")
+        )
+        for _ in range_(self.num_replay_workers):
+            memory = SharedApexMemory(max_batch_size=self.replay_batch_size, mp_context=self.mp_context, **{
+                key: value for key, value in shared_memory_spec.items() if key != "type"
+            })
+            replay_spec = deepcopy(self.apex_replay_spec)
+            replay_spec["memory_spec"] = dict(shared_memory_spec, _attach_handle=memory.handle())
+            replay_spec["sample_batch_size"] = self.replay_batch_size
+            sample_queue = self.mp_context.Queue()
+            process = self.mp_context.Process(target=_run_replay_memory, args=(replay_spec, sample_queue))
+            process.daemon = True
+            process.start()
+            self.replay_memories.append(memory)
+            self.sample_queues.append(sample_queue)
+            self.replay_processes.append(process)
+
+        self.sharded_replay = SharedMemoryShardedReplay(
+            memories=self.replay_memories,
+            sample_queues=self.sample_queues,
+            min_sample_memory_size=int(min_sample_size / self.num_replay_workers),
+            routing=self.replay_routing,
+            samples_per_insert=self.samples_per_insert,
+            min_size_to_sample=min_sample_size
+        )
+
+        # Create sample worker processes.
+        self.worker_spec["worker_sample_size"] = self.worker_sample_size
+        self.logger.info("Initializing {} data collection processes, sample size: {}".format(
+            self.num_sample_workers, self.worker_spec["worker_sample_size"]))
+        ray_constant_exploration = self.worker_spec.get("ray_constant_exploration", False)
+        self.ray_env_sample_workers = []
+        for i in range_(self.num_sample_workers):
+            worker_spec = deepcopy(self.worker_spec)
+            if ray_constant_exploration is True:
+                worker_spec["ray_exploration"] = worker_exploration(i, self.num_sample_workers)
+            worker_id = "worker_{}".format(i)
+            pipe, worker_pipe = self.mp_context.Pipe()
+            process = self.mp_context.Process(target=_run_sample_worker, args=(
+                deepcopy(self.agent_config), worker_spec, self.environment_spec, self.worker_frameskip,
+                worker_pipe, self.sample_queues
+            ))
+            process.daemon = True
+            process.start()
+            self.worker_ids[worker_id] = worker_id
+            self.worker_pipes[worker_id] = pipe
+            self.pending_shard_ids[worker_id] = deque()
+            self.worker_processes.append(process)
+            self.ray_env_sample_workers.append(worker_id)
+        self.test_worker_init()
+        self.init_tasks()
+
+    def test_worker_init(self):
+        for worker_id in self.ray_env_sample_workers:
+            self._receive(worker_id, "ready")
+            self.logger.info("Successfully built agent {}.".format(worker_id))
+
+    def init_tasks(self):
+        # Start learner thread.
+        self.update_worker.start()
+
+        self.weight_publisher.publish(self.local_agent.get_weights())
+        for worker_id in self.ray_env_sample_workers:
+            self.worker_weight_versions[worker_id] = 0
+            self._sync_worker_weights(worker_id)
+            self.steps_since_weights_synced[worker_id] = 0
+            for _ in range_(self.env_interaction_task_depth):
+                self._schedule_env_sample_task(worker_id)
+
+    def _receive(self, worker_id, expected):
+        """
+        Receives messages from a worker until one with tag `expected` arrives. Completed samples arriving in
+        between are recorded, their workers are rescheduled on the next step.
+
+        Returns:
+            any: Payload of the expected message.
+        """
+        while True:
+            tag, payload = self.worker_pipes[worker_id].recv()
+            if tag == "error":
+                raise RLGraphError("Sample worker {} failed:\n{}".format(worker_id, payload))
+            elif tag == expected:
+                return payload
+            elif tag == "sampled":
+                self._on_sample_done(worker_id, *payload)
+                self.throttled_env_workers.append(worker_id)
+
+    def _sync_worker_weights(self, worker_id):
+        """
+        Sends the latest published weights to a worker unless it already holds them.
+
+        Returns:
+            bool: True if weights were sent.
+        """
+        weights = self.weight_publisher.weights_for(self.worker_weight_versions[worker_id])
+        if weights is None:
+            return False
+        self.worker_pipes[worker_id].send(("set_weights", weights))
+        self.worker_weight_versions[worker_id] = self.weight_publisher.version
+        return True
+
+    def _schedule_env_sample_task(self, worker_id):
+        """
+        Schedules an env sample task unless collection is too far ahead of learning.
+        """
+        if self.sharded_replay.can_insert(self.worker_sample_size):
+            shard_id = self.sharded_replay.route()
+            self.pending_shard_ids[worker_id].append(shard_id)
+            self.worker_pipes[worker_id].send(("sample", shard_id))
+        else:
+            self.throttled_env_workers.append(worker_id)
+
+    def _on_sample_done(self, worker_id, sample_steps, policy_version):
+        """
+        Records a sample a worker has put on the sample queue of its shard, and syncs weights to the worker.
+        """
+        self.sharded_replay.record_insert(self.pending_shard_ids[worker_id].popleft(), sample_steps)
+        self.policy_lags.append(self.weight_publisher.version - policy_version)
+
+        self.steps_since_weights_synced[worker_id] += sample_steps
+        if self.steps_since_weights_synced[worker_id] >= self.weight_sync_steps:
+            # Publish a new version only if the learner updated since the last one.
+            if self.update_worker.update_done:
+                self.update_worker.update_done = False
+                self.weight_publisher.publish(self.local_agent.get_weights())
+            if self._sync_worker_weights(worker_id):
+                self.weight_syncs_executed += 1
+            self.steps_since_weights_synced[worker_id] = 0
+
+    def _fetch_worker_metrics(self):
+        results = list()
+        for worker_id in self.ray_env_sample_workers:
+            self.logger.info("Retrieving workload statistics for worker: {}".format(worker_id))
+            self.worker_pipes[worker_id].send(("stats", None))
+            results.append((worker_id, self._receive(worker_id, "stats")))
+        return results
+
+    def result_by_worker(self, worker_index=None):
+        worker_id = self.ray_env_sample_workers[worker_index or 0]
+        self.worker_pipes[worker_id].send(("stats", None))
+        metrics = self._receive(worker_id, "stats")
+        return dict(
+            episode_rewards=metrics["episode_rewards"],
+            episode_timesteps=metrics["episode_timesteps"]
+        )
+
+    def _execute_step(self):
+        """
+        Executes one step of the workload:
+
+        - Record samples finished by worker processes, sync weights and reschedule the workers
+        - Sample batches from replay shards in shared memory and pass them to the learner thread
+        - Update priorities in shared memory using loss values produced by the learner
+        """
+        env_steps = 0
+        update_steps = 0
+        discarded = 0
+        queue_inserts = 0
+
+        # 0. Resume workers held back by the rate limiter, or which finished while fetching statistics.
+        throttled_env_workers, self.throttled_env_workers = self.throttled_env_workers, []
+        for worker_id in throttled_env_workers:
+            self._schedule_env_sample_task(worker_id)
+
+        # 1. Block until a worker finished a sample, unless learner results are waiting to be processed.
+        timeout = self.task_wait_timeout if self.update_worker.output_queue.empty() else 0.0
+        pipes = {pipe: worker_id for worker_id, pipe in self.worker_pipes.items()}
+        for pipe in connection.wait(list(pipes.keys()), timeout=timeout):
+            worker_id = pipes[pipe]
+            tag, payload = pipe.recv()
+            if tag == "error":
+                raise RLGraphError("Sample worker {} failed:\n{}".format(worker_id, payload))
+            sample_steps, policy_version = payload
+            self._on_sample_done(worker_id, sample_steps, policy_version)
+            env_steps += sample_steps
+            self._schedule_env_sample_task(worker_id)
+
+        # 2. Sample one batch per shard for the learner.
+        for shard_id in range_(self.num_replay_workers):
+            if self.update_worker.input_queue.full():
+                if self.discard_queued_samples:
+                    discarded += 1
+                continue
+            sampled_batch = self.sharded_replay.sample_shard(shard_id, self.replay_batch_size)
+            if sampled_batch is not None:
+                self.update_worker.input_queue.put((shard_id, sampled_batch))
+                queue_inserts += 1
+
+        # 3. Update priorities in the shards using loss values produced by update worker.
+        while not self.update_worker.output_queue.empty():
+            shard_id, indices, loss_per_item = self.update_worker.output_queue.get()
+            self.replay_memories[shard_id].update_records(indices, loss_per_item)
+            update_steps += len(indices)
+
+        return env_steps, update_steps, discarded, queue_inserts
+
+    def stop(self):
+        """
+        Stops all worker and replay processes and frees the shared memory shards.
+        """
+        for worker_id, pipe in self.worker_pipes.items():
+            pipe.send(("stop", None))
+        for process in self.worker_processes:
+            process.join()
+        for sample_queue in self.sample_queues:
+            sample_queue.put(None)
+        for process in self.replay_processes:
+            process.join()
+        for memory in self.replay_memories:
+            memory.close()
+        self.worker_processes = []
+        self.replay_processes = []
+        self.replay_memories = []
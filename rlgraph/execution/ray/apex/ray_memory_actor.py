@@ -18,7 +18,6 @@ from __future__ import division
 from __future__ import print_function
 
 import numpy as np
-from six.moves import xrange as range_
 from rlgraph import get_distributed_backend
 from rlgraph.execution.ray.apex.apex_memory import ApexMemory
 from rlgraph.execution.ray.ray_actor import RayActor
@@ -36,22 +35,29 @@ class RayMemoryActor(RayActor):
         Args:
             apex_replay_spec (dict): Specifies behaviour of this replay actor. Must contain key "memory_spec".
         """
-        # N.b. The memory spec contains type PrioritizedReplay because that is
-        # used for the agent. We hence do not use from_spec but just read the relevant
-        # args.
+        # N.b. The memory spec may contain type PrioritizedReplay because that is
+        # used for the agent. We hence only use the type if it names an Apex memory (e.g.
+        # "apex_frame_memory") and otherwise just read the relevant args.
         self.min_sample_memory_size = apex_replay_spec["min_sample_memory_size"]
         self.clip_rewards = apex_replay_spec.get("clip_rewards", True)
         self.sample_batch_size = apex_replay_spec["sample_batch_size"]
-        self.memory = ApexMemory(**apex_replay_spec["memory_spec"])
+        memory_spec = dict(apex_replay_spec["memory_spec"])
+        memory_type = memory_spec.pop("type", None)
+        if ApexMemory.lookup_class(memory_type) is None:
+            memory_type = None
+        self.memory = ApexMemory.from_spec(memory_type, **memory_spec)
 
     @classmethod
     def as_remote(cls, num_cpus=None, num_gpus=None):
         return ray.remote(num_cpus=num_cpus, num_gpus=num_gpus)(cls)
 
-    def get_batch(self):
+    def get_batch(self, batch_size=None):
         """
         Samples a batch from the replay memory.
 
+        Args:
+            batch_size (Optional[int]): Number of records to sample. Defaults to the configured sample batch size.
+
         Returns:
             dict: Sample batch
 
@@ -59,7 +65,7 @@ class RayMemoryActor(RayActor):
         if self.memory.size < self.min_sample_memory_size:
             return None
         else:
-            batch, indices, weights = self.memory.get_records(self.sample_batch_size)
+            batch, indices, weights = self.memory.get_records(batch_size or self.sample_batch_size)
             # Merge into one dict to only return one future in ray.
             batch["indices"] = indices
             batch["importance_weights"] = weights
@@ -72,29 +78,20 @@ class RayMemoryActor(RayActor):
         N.b. For performance reason, data layout is slightly different for apex.
         """
         records = env_sample.get_batch()
-        num_records = len(records['states'])
 
         # TODO port to tf PR behaviour.
         if self.clip_rewards:
             rewards = np.sign(records["rewards"])
         else:
             rewards = records["rewards"]
-        for i in range_(num_records):
-            self.memory.insert_records((
-                records["states"][i],
-                records["actions"][i],
-                rewards[i],
-                records["terminals"][i],
-                records["next_states"][i],
-                records["importance_weights"][i]
-            ))
-            # self.memory.insert_records((
-            #     records["states"][i],
-            #     records["actions"][i],
-            #     rewards[i],
-            #     records["terminals"][i],
-            #     records["importance_weights"][i]
-            # ))
+        self.memory.insert_batch(dict(
+            states=records["states"],
+            actions=records["actions"],
+            rewards=rewards,
+            terminals=records["terminals"],
+            next_states=records["next_states"],
+            importance_weights=records["importance_weights"]
+        ))
 
     def update_priorities(self, indices, loss):
         """
@@ -105,4 +102,28 @@ class RayMemoryActor(RayActor):
             indices (ndarray): Indices to update in replay memory.
             loss (ndarray):  Loss values for indices.
         """
-        self.memory.update_records(indices, loss)
\ No newline at end of file
+        self.memory.update_records(indices, loss)
+
+    def store_memory(self, path, incremental=False):
+        """
+        Checkpoints the replay memory, see `ApexMemory.store_memory`.
+        """
+        self.memory.store_memory(path, incremental=incremental)
+
+    def load_memory(self, path):
+        """
+        Restores the replay memory from a checkpoint.
+
+        Returns:
+            int: Size of the restored memory.
+        """
+        self.memory.load_memory(path)
+        return self.memory.size
+
+    def close(self):
+        """
+        Frees resources held by the replay memory, e.g. the blocks of a `SharedApexMemory`. Must be called before
+        the actor is terminated.
+        """
+        if hasattr(self.memory, "close"):
+            self.memory.close()
@@ -0,0 +1,102 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+from rlgraph import get_distributed_backend
+from rlgraph.execution.sharded_replay import ShardedReplay
+
+if get_distributed_backend() == "ray":
+    import ray
+
+
+class RayShardedReplay(ShardedReplay):
+    """
+    Sharded replay over `RayMemoryActor`s. Routing and rate limiting happen on the driver, so inserts never
+    wait for a remote call. Back-pressure is non-blocking: Callers check `can_insert` / `can_sample` and hold
+    back new tasks instead of waiting, `timeout` arguments are ignored.
+    """
+    def __init__(self, memory_actors, shard_capacity, routing="round_robin", samples_per_insert=None,
+                 min_size_to_sample=1, error_buffer=None):
+        """
+        Args:
+            memory_actors (list): Remote `RayMemoryActor` handles, one per shard.
+
+        See `ShardedReplay` for the remaining args.
+        """
+        super(RayShardedReplay, self).__init__(
+            num_shards=len(memory_actors), shard_capacity=shard_capacity, routing=routing,
+            samples_per_insert=samples_per_insert, min_size_to_sample=min_size_to_sample, error_buffer=error_buffer
+        )
+        self.memory_actors = memory_actors
+        self.shard_ids = {actor: shard_id for shard_id, actor in enumerate(memory_actors)}
+
+    def can_insert(self, num_records):
+        return self.rate_limiter.can_insert(num_records)
+
+    def can_sample(self, num_records):
+        return self.rate_limiter.can_sample(num_records)
+
+    def record_sample(self, num_records):
+        self.rate_limiter.sample(num_records)
+
+    def insert(self, env_sample, shard_id=None, timeout=None, num_records=None):
+        """
+        Routes a sample to a memory actor.
+
+        Args:
+            env_sample (Union[EnvironmentSample, ray.ObjectID]): Sample or object id of a sample.
+            num_records (int): Number of records in the sample, required since object ids are not resolved
+                on the driver.
+
+        Returns:
+            bool: Always True. Samples arriving here were already collected, so they are never dropped; callers
+                throttle collection via `can_insert` instead.
+        """
+        assert num_records is not None, "ERROR: Ray sharded replay needs the number of inserted records."
+        shard_id = self.route(shard_id)
+        self.memory_actors[shard_id].observe.remote(env_sample)
+        self.record_insert(shard_id, num_records)
+        return True
+
+    def sample_from_all_shards(self, batch_size, timeout=None):
+        if not self.rate_limiter.can_sample(batch_size):
+            return None
+        self.rate_limiter.sample(batch_size)
+
+        shard_batch_sizes = self.split_batch_size(batch_size)
+        shard_ids = [shard_id for shard_id, num_records in enumerate(shard_batch_sizes) if num_records > 0]
+        batches = ray.get([
+            self.memory_actors[shard_id].get_batch.remote(int(shard_batch_sizes[shard_id])) for shard_id in shard_ids
+        ])
+        shard_batches = [
+            (shard_id, batch, batch.pop("indices"), batch.pop("importance_weights"))
+            for shard_id, batch in zip(shard_ids, batches) if batch is not None
+        ]
+        if len(shard_batches) == 0:
+            return None
+        return self.merge_shard_batches(shard_batches)
+
+    def update_priorities(self, shard_ids, indices, loss):
+        shard_ids = np.asarray(shard_ids)
+        indices = np.asarray(indices)
+        loss = np.asarray(loss)
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            self.memory_actors[shard_id].update_priorities.remote(indices[mask], loss[mask])
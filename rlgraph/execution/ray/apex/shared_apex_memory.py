@@ -0,0 +1,243 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+
+import numpy as np
+
+from rlgraph.execution.ray.apex.apex_memory import ApexMemory
+from rlgraph.execution.ray.ray_util import decompress_states
+from rlgraph.utils.rlgraph_errors import RLGraphError
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+class SharedApexMemory(ApexMemory):
+    """
+    Apex prioritized replay whose record columns, priority trees and index state live in shared memory blocks.
+
+    One process creates (owns) the memory and inserts. Other processes or threads attach to it via `handle()` /
+    `attach(handle)` and sample by index directly from the shared columns, without pickling batches or passing
+    them through an object store. Sampled batches are gathered into per-instance preallocated buffers and returned
+    as views of these buffers, i.e. a batch is valid until the next `get_records` call of the same instance.
+
+    The handle carries a `multiprocessing` lock, so it can only be passed to threads or to child processes at
+    creation, not through pipes, queues or Ray calls. Child processes must be started from the context the lock
+    was created with (see `mp_context`).
+
+    As blocks must exist before readers attach, record shapes and dtypes are fixed at construction. Compressed
+    states are decompressed on insert.
+    """
+    def __init__(self, capacity=1000, alpha=1.0, beta=1.0, state_shape=(), state_dtype="float32",
+                 action_shape=(), action_dtype="int64", reward_dtype="float32", max_batch_size=None,
+                 mp_context=None, _attach_handle=None):
+        """
+        Args:
+            capacity (int): Max capacity.
+            alpha (float): Initial weight.
+            beta (float): Prioritisation factor.
+            state_shape (tuple): Shape of a single (uncompressed) state.
+            state_dtype (str): Dtype of states.
+            action_shape (tuple): Shape of a single action.
+            action_dtype (str): Dtype of actions.
+            reward_dtype (str): Dtype of rewards.
+            max_batch_size (Optional[int]): Size of the preallocated sample buffers. Larger batches are
+                allocated per call. Defaults to no preallocation before the first call.
+            mp_context (Optional[multiprocessing.context.BaseContext]): Context to create the lock with, i.e. the
+                context of the processes the handle is passed to. Defaults to the default context.
+        """
+        if shared_memory is None:
+            raise RLGraphError("SharedApexMemory requires multiprocessing.shared_memory (Python 3.8+).")
+        self.column_specs = dict(
+            states=(tuple(state_shape), np.dtype(state_dtype)),
+            actions=(tuple(action_shape), np.dtype(action_dtype)),
+            rewards=((), np.dtype(reward_dtype)),
+            terminals=((), np.dtype(bool)),
+            next_states=(tuple(state_shape), np.dtype(state_dtype)),
+            importance_weights=((), np.dtype(np.float64))
+        )
+        self.owner = _attach_handle is None
+        self.blocks = {}
+        self.lock = (mp_context or multiprocessing).RLock() if self.owner else _attach_handle["lock"]
+        # Header: index, size and number of inserted records (int64), max priority (float64).
+        self.header = self._create_array("header", (4,), np.int64, _attach_handle)
+        self.max_priority_view = self.header[3:4].view(np.float64)
+
+        # The base constructor resets index state, which must survive for attaching instances.
+        header = self.header.copy()
+        super(SharedApexMemory, self).__init__(capacity=capacity, alpha=alpha, beta=beta, columnar=True)
+        if not self.owner:
+            self.header[:] = header
+
+        # Move segment trees into shared memory, preserving their neutral-element initialization.
+        for name, tree in [("sum_tree", self.merged_segment_tree.sum_segment_tree),
+                           ("min_tree", self.merged_segment_tree.min_segment_tree)]:
+            values = self._create_array(name, tree.values.shape, np.float64, _attach_handle)
+            if self.owner:
+                values[:] = tree.values
+            tree.values = values
+
+        self.columns = {
+            key: self._create_array(key, (self.capacity,) + shape, dtype, _attach_handle)
+            for key, (shape, dtype) in self.column_specs.items()
+        }
+        if self.owner:
+            self.columns["importance_weights"][:] = 1.0
+            self.index = 0
+            self.size = 0
+            self.num_inserted = 0
+            self.max_priority = 1.0
+
+        self.sample_buffers = None
+        if max_batch_size is not None:
+            self.sample_buffers = self._create_sample_buffers(max_batch_size)
+
+    def _create_array(self, name, shape, dtype, attach_handle):
+        """
+        Creates (owner) or attaches to a shared memory block and returns an array view of it.
+        """
+        num_bytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        if attach_handle is None:
+            block = shared_memory.SharedMemory(create=True, size=num_bytes)
+        else:
+            block = shared_memory.SharedMemory(name=attach_handle["blocks"][name])
+        self.blocks[name] = block
+        return np.ndarray(shape=shape, dtype=dtype, buffer=block.buf)
+
+    def _create_sample_buffers(self, batch_size):
+        return {
+            key: np.empty(shape=(batch_size,) + shape, dtype=dtype)
+            for key, (shape, dtype) in self.column_specs.items() if key != "importance_weights"
+        }
+
+    # Index state lives in the shared header so all attached instances see the writer's progress.
+    @property
+    def index(self):
+        return int(self.header[0])
+
+    @index.setter
+    def index(self, value):
+        self.header[0] = value
+
+    @property
+    def size(self):
+        return int(self.header[1])
+
+    @size.setter
+    def size(self, value):
+        self.header[1] = value
+
+    @property
+    def num_inserted(self):
+        return int(self.header[2])
+
+    @num_inserted.setter
+    def num_inserted(self, value):
+        self.header[2] = value
+
+    @property
+    def max_priority(self):
+        return float(self.max_priority_view[0])
+
+    @max_priority.setter
+    def max_priority(self, value):
+        self.max_priority_view[0] = value
+
+    def handle(self):
+        """
+        Returns:
+            dict: Handle to pass to threads or to child processes (at creation) to `attach` to this memory.
+        """
+        return dict(
+            blocks={name: block.name for name, block in self.blocks.items()},
+            lock=self.lock,
+            capacity=self.capacity,
+            alpha=self.alpha,
+            beta=self.beta,
+            column_specs={key: (shape, dtype.str) for key, (shape, dtype) in self.column_specs.items()}
+        )
+
+    @staticmethod
+    def attach(handle, max_batch_size=None):
+        """
+        Attaches to a shared memory created by another instance.
+
+        Args:
+            handle (dict): Handle returned by `handle()` of the owning instance.
+            max_batch_size (Optional[int]): Size of the preallocated sample buffers.
+
+        Returns:
+            SharedApexMemory: A view of the same memory. Inserting, sampling and priority updates are all supported.
+        """
+        specs = handle["column_specs"]
+        return SharedApexMemory(
+            capacity=handle["capacity"], alpha=handle["alpha"], beta=handle["beta"],
+            state_shape=specs["states"][0], state_dtype=specs["states"][1],
+            action_shape=specs["actions"][0], action_dtype=specs["actions"][1],
+            reward_dtype=specs["rewards"][1], max_batch_size=max_batch_size, _attach_handle=handle
+        )
+
+    def _create_columns(self, records):
+        raise RLGraphError("Columns of a SharedApexMemory are preallocated.")
+
+    def insert_records(self, record):
+        with self.lock:
+            super(SharedApexMemory, self).insert_records(record)
+
+    def insert_batch(self, records):
+        records = dict(records)
+        for key in ["states", "next_states"]:
+            records[key] = decompress_states(records[key])
+        with self.lock:
+            super(SharedApexMemory, self).insert_batch(records)
+
+    def _read_columns(self, indices):
+        num_records = len(indices)
+        if self.sample_buffers is None or len(self.sample_buffers["states"]) < num_records:
+            self.sample_buffers = self._create_sample_buffers(num_records)
+        records = {}
+        for key, buffer in self.sample_buffers.items():
+            records[key] = np.take(self.columns[key], indices, axis=0, out=buffer[:num_records])
+        return records
+
+    def get_records(self, num_records):
+        with self.lock:
+            return super(SharedApexMemory, self).get_records(num_records)
+
+    def update_records(self, indices, update):
+        with self.lock:
+            super(SharedApexMemory, self).update_records(indices, update)
+
+    def close(self):
+        """
+        Detaches from the shared blocks. The owner also frees them.
+        """
+        self.columns = None
+        self.header = self.max_priority_view = None
+        self.merged_segment_tree.sum_segment_tree.values = None
+        self.merged_segment_tree.min_segment_tree.values = None
+        self.sample_buffers = None
+        for block in self.blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+        self.blocks = {}
@@ -26,6 +26,7 @@ import time
 from rlgraph import get_distributed_backend
 from rlgraph.agents import Agent
 from rlgraph.environments import Environment
+from rlgraph.execution.ray.adaptive_sample_controller import AdaptiveSampleController
 from rlgraph.execution.ray.ray_util import worker_exploration
 
 if get_distributed_backend() == "ray":
@@ -61,11 +62,23 @@ class RayExecutor(object):
         self.sample_iteration_throughputs = None
         self.update_iteration_throughputs = None
         self.iteration_times = None
+        # Number of weight versions each collected sample lagged behind the learner.
+        self.policy_lags = []
         self.worker_frameskip = worker_spec.get("frame_skip", 1)
         self.env_internal_frame_skip = environment_spec.get("frameskip", 1)
 
         # Map worker objects to host ids.
         self.worker_ids = {}
+        # Final statistics of sample workers retired before the end of the workload.
+        self.retired_worker_metrics = []
+
+        # Adapts sample sizes, task depths and the number of sample workers online, if configured.
+        self.sample_controller = None
+        adaptive_sampling_spec = executor_spec.get("adaptive_sampling", None)
+        if adaptive_sampling_spec is not None:
+            self.sample_controller = AdaptiveSampleController(
+                task_depth=executor_spec.get("env_interaction_task_depth", 1), **adaptive_sampling_spec
+            )
 
     def ray_init(self):
         """
@@ -103,9 +116,14 @@ class RayExecutor(object):
 
         # Create remote objects and schedule init tasks.
         ray_constant_exploration = worker_spec.get("ray_constant_exploration", False)
-        for i in range_(num_actors):
+        # Workers added later continue the exploration schedule over the max. number of workers.
+        first_index = len(self.worker_ids)
+        num_exploration_workers = first_index + num_actors
+        if self.sample_controller is not None and self.sample_controller.max_workers is not None:
+            num_exploration_workers = max(num_exploration_workers, self.sample_controller.max_workers)
+        for i in range_(first_index, first_index + num_actors):
             if ray_constant_exploration is True:
-                exploration_val = worker_exploration(i, num_actors)
+                exploration_val = worker_exploration(i, num_exploration_workers)
                 worker_spec["ray_exploration"] = exploration_val
             worker = cls_as_remote(deepcopy(agent_config), worker_spec, *args)
             self.worker_ids[worker] = "worker_{}".format(i)
@@ -114,6 +132,22 @@ class RayExecutor(object):
 
         return workers
 
+    def retire_worker(self, ray_worker):
+        """
+        Removes a sample worker which has no pending tasks: Keeps its final statistics for reporting and
+        terminates the actor.
+
+        Args:
+            ray_worker (any): Ray actor handle of the worker.
+        """
+        self.logger.info("Retiring worker {}.".format(self.worker_ids[ray_worker]))
+        metrics = ray.get(ray_worker.get_workload_statistics.remote())
+        self.retired_worker_metrics.append((self.worker_ids[ray_worker], metrics))
+        self.ray_env_sample_workers.remove(ray_worker)
+        if self.sample_controller is not None:
+            self.sample_controller.remove_worker(ray_worker)
+        ray_worker.__ray_terminate__.remote()
+
     def test_worker_init(self):
         """
         Tests every worker for successful constructor call (which may otherwise fail silently.
@@ -152,6 +186,7 @@ class RayExecutor(object):
         self.sample_iteration_throughputs = []
         self.update_iteration_throughputs = []
         self.iteration_times = []
+        self.policy_lags = []
 
         # Assume time step based initially.
         num_timesteps = workload["num_timesteps"]
@@ -234,7 +269,9 @@ class RayExecutor(object):
             max_worker_reward=worker_stats["max_reward"],
             min_worker_reward=worker_stats["min_reward"],
             # This is the mean final episode over all workers.
-            mean_final_reward=worker_stats["mean_final_reward"]
+            mean_final_reward=worker_stats["mean_final_reward"],
+            mean_policy_lag=np.mean(self.policy_lags) if len(self.policy_lags) > 0 else None,
+            max_policy_lag=np.max(self.policy_lags) if len(self.policy_lags) > 0 else None
         )
 
     def sample_metrics(self):
@@ -318,9 +355,7 @@ class RayExecutor(object):
             list: List dicts with worker results (timesteps and rewards)
         """
         results = list()
-        for ray_worker in self.ray_env_sample_workers:
-            task = ray_worker.get_workload_statistics.remote()
-            metrics = ray.get(task)
+        for _, metrics in self._fetch_worker_metrics():
             results.append(dict(
                 episode_rewards=metrics["episode_rewards"],
                 episode_timesteps=metrics["episode_timesteps"],
@@ -339,6 +374,22 @@ class RayExecutor(object):
         """
         return list(self.worker_ids.keys())
 
+    def _fetch_worker_metrics(self):
+        """
+        Fetches workload statistics from all sample workers.
+
+        Returns:
+            list: Tuples of worker id and workload statistics dict.
+        """
+        results = list()
+        for ray_worker in self.ray_env_sample_workers:
+            self.logger.info("Retrieving workload statistics for worker: {}".format(
+                self.worker_ids[ray_worker])
+            )
+            task = ray_worker.get_workload_statistics.remote()
+            results.append((self.worker_ids[ray_worker], ray.get(task)))
+        return results + self.retired_worker_metrics
+
     def get_aggregate_worker_results(self):
         """
         Fetches execution statistics from remote workers and aggregates them.
@@ -355,12 +406,7 @@ class RayExecutor(object):
         episodes_executed = []
         steps_executed = 0
 
-        for ray_worker in self.ray_env_sample_workers:
-            self.logger.info("Retrieving workload statistics for worker: {}".format(
-                self.worker_ids[ray_worker])
-            )
-            task = ray_worker.get_workload_statistics.remote()
-            metrics = ray.get(task)
+        for worker_id, metrics in self._fetch_worker_metrics():
             if metrics["mean_episode_reward"] is not None:
                 min_rewards.append(metrics["min_episode_reward"])
                 max_rewards.append(metrics["max_episode_reward"])
@@ -368,7 +414,7 @@ class RayExecutor(object):
                 final_rewards.append(metrics["final_episode_reward"])
             else:
                 self.logger.warning("Warning: No episode rewards available for worker {}. Steps executed: {}".
-                                    format(self.worker_ids[ray_worker], metrics["worker_steps"]))
+                                    format(worker_id, metrics["worker_steps"]))
             episodes_executed.append(metrics["episodes_executed"])
             steps_executed += metrics["worker_steps"]
             worker_op_throughputs.append(metrics["mean_worker_ops_per_second"])
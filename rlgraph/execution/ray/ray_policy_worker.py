@@ -25,11 +25,13 @@ import time
 
 from rlgraph import get_distributed_backend
 from rlgraph.components.neural_networks.preprocessor_stack import PreprocessorStack
-from rlgraph.environments.sequential_vector_env import SequentialVectorEnv
+from rlgraph.environments import Environment
 from rlgraph.execution.environment_sample import EnvironmentSample
 from rlgraph.execution.ray import RayExecutor
 from rlgraph.execution.ray.ray_actor import RayActor
-from rlgraph.execution.ray.ray_util import ray_compress
+from rlgraph.execution.ray.ray_util import ray_method, StateCodec
+from rlgraph.execution.ray.trajectory_buffer import TrajectoryBuffer
+from rlgraph.utils.rlgraph_errors import RLGraphError
 
 if get_distributed_backend() == "ray":
     import ray
@@ -50,7 +52,6 @@ class RayPolicyWorker(RayActor):
             env_spec (dict): Environment config for environment to run.
             frameskip (int): How often actions are repeated after retrieving them from the agent.
         """
-        assert get_distributed_backend() == "ray"
         # Internal frameskip of env.
         self.env_frame_skip = env_spec.get("frameskip", 1)
         # Worker computes weights for prioritized sampling.
@@ -63,11 +64,15 @@ class RayPolicyWorker(RayActor):
         self.generalized_advantage_estimation = worker_spec.pop("generalized_advantage_estimation", True)
         self.gae_lambda = worker_spec.pop("gae_lambda", 1.0)
         self.compress = worker_spec.pop("compress_states", False)
+        self.state_codec = StateCodec(worker_spec.pop("state_codec", "lz4")) if self.compress else None
 
         self.env_ids = ["env_{}".format(i) for i in range_(self.num_environments)]
         num_background_envs = worker_spec.pop("num_background_envs", 1)
-
-        self.vector_env = SequentialVectorEnv(self.num_environments, env_spec, num_background_envs)
+        # VectorEnv running the environments, e.g. dict(type="parallel_vector", num_processes=4).
+        vector_env_spec = worker_spec.pop(
+            "vector_env_spec", dict(type="sequential_vector", num_background_envs=num_background_envs)
+        )
+        self.vector_env = Environment.from_spec(vector_env_spec, num_envs=self.num_environments, env_spec=env_spec)
 
         # Then update agent config.
         agent_config['state_space'] = self.vector_env.state_space
@@ -77,10 +82,20 @@ class RayPolicyWorker(RayActor):
         self.preprocessors = {}
         preprocessing_spec = agent_config.get("preprocessing_spec", None)
         self.is_preprocessed = {}
-        for env_id in self.env_ids:
-            self.preprocessors[env_id] = self.setup_preprocessor(
+        # Vectorized preprocessing: One stack preprocesses the states of all environments as one batch.
+        self.preprocessor = None
+        if worker_spec.pop("vectorized_preprocessing", False):
+            self.preprocessor = self.setup_preprocessor(
                 preprocessing_spec, self.vector_env.state_space.with_batch_rank()
             )
+        self.vectorized_preprocessing = self.preprocessor is not None
+        for env_id in self.env_ids:
+            if self.vectorized_preprocessing:
+                self.preprocessors[env_id] = None
+            else:
+                self.preprocessors[env_id] = self.setup_preprocessor(
+                    preprocessing_spec, self.vector_env.state_space.with_batch_rank()
+                )
             self.is_preprocessed[env_id] = False
         self.agent = self.setup_agent(agent_config, worker_spec)
         self.worker_frameskip = frameskip
@@ -110,6 +125,10 @@ class RayPolicyWorker(RayActor):
             shape=(self.num_environments,) + self.agent.preprocessed_state_space.shape,
             dtype=self.agent.preprocessed_state_space.dtype
         )
+        self.trajectory_buffer = TrajectoryBuffer(
+            self.num_environments, self.agent.preprocessed_state_space.shape,
+            self.agent.preprocessed_state_space.dtype
+        )
         self.last_ep_timesteps = [0 for _ in range_(self.num_environments)]
         self.last_ep_rewards = [0 for _ in range_(self.num_environments)]
         self.last_ep_start_timestamps = [0.0 for _ in range_(self.num_environments)]
@@ -119,6 +138,10 @@ class RayPolicyWorker(RayActor):
         # Was the last state a terminal state so env should be reset in next call?
         self.last_terminals = [False for _ in range_(self.num_environments)]
 
+        # Version of the weights acting, and their decoded values as base for weight deltas.
+        self.weights_version = 0
+        self.weights_reference = None
+
     def get_constructor_success(self):
         """
         For debugging: fetch the last attribute. Will fail if constructor failed.
@@ -129,6 +152,21 @@ class RayPolicyWorker(RayActor):
     def as_remote(cls, num_cpus=None, num_gpus=None):
         return ray.remote(num_cpus=num_cpus, num_gpus=num_gpus)(cls)
 
+    def _preprocess_batch(self, env_states):
+        """
+        Vectorized preprocessing: Preprocesses the states of all environments not preprocessed yet with one
+        preprocessor stack, as one batch or (after per-env resets) as single rows.
+        """
+        env_indices = [i for i, env_id in enumerate(self.env_ids) if self.is_preprocessed[env_id] is False]
+        if len(env_indices) == self.num_environments:
+            self.preprocessed_states_buffer[:] = self.preprocessor.preprocess(np.asarray(env_states))
+        elif len(env_indices) > 0:
+            self.preprocessed_states_buffer[env_indices] = self.preprocessor.preprocess_envs(
+                np.asarray([env_states[i] for i in env_indices]), env_indices
+            )
+        for i in env_indices:
+            self.is_preprocessed[self.env_ids[i]] = True
+
     def setup_preprocessor(self, preprocessing_spec, in_space):
         if preprocessing_spec is not None:
             # TODO move ingraph for python component assembly.
@@ -189,19 +227,8 @@ class RayPolicyWorker(RayActor):
         episodes_executed = [0] * self.num_environments
         env_frames = 0
 
-        # Final result batch.
-        batch_states, batch_actions, batch_rewards, batch_terminals = [], [], [], []
-
-        # Running trajectories.
-        sample_states, sample_actions, sample_rewards, sample_terminals = {}, {}, {}, {}
-
-        # Reset envs and Agent either if finished an episode in current loop or if last state
-        # from previous execution was terminal for that environment.
-        for i, env_id in enumerate(self.env_ids):
-            sample_states[env_id] = []
-            sample_actions[env_id] = []
-            sample_rewards[env_id] = []
-            sample_terminals[env_id] = []
+        # Running trajectories of all environments, written in place per step.
+        self.trajectory_buffer.reset(-(-num_timesteps // self.num_environments))
 
         env_states = self.last_states
         current_episode_rewards = self.last_ep_rewards
@@ -214,14 +241,17 @@ class RayPolicyWorker(RayActor):
 
         while timesteps_executed < num_timesteps:
             current_iteration_start_timestamp = time.perf_counter()
-            for i, env_id in enumerate(self.env_ids):
-                state = self.agent.state_space.force_batch(env_states[i])
-                if self.preprocessors[env_id] is not None:
-                    if self.is_preprocessed[env_id] is False:
-                        self.preprocessed_states_buffer[i] = self.preprocessors[env_id].preprocess(state)
-                        self.is_preprocessed[env_id] = True
-                else:
-                    self.preprocessed_states_buffer[i] = env_states[i]
+            if self.vectorized_preprocessing:
+                self._preprocess_batch(env_states)
+            else:
+                for i, env_id in enumerate(self.env_ids):
+                    state = self.agent.state_space.force_batch(env_states[i])
+                    if self.preprocessors[env_id] is not None:
+                        if self.is_preprocessed[env_id] is False:
+                            self.preprocessed_states_buffer[i] = self.preprocessors[env_id].preprocess(state)
+                            self.is_preprocessed[env_id] = True
+                    else:
+                        self.preprocessed_states_buffer[i] = env_states[i]
 
             actions = self.get_action(states=self.preprocessed_states_buffer,
                                       use_exploration=use_exploration, apply_preprocessing=False)
@@ -243,17 +273,13 @@ class RayPolicyWorker(RayActor):
             current_iteration_time = time.perf_counter() - current_iteration_start_timestamp
 
             # Do accounting for each environment.
-            state_buffer = np.array(self.preprocessed_states_buffer)
+            self.trajectory_buffer.add(self.preprocessed_states_buffer, actions, step_rewards, terminals)
             for i, env_id in enumerate(self.env_ids):
                 # Set is preprocessed to False because env_states are currently NOT preprocessed.
                 self.is_preprocessed[env_id] = False
                 current_episode_timesteps[i] += 1
                 # Each position is the running episode reward of that episode. Add step reward.
                 current_episode_rewards[i] += step_rewards[i]
-                sample_states[env_id].append(state_buffer[i])
-                sample_actions[env_id].append(actions[i])
-                sample_rewards[env_id].append(step_rewards[i])
-                sample_terminals[env_id].append(terminals[i])
                 current_episode_sample_times[i] += current_iteration_time
 
                 # Terminate and reset episode for that environment.
@@ -265,21 +291,15 @@ class RayPolicyWorker(RayActor):
                     episodes_executed[i] += 1
                     self.episodes_executed += 1
 
-                    # Append to final result trajectories.
-                    batch_states.extend(sample_states[env_id])
-                    batch_actions.extend(sample_actions[env_id])
-                    batch_rewards.extend(sample_rewards[env_id])
-                    batch_terminals.extend(sample_terminals[env_id])
-
-                    # Reset running trajectory for this env.
-                    sample_states[env_id] = []
-                    sample_actions[env_id] = []
-                    sample_rewards[env_id] = []
-                    sample_terminals[env_id] = []
+                    # End the running trajectory for this env.
+                    self.trajectory_buffer.end_segment(i, ends_episode=True)
 
                     # Reset this environment and its pre-processor stack.
                     env_states[i] = self.vector_env.reset(i)
-                    if self.preprocessors[env_id] is not None:
+                    if self.vectorized_preprocessing:
+                        # The reset state is preprocessed with the next action's states.
+                        self.preprocessor.reset([i])
+                    elif self.preprocessors[env_id] is not None:
                         self.preprocessors[env_id].reset()
                         # This re-fills the sequence with the reset state.
                         state = self.agent.state_space.force_batch(env_states[i])
@@ -302,27 +322,21 @@ class RayPolicyWorker(RayActor):
         self.last_ep_start_timestamps = current_episode_start_timestamps
         self.last_ep_sample_times = current_episode_sample_times
 
-        # Sequence indices are the same as terminals for terminal episodes.
-        batch_sequence_indices = batch_terminals.copy()
-
         # We already accounted for all terminated episodes. This means we only
         # have to do accounting for any unfinished fragments.
         for i, env_id in enumerate(self.env_ids):
             # This env was not terminal -> need to process remaining trajectory
             if not terminals[i]:
-                batch_states.extend(sample_states[env_id])
-                batch_actions.extend(sample_actions[env_id])
-                batch_rewards.extend(sample_rewards[env_id])
-                batch_terminals.extend(sample_terminals[env_id])
+                self.trajectory_buffer.end_segment(i, ends_episode=False)
 
-                # Take terminals thus far - all zero.
-                batch_sequence_indices.extend(sample_terminals[env_id].copy())
-                # Set final elem to true because sub-sequence ends here.
-                batch_sequence_indices[-1] = True
+        batch, segment_lengths, _ = self.trajectory_buffer.get_batch()
+        # Sequence indices are the same as terminals, plus the end of every (sub-)sequence.
+        batch_sequence_indices = batch["terminals"].copy()
+        batch_sequence_indices[np.cumsum(segment_lengths, dtype=np.int64) - 1] = True
 
         # Perform final batch-processing once.
-        sample_batch, batch_size = self._process_policy_trajectories(batch_states, batch_actions,
-                                                                     batch_rewards, batch_terminals,
+        sample_batch, batch_size = self._process_policy_trajectories(batch["states"], batch["actions"],
+                                                                     batch["rewards"], batch["terminals"],
                                                                      batch_sequence_indices)
 
         total_time = (time.perf_counter() - start) or 1e-10
@@ -334,26 +348,38 @@ class RayPolicyWorker(RayActor):
         # for each worker to calculate expensive statistics now.
         return EnvironmentSample(
             sample_batch=sample_batch,
-            batch_size=len(batch_rewards),
+            batch_size=batch_size,
             metrics=dict(
                 runtime=total_time,
                 # Agent act/observe throughput.
                 timesteps_executed=timesteps_executed,
                 ops_per_second=(timesteps_executed / total_time),
+                # Policy version which produced this sample.
+                policy_version=self.weights_version
             )
         )
 
-    @ray.method(num_return_vals=2)
+    @ray_method(num_return_vals=2)
     def execute_and_get_with_count(self):
         sample = self.execute_and_get_timesteps(num_timesteps=self.worker_sample_size)
         return sample, sample.batch_size
 
     def set_weights(self, weights):
-        policy_weights = {k: v for k,v in zip(weights.policy_vars, weights.policy_values)}
-        vf_weights = None
-        if weights.has_vf:
-            vf_weights = {k: v for k, v in zip(weights.value_function_vars, weights.value_function_values)}
+        """
+        Sets weights of the local agent.
+
+        Args:
+            weights (RayWeight): Published weights. Delta encoded weights must refer to the version this worker holds.
+        """
+        if weights.version <= self.weights_version:
+            return
+        if weights.encoding == "delta" and weights.base_version != self.weights_version:
+            raise RLGraphError("Received weight delta for version {}, but worker holds version {}.".format(
+                weights.base_version, self.weights_version))
+        self.weights_reference = weights.decode(self.weights_reference)
+        policy_weights, vf_weights = self.weights_reference
         self.agent.set_weights(policy_weights, value_function_weights=vf_weights)
+        self.weights_version = weights.version
 
     def get_workload_statistics(self):
         """
@@ -411,8 +437,7 @@ class RayPolicyWorker(RayActor):
 
         if self.compress:
             env_dtype = self.vector_env.state_space.dtype
-            states = [ray_compress(np.asarray(state, dtype=util.convert_dtype(dtype=env_dtype, to='np')))
-                      for state in states]
+            states = self.state_codec.compress_batch(states, dtype=util.convert_dtype(dtype=env_dtype, to='np'))
         return dict(
             states=states,
             actions=actions,
@@ -18,16 +18,19 @@ from __future__ import division
 from __future__ import print_function
 
 import os
-import base64
+import struct
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from six import string_types
+from six.moves import xrange as range_
+
 from rlgraph import get_distributed_backend
 from rlgraph.utils.rlgraph_errors import RLGraphError
 
 if get_distributed_backend() == "ray":
     import ray
-    import lz4.frame
-    import pyarrow
 
 
 # Follows utils used in Ray RLlib.
@@ -35,10 +38,25 @@ class RayWeight(object):
     """
     Wrapper to transport TF weights to deal with serialisation bugs in Ray/Arrow.
 
+    Weights carry the version they were published with and are optionally encoded for transport: "float16" casts
+    floating point values to float16, "delta" transports the float16 difference to the (decoded) weights of
+    `base_version`.
+
     #TODO investigate serialisation bugs in Ray/flatten values.
     """
 
-    def __init__(self, weights):
+    def __init__(self, weights, version=0, encoding="none", reference=None, base_version=None):
+        """
+        Args:
+            weights (dict): Dict with policy weights and optional value function weights.
+            version (int): Published version of the weights.
+            encoding (str): One of "none", "float16" and "delta".
+            reference (Optional[tuple]): Decoded weights of `base_version`, required for "delta" encoding.
+            base_version (Optional[int]): Version the delta refers to.
+        """
+        self.version = version
+        self.encoding = encoding
+        self.base_version = base_version
         self.policy_vars = []
         self.policy_values = []
 
@@ -47,7 +65,7 @@ class RayWeight(object):
             self.policy_values.append(v)
 
         self.has_vf = False
-        if "value_function_weights" in weights:
+        if "value_function_weights" in weights and weights["value_function_weights"] is not None:
             self.value_function_vars = []
             self.value_function_values = []
             self.has_vf = True
@@ -55,15 +73,170 @@ class RayWeight(object):
                 self.value_function_vars.append(k)
                 self.value_function_values.append(v)
 
+        if encoding != "none":
+            if encoding == "delta" and reference is None:
+                raise RLGraphError("Delta encoding of weights requires reference weights.")
+            self.policy_dtypes, self.policy_values = self._encode(
+                self.policy_vars, self.policy_values, reference[0] if reference is not None else None
+            )
+            if self.has_vf:
+                self.value_function_dtypes, self.value_function_values = self._encode(
+                    self.value_function_vars, self.value_function_values,
+                    reference[1] if reference is not None else None
+                )
+
+    def _encode(self, keys, values, reference):
+        dtypes, encoded = [], []
+        for key, value in zip(keys, values):
+            value = np.asarray(value)
+            dtypes.append(value.dtype)
+            if np.issubdtype(value.dtype, np.floating):
+                if self.encoding == "delta":
+                    value = value - reference[key]
+                value = value.astype(np.float16)
+            encoded.append(value)
+        return dtypes, encoded
+
+    def _decode(self, keys, dtypes, values, reference):
+        decoded = {}
+        for key, dtype, value in zip(keys, dtypes, values):
+            if np.issubdtype(dtype, np.floating):
+                value = value.astype(dtype)
+                if self.encoding == "delta":
+                    value = reference[key] + value
+            decoded[key] = value
+        return decoded
+
+    def decode(self, reference=None):
+        """
+        Decodes the transported weights.
+
+        Args:
+            reference (Optional[tuple]): Decoded weights of version `base_version`, required for "delta" encoding.
+
+        Returns:
+            tuple: Dicts of policy weights and value function weights (None if there is no value function).
+        """
+        if self.encoding == "none":
+            policy_weights = dict(zip(self.policy_vars, self.policy_values))
+            vf_weights = dict(zip(self.value_function_vars, self.value_function_values)) if self.has_vf else None
+            return policy_weights, vf_weights
+
+        if self.encoding == "delta" and reference is None:
+            raise RLGraphError("Cannot decode weight delta to version {} without weights of version {}.".format(
+                self.version, self.base_version))
+        policy_weights = self._decode(self.policy_vars, self.policy_dtypes, self.policy_values,
+                                      reference[0] if reference is not None else None)
+        vf_weights = None
+        if self.has_vf:
+            vf_weights = self._decode(self.value_function_vars, self.value_function_dtypes,
+                                      self.value_function_values, reference[1] if reference is not None else None)
+        return policy_weights, vf_weights
+
+
+class WeightPublisher(object):
+    """
+    Publishes versioned weights to the object store. Workers are only sent weights if their version is stale.
+
+    With "delta" encoding, workers holding the previous version receive the float16 difference to it, all other
+    workers the full weights. Deltas are computed against the weights as decoded by workers, so rounding errors do
+    not accumulate over versions.
+    """
+    def __init__(self, encoding="none"):
+        """
+        Args:
+            encoding (str): Transport encoding of weights, one of "none", "float16" and "delta".
+        """
+        if encoding not in ["none", "float16", "delta"]:
+            raise RLGraphError("Unknown weight encoding {}.".format(encoding))
+        self.encoding = encoding
+        self.version = 0
+        self.full_weights = None
+        self.delta_weights = None
+        # Decoded weights of the latest version, base of the next delta.
+        self.reference = None
+
+    def publish(self, weights):
+        """
+        Publishes a new version of weights.
+
+        Args:
+            weights (dict): Weights as returned by `Agent.get_weights()`.
+
+        Returns:
+            int: The new version.
+        """
+        self.version += 1
+        self.delta_weights = None
+        if self.encoding == "delta":
+            if self.reference is not None:
+                delta = RayWeight(weights, version=self.version, encoding="delta", reference=self.reference,
+                                  base_version=self.version - 1)
+                self.reference = delta.decode(self.reference)
+                self.delta_weights = _put(delta)
+            else:
+                self.reference = RayWeight(weights).decode()
+            full = RayWeight(dict(policy_weights=self.reference[0], value_function_weights=self.reference[1]),
+                             version=self.version)
+        else:
+            full = RayWeight(weights, version=self.version, encoding=self.encoding)
+        self.full_weights = _put(full)
+        return self.version
+
+    def weights_for(self, version):
+        """
+        Returns the weights a worker holding `version` needs to fetch.
+
+        Args:
+            version (int): Version currently held by the worker.
+
+        Returns:
+            any: Object (id) of the weights, None if the worker is up to date.
+        """
+        if version >= self.version:
+            return None
+        if self.delta_weights is not None and version == self.version - 1:
+            return self.delta_weights
+        return self.full_weights
+
+
+def _put(value):
+    if get_distributed_backend() == "ray":
+        return ray.put(value)
+    return value
+
+
+def ray_method(**kwargs):
+    """
+    Decorator for actor methods, `ray.method(**kwargs)` if Ray is the distributed backend. Otherwise methods are
+    left as is, so actor classes can also be instantiated as plain local objects (e.g. in worker processes).
+    """
+    if get_distributed_backend() == "ray":
+        return ray.method(**kwargs)
+    return lambda method: method
+
 
 class RayTaskPool(object):
     """
     Manages a set of Ray tasks currently being executed (i.e. the RayAgent tasks).
+
+    Completed tasks are collected via blocking `ray.wait` calls instead of polling. The pool records the latency of
+    each task (from submission to collection) and the number of pending tasks at each collection.
     """
 
-    def __init__(self):
+    def __init__(self, drain_size=None, statistics_window=1000):
+        """
+        Args:
+            drain_size (Optional[int]): Max. number of completed tasks returned per `get_completed` call.
+                Defaults to all ready tasks.
+            statistics_window (int): Number of most recent latencies and queue depths kept for statistics.
+        """
         self.ray_tasks = {}
         self.ray_objects = {}
+        self.submit_times = {}
+        self.drain_size = drain_size
+        self.task_latencies = deque(maxlen=statistics_window)
+        self.queue_depths = deque(maxlen=statistics_window)
 
     def add_task(self, worker, ray_object_ids):
         """
@@ -79,21 +252,77 @@ class RayTaskPool(object):
             ray_object_id = ray_object_ids
         self.ray_tasks[ray_object_id] = worker
         self.ray_objects[ray_object_id] = ray_object_ids
+        self.submit_times[ray_object_id] = time.perf_counter()
+
+    def num_pending(self, worker):
+        """
+        Returns:
+            int: Number of pending tasks of a worker.
+        """
+        return sum(1 for task_worker in self.ray_tasks.values() if task_worker is worker)
 
-    def get_completed(self):
+    def get_completed(self, timeout=0.0):
         """
         Waits on pending tasks and yields them upon completion.
 
+        Args:
+            timeout (Optional[float]): Seconds to block until at least one task is ready. None blocks
+                indefinitely, 0 only collects tasks which are already done.
+
         Returns:
             generator: Yields completed tasks.
         """
-
         pending_tasks = list(self.ray_tasks)
-        if pending_tasks:
-            # This ray function checks tasks and splits into ready and non-ready tasks.
-            ready, not_ready = ray.wait(pending_tasks, num_returns=len(pending_tasks), timeout=0.01)
-            for obj_id in ready:
-                yield (self.ray_tasks.pop(obj_id), self.ray_objects.pop(obj_id))
+        self.queue_depths.append(len(pending_tasks))
+        if not pending_tasks:
+            return
+        if timeout != 0.0:
+            ready, _ = ray.wait(pending_tasks, num_returns=1, timeout=timeout)
+            if not ready:
+                return
+        num_returns = len(pending_tasks) if self.drain_size is None else min(self.drain_size, len(pending_tasks))
+        # This ray function checks tasks and splits into ready and non-ready tasks.
+        ready, not_ready = ray.wait(pending_tasks, num_returns=num_returns, timeout=0.0)
+        now = time.perf_counter()
+        for obj_id in ready:
+            self.task_latencies.append(now - self.submit_times.pop(obj_id))
+            yield (self.ray_tasks.pop(obj_id), self.ray_objects.pop(obj_id))
+
+    @staticmethod
+    def wait_any(task_pools, timeout=None):
+        """
+        Blocks until at least one task of any of the given pools is done.
+
+        Args:
+            task_pools (list): RayTaskPools to wait on.
+            timeout (Optional[float]): Max. seconds to block, None blocks indefinitely.
+
+        Returns:
+            bool: True if a task is done, False on timeout.
+        """
+        pending_tasks = [obj_id for task_pool in task_pools for obj_id in task_pool.ray_tasks]
+        if not pending_tasks:
+            # Nothing to wait for, e.g. all tasks are throttled: Avoid busy looping.
+            if timeout:
+                time.sleep(timeout)
+            return False
+        ready, _ = ray.wait(pending_tasks, num_returns=1, timeout=timeout)
+        return len(ready) > 0
+
+    def get_statistics(self):
+        """
+        Returns:
+            dict: Task latency (seconds) and queue depth statistics over the statistics window.
+        """
+        latencies = list(self.task_latencies) or [0.0]
+        queue_depths = list(self.queue_depths) or [0]
+        return dict(
+            pending_tasks=len(self.ray_tasks),
+            mean_task_latency=float(np.mean(latencies)),
+            max_task_latency=float(np.max(latencies)),
+            mean_queue_depth=float(np.mean(queue_depths)),
+            max_queue_depth=int(np.max(queue_depths))
+        )
 
 
 def create_colocated_ray_actors(cls, config, num_agents, max_attempts=10):
@@ -153,24 +382,273 @@ def split_local_non_local_agents(ray_agents):
     return local, non_local
 
 
-# Ported Ray compression utils, encoding apparently necessary for Redis.
+class StateCodec(object):
+    """
+    Binary state codec. An encoded state is a small header (codec, dtype, shape) followed by the raw array bytes,
+    optionally compressed with LZ4 or zstd. Decoding only relies on the header, so states encoded with any codec
+    can be decoded without configuration.
+    """
+    codec_ids = dict(none=0, lz4=1, zstd=2)
+    # Magic, codec id, dtype string length, number of dims.
+    header_format = "<2sBBB"
+    magic = b"RS"
+
+    def __init__(self, codec="lz4", level=None):
+        """
+        Args:
+            codec (str): One of "none" (raw bytes), "lz4" (requires `lz4`) and "zstd" (requires `zstandard`).
+            level (Optional[int]): Compression level, codec default if None.
+        """
+        if codec not in self.codec_ids:
+            raise RLGraphError("Unknown state codec {}, must be one of {}.".format(codec, list(self.codec_ids)))
+        self.codec = codec
+        self.codec_id = self.codec_ids[codec]
+        self.compressor = _compressor(self.codec_id, level)
+
+    def header(self, dtype, shape):
+        dtype = np.dtype(dtype).str.encode("ascii")
+        return struct.pack(self.header_format, self.magic, self.codec_id, len(dtype), len(shape)) + dtype + \
+            struct.pack("<{}I".format(len(shape)), *shape)
+
+    def compress(self, state):
+        """
+        Encodes a single state.
+
+        Args:
+            state (ndarray): State to encode.
+
+        Returns:
+            bytes: Encoded state.
+        """
+        state = np.ascontiguousarray(state)
+        return self.header(state.dtype, state.shape) + self.compressor(memoryview(state).cast("B"))
+
+    def compress_batch(self, states, dtype=None):
+        """
+        Encodes a batch of states with one shared header, each state into its own bytes object (so states can
+        be stored and sampled individually).
+
+        Args:
+            states (Union[list,ndarray]): States of identical shape and dtype.
+            dtype (Optional[np.dtype]): Dtype to convert states to.
+
+        Returns:
+            list: Encoded states.
+        """
+        if len(states) == 0:
+            return []
+        states = np.ascontiguousarray(np.asarray(states, dtype=dtype))
+        header = self.header(states.dtype, states.shape[1:])
+        data = memoryview(states.reshape(len(states), -1)).cast("B")
+        row_size = states[0].nbytes
+        return [header + self.compressor(data[i * row_size:(i + 1) * row_size]) for i in range_(len(states))]
+
+    @staticmethod
+    def parse_header(data):
+        """
+        Returns:
+            tuple: Codec id, dtype, shape and header length of an encoded state.
+        """
+        magic, codec_id, dtype_length, ndim = struct.unpack_from(StateCodec.header_format, data)
+        if magic != StateCodec.magic:
+            raise RLGraphError("Data is not an encoded state.")
+        offset = struct.calcsize(StateCodec.header_format)
+        dtype = np.dtype(bytes(data[offset:offset + dtype_length]).decode("ascii"))
+        offset += dtype_length
+        shape = struct.unpack_from("<{}I".format(ndim), data, offset)
+        return codec_id, dtype, shape, offset + 4 * ndim
+
+    @staticmethod
+    def decompress(data, out=None):
+        """
+        Decodes a single state.
+
+        Args:
+            data (bytes): Encoded state.
+            out (Optional[ndarray]): Array to decode into.
+
+        Returns:
+            ndarray: The decoded state.
+        """
+        codec_id, dtype, shape, header_length = StateCodec.parse_header(data)
+        state = np.frombuffer(_decompressor(codec_id)(data[header_length:]), dtype=dtype).reshape(shape)
+        if out is None:
+            return state.copy() if codec_id == 0 else state
+        out[...] = state
+        return out
+
+    @staticmethod
+    def decompress_batch(data, out=None):
+        """
+        Decodes a batch of encoded states of identical shape and dtype into one array.
+
+        Args:
+            data (Union[list,ndarray]): Encoded states.
+            out (Optional[ndarray]): Preallocated array of shape [len(data)] + state shape to decode into.
+
+        Returns:
+            ndarray: The decoded batch.
+        """
+        if out is None:
+            _, dtype, shape, _ = StateCodec.parse_header(data[0])
+            out = np.empty(shape=(len(data),) + tuple(shape), dtype=dtype)
+        StateCodec.decompress_rows(data, range_(len(data)), out)
+        return out
+
+    @staticmethod
+    def decompress_rows(data, rows, out):
+        """
+        Decodes selected encoded states into the same rows of `out`.
+
+        Args:
+            data (Union[list,ndarray]): Encoded states.
+            rows (iterable): Indices of the states to decode.
+            out (ndarray): Array of shape [len(data)] + state shape to decode into.
+        """
+        codec_id = dtype = shape = header = None
+        for i in rows:
+            encoded = data[i]
+            if header is None:
+                codec_id, dtype, shape, header_length = StateCodec.parse_header(encoded)
+                decompressor = _decompressor(codec_id)
+                header = encoded[:header_length]
+            if encoded[:len(header)] == header:
+                out[i] = np.frombuffer(decompressor(encoded[len(header):]), dtype=dtype).reshape(shape)
+            else:
+                StateCodec.decompress(encoded, out=out[i])
+
+
+def _compressor(codec_id, level=None):
+    if codec_id == 1:
+        import lz4.frame
+        return lambda data: lz4.frame.compress(data, compression_level=level or 0)
+    elif codec_id == 2:
+        import zstandard
+        return zstandard.ZstdCompressor(level=level or 3).compress
+    return bytes
+
+
+def _decompressor(codec_id):
+    if codec_id == 1:
+        import lz4.frame
+        return lz4.frame.decompress
+    elif codec_id == 2:
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress
+    return bytes
+
+
+_default_codec = None
+
+
 def ray_compress(data):
-    data = pyarrow.serialize(data).to_buffer().to_pybytes()
-    data = lz4.frame.compress(data)
-    # Unclear why ascii decoding.
-    data = base64.b64encode(data).decode("ascii")
-    # data = base64.b64encode(data)
-    return data
+    """
+    Encodes a single state with the default (LZ4) state codec.
+    """
+    global _default_codec
+    if _default_codec is None:
+        _default_codec = StateCodec("lz4")
+    return _default_codec.compress(np.asarray(data))
 
 
 def ray_decompress(data):
-    if isinstance(data, bytes) or isinstance(data, string_types):
-        data = base64.b64decode(data)
-        data = lz4.frame.decompress(data)
-        data = pyarrow.deserialize(data)
+    """
+    Decodes a single state encoded by a `StateCodec`. Other values are returned as is.
+    """
+    if isinstance(data, bytes):
+        data = StateCodec.decompress(data)
     return data
 
 
+_decompression_pool = None
+
+
+def parallel_decompress_rows(data, rows, out, num_threads=None):
+    """
+    Decodes selected encoded states into the same rows of `out`, split over threads. The LZ4 and zstd
+    decompressors release the GIL, so threads decode concurrently.
+
+    Args:
+        data (Union[list,ndarray]): Encoded states.
+        rows (ndarray): Indices of the states to decode.
+        out (ndarray): Array of shape [len(data)] + state shape to decode into.
+        num_threads (Optional[int]): Max. number of threads. Defaults to the number of CPUs.
+    """
+    global _decompression_pool
+    num_threads = min(num_threads or os.cpu_count() or 1, len(rows))
+    if num_threads <= 1:
+        StateCodec.decompress_rows(data, rows, out)
+        return
+    if _decompression_pool is None:
+        _decompression_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+    futures = [_decompression_pool.submit(StateCodec.decompress_rows, data, chunk, out)
+               for chunk in np.array_split(rows, num_threads)]
+    for future in futures:
+        future.result()
+
+
+class LazyStates(object):
+    """
+    Batch of encoded states which are only decoded on access. Each state is decoded at most once into a
+    preallocated array: Indexing decodes the selected states, conversion via `np.asarray` decodes all remaining
+    states.
+    """
+    def __init__(self, data, num_threads=None):
+        """
+        Args:
+            data (list): States encoded by a `StateCodec`.
+            num_threads (Optional[int]): Max. number of threads decoding states.
+        """
+        self.data = data
+        self.num_threads = num_threads
+        _, self.dtype, state_shape, _ = StateCodec.parse_header(data[0])
+        self.shape = (len(data),) + tuple(state_shape)
+        self.states = np.empty(shape=self.shape, dtype=self.dtype)
+        self.decoded = np.zeros(shape=(len(data),), dtype=bool)
+
+    def __len__(self):
+        return len(self.data)
+
+    def _decode(self, rows):
+        rows = np.unique(rows)
+        rows = rows[~self.decoded[rows]]
+        if len(rows) > 0:
+            parallel_decompress_rows(self.data, rows, self.states, self.num_threads)
+            self.decoded[rows] = True
+
+    def __getitem__(self, index):
+        self._decode(np.arange(len(self.data))[index])
+        return self.states[index]
+
+    def __array__(self, dtype=None, copy=None):
+        self._decode(np.arange(len(self.data)))
+        return self.states if dtype is None else self.states.astype(dtype, copy=False)
+
+
+def decompress_states(states, out=None, num_threads=1):
+    """
+    Decodes a batch of states encoded by a `StateCodec` into one array. Uncompressed states are stacked.
+
+    Args:
+        states (Union[list,ndarray,LazyStates]): Encoded or plain states.
+        out (Optional[ndarray]): Preallocated output array.
+        num_threads (Optional[int]): Max. number of threads decoding states, None for one per CPU.
+
+    Returns:
+        ndarray: Batch of states.
+    """
+    if len(states) > 0 and isinstance(states[0], bytes):
+        if out is None:
+            _, dtype, shape, _ = StateCodec.parse_header(states[0])
+            out = np.empty(shape=(len(states),) + tuple(shape), dtype=dtype)
+        parallel_decompress_rows(states, np.arange(len(states)), out, num_threads)
+        return out
+    if out is not None:
+        out[...] = states
+        return out
+    return np.asarray(states)
+
+
 # Ray's magic constant worker explorations..
 def worker_exploration(worker_index, num_workers):
     """
@@ -185,22 +663,40 @@ def worker_exploration(worker_index, num_workers):
     return 0.4 ** exponent
 
 
-def merge_samples(samples, decompress=False):
+def merge_samples(samples, decompress=False, lazy=False, num_threads=None):
     """
-    Merges list of samples into a final batch.
+    Merges list of samples into a final batch. Batch sizes are summed first and the values of all samples are
+    written into their slices of one preallocated array per key.
+
     Args:
         samples (list): List of EnvironmentSamples
-        decompress (bool): If true, assume states are compressed and decompress them.
+        decompress (bool): If true, decompress encoded states into their slices, in parallel threads.
+        lazy (bool): If true (and decompressing), encoded states are returned as `LazyStates` which are only
+            decoded on access.
+        num_threads (Optional[int]): Max. number of threads decoding states, None for one per CPU.
 
     Returns:
         dict: Sample batch of numpy arrays.
     """
     batch = {}
-    sample_layout = samples[0].sample_batch
-    for key in sample_layout.keys():
-        batch[key] = np.concatenate([sample.sample_batch[key] for sample in samples])
-
-    if decompress:
-        assert "states" in batch
-        batch["states"] = np.asarray([ray_decompress(state) for state in batch["states"]])
+    for key in samples[0].sample_batch.keys():
+        values = [sample.sample_batch[key] for sample in samples]
+        if len(values[0]) > 0 and isinstance(values[0][0], bytes):
+            # Encoded states are merged as one list, arrays of bytes would strip trailing null bytes.
+            encoded = [state for value in values for state in value]
+            if not decompress:
+                batch[key] = encoded
+            elif lazy:
+                batch[key] = LazyStates(encoded, num_threads=num_threads)
+            else:
+                batch[key] = decompress_states(encoded, num_threads=num_threads)
+            continue
+
+        first = np.asarray(values[0])
+        merged = np.empty(shape=(sum(len(value) for value in values),) + first.shape[1:], dtype=first.dtype)
+        start = 0
+        for value in values:
+            merged[start:start + len(value)] = value
+            start += len(value)
+        batch[key] = merged
     return batch
@@ -26,11 +26,14 @@ import time
 from rlgraph import get_distributed_backend
 from rlgraph.utils.util import SMALL_NUMBER
 from rlgraph.components.neural_networks.preprocessor_stack import PreprocessorStack
-from rlgraph.environments.sequential_vector_env import SequentialVectorEnv
+from rlgraph.environments import Environment
 from rlgraph.execution.environment_sample import EnvironmentSample
 from rlgraph.execution.ray import RayExecutor
 from rlgraph.execution.ray.ray_actor import RayActor
-from rlgraph.execution.ray.ray_util import ray_compress
+from rlgraph.execution.ray.ray_util import ray_method, StateCodec
+from rlgraph.execution.ray.trajectory_buffer import TrajectoryBuffer
+from rlgraph.utils.rlgraph_errors import RLGraphError
+from rlgraph.utils.numpy import n_step_transform
 
 if get_distributed_backend() == "ray":
     import ray
@@ -52,7 +55,6 @@ class RayValueWorker(RayActor):
             env_spec (dict): Environment config for environment to run.
             frameskip (int): How often actions are repeated after retrieving them from the agent.
         """
-        assert get_distributed_backend() == "ray"
         # Internal frameskip of env.
         self.env_frame_skip = env_spec.get("frameskip", 1)
         # Worker computes weights for prioritized sampling.
@@ -63,11 +65,15 @@ class RayValueWorker(RayActor):
         self.worker_sample_size = worker_spec.pop("worker_sample_size") * self.num_environments
         self.worker_computes_weights = worker_spec.pop("worker_computes_weights", True)
         self.n_step_adjustment = worker_spec.pop("n_step_adjustment", 1)
+        # Codec used to compress states before sending them to memory: "lz4", "zstd" or "none".
+        self.state_codec = StateCodec(worker_spec.pop("state_codec", "lz4"))
         self.env_ids = ["env_{}".format(i) for i in range_(self.num_environments)]
         num_background_envs = worker_spec.pop("num_background_envs", 1)
-
-        # TODO from spec once we decided on generic vectorization.
-        self.vector_env = SequentialVectorEnv(self.num_environments, env_spec, num_background_envs)
+        # VectorEnv running the environments, e.g. dict(type="parallel_vector", num_processes=4).
+        vector_env_spec = worker_spec.pop(
+            "vector_env_spec", dict(type="sequential_vector", num_background_envs=num_background_envs)
+        )
+        self.vector_env = Environment.from_spec(vector_env_spec, num_envs=self.num_environments, env_spec=env_spec)
 
         # Then update agent config.
         agent_config['state_space'] = self.vector_env.state_space
@@ -94,10 +100,20 @@ class RayValueWorker(RayActor):
         self.preprocessors = {}
         preprocessing_spec = agent_config.get("preprocessing_spec", None)
         self.is_preprocessed = {}
-        for env_id in self.env_ids:
-            self.preprocessors[env_id] = self.setup_preprocessor(
+        # Vectorized preprocessing: One stack preprocesses the states of all environments as one batch.
+        self.preprocessor = None
+        if worker_spec.pop("vectorized_preprocessing", False):
+            self.preprocessor = self.setup_preprocessor(
                 preprocessing_spec, self.vector_env.state_space.with_batch_rank()
             )
+        self.vectorized_preprocessing = self.preprocessor is not None
+        for env_id in self.env_ids:
+            if self.vectorized_preprocessing:
+                self.preprocessors[env_id] = None
+            else:
+                self.preprocessors[env_id] = self.setup_preprocessor(
+                    preprocessing_spec, self.vector_env.state_space.with_batch_rank()
+                )
             self.is_preprocessed[env_id] = False
         self.agent = self.setup_agent(agent_config, worker_spec)
         self.worker_frameskip = frameskip
@@ -127,6 +143,10 @@ class RayValueWorker(RayActor):
             shape=(self.num_environments,) + self.agent.preprocessed_state_space.shape,
             dtype=self.agent.preprocessed_state_space.dtype
         )
+        self.trajectory_buffer = TrajectoryBuffer(
+            self.num_environments, self.agent.preprocessed_state_space.shape,
+            self.agent.preprocessed_state_space.dtype
+        )
         self.last_ep_timesteps = [0 for _ in range_(self.num_environments)]
         self.last_ep_rewards = [0 for _ in range_(self.num_environments)]
         self.last_ep_start_timestamps = [0.0 for _ in range_(self.num_environments)]
@@ -136,6 +156,10 @@ class RayValueWorker(RayActor):
         # Was the last state a terminal state so env should be reset in next call?
         self.last_terminals = [False for _ in range_(self.num_environments)]
 
+        # Version of the weights acting, and their decoded values as base for weight deltas.
+        self.weights_version = 0
+        self.weights_reference = None
+
     def get_constructor_success(self):
         """
         For debugging: fetch the last attribute. Will fail if constructor failed.
@@ -146,6 +170,21 @@ class RayValueWorker(RayActor):
     def as_remote(cls, num_cpus=None, num_gpus=None):
         return ray.remote(num_cpus=num_cpus, num_gpus=num_gpus)(cls)
 
+    def _preprocess_batch(self, env_states):
+        """
+        Vectorized preprocessing: Preprocesses the states of all environments not preprocessed yet with one
+        preprocessor stack, as one batch or (after per-env resets) as single rows.
+        """
+        env_indices = [i for i, env_id in enumerate(self.env_ids) if self.is_preprocessed[env_id] is False]
+        if len(env_indices) == self.num_environments:
+            self.preprocessed_states_buffer[:] = self.preprocessor.preprocess(np.asarray(env_states))
+        elif len(env_indices) > 0:
+            self.preprocessed_states_buffer[env_indices] = self.preprocessor.preprocess_envs(
+                np.asarray([env_states[i] for i in env_indices]), env_indices
+            )
+        for i in env_indices:
+            self.is_preprocessed[self.env_ids[i]] = True
+
     def setup_preprocessor(self, preprocessing_spec, in_space):
         if preprocessing_spec is not None:
             # TODO move ingraph for python component assembly.
@@ -223,21 +262,10 @@ class RayValueWorker(RayActor):
         episodes_executed = [0 for _ in range_(self.num_environments)]
         env_frames = 0
 
-        # Final result batch.
-        batch_states, batch_actions, batch_rewards, batch_next_states, batch_terminals = [], [], [], [], []
-
-        # Running trajectories.
-        sample_states, sample_actions, sample_rewards, sample_terminals = {}, {}, {}, {}
+        # Running trajectories of all environments, written in place per step.
+        self.trajectory_buffer.reset(-(-num_timesteps // self.num_environments))
         next_states = [np.zeros_like(self.last_states) for _ in range_(self.num_environments)]
 
-        # Reset envs and Agent either if finished an episode in current loop or if last state
-        # from previous execution was terminal for that environment.
-        for i, env_id in enumerate(self.env_ids):
-            sample_states[env_id] = []
-            sample_actions[env_id] = []
-            sample_rewards[env_id] = []
-            sample_terminals[env_id] = []
-
         env_states = self.last_states
         current_episode_rewards = self.last_ep_rewards
         current_episode_timesteps = self.last_ep_timesteps
@@ -248,14 +276,17 @@ class RayValueWorker(RayActor):
         terminals = [False for _ in range_(self.num_environments)]
         while timesteps_executed < num_timesteps:
             current_iteration_start_timestamp = time.perf_counter()
-            for i, env_id in enumerate(self.env_ids):
-                state = self.agent.state_space.force_batch(env_states[i])
-                if self.preprocessors[env_id] is not None:
-                    if self.is_preprocessed[env_id] is False:
-                        self.preprocessed_states_buffer[i] = self.preprocessors[env_id].preprocess(state)
-                        self.is_preprocessed[env_id] = True
-                else:
-                    self.preprocessed_states_buffer[i] = env_states[i]
+            if self.vectorized_preprocessing:
+                self._preprocess_batch(env_states)
+            else:
+                for i, env_id in enumerate(self.env_ids):
+                    state = self.agent.state_space.force_batch(env_states[i])
+                    if self.preprocessors[env_id] is not None:
+                        if self.is_preprocessed[env_id] is False:
+                            self.preprocessed_states_buffer[i] = self.preprocessors[env_id].preprocess(state)
+                            self.is_preprocessed[env_id] = True
+                    else:
+                        self.preprocessed_states_buffer[i] = env_states[i]
 
             actions = self.get_action(states=self.preprocessed_states_buffer,
                                       use_exploration=use_exploration, apply_preprocessing=False)
@@ -276,17 +307,17 @@ class RayValueWorker(RayActor):
             current_iteration_time = time.perf_counter() - current_iteration_start_timestamp
 
             # Do accounting for each environment.
-            state_buffer = np.array(self.preprocessed_states_buffer)
+            self.trajectory_buffer.add(self.preprocessed_states_buffer, actions, step_rewards, terminals)
+            if self.vectorized_preprocessing:
+                # Preprocess all next states in one batch, they are the states of the next action as well.
+                preprocessed_next_states = np.array(self.preprocessor.preprocess(np.asarray(next_states)))
+                self.preprocessed_states_buffer[:] = preprocessed_next_states
             for i, env_id in enumerate(self.env_ids):
-                # Set is preprocessed to False because env_states are currently NOT preprocessed.
-                self.is_preprocessed[env_id] = False
+                # Unless preprocessed in one batch above, env_states are currently NOT preprocessed.
+                self.is_preprocessed[env_id] = self.vectorized_preprocessing
                 current_episode_timesteps[i] += 1
                 # Each position is the running episode reward of that episode. Add step reward.
                 current_episode_rewards[i] += step_rewards[i]
-                sample_states[env_id].append(state_buffer[i])
-                sample_actions[env_id].append(actions[i])
-                sample_rewards[env_id].append(step_rewards[i])
-                sample_terminals[env_id].append(terminals[i])
                 current_episode_sample_times[i] += current_iteration_time
 
                 # Terminate and reset episode for that environment.
@@ -298,39 +329,23 @@ class RayValueWorker(RayActor):
                     episodes_executed[i] += 1
                     self.episodes_executed += 1
 
-                    env_sample_states = sample_states[env_id]
-                    # Get next states for this environment's trajectory.
-                    env_sample_next_states = env_sample_states[1:]
-
+                    # Get the final next state for this environment's trajectory.
                     next_state = self.agent.state_space.force_batch(next_states[i])
-                    if self.preprocessors[env_id] is not None:
+                    if self.vectorized_preprocessing:
+                        next_state = preprocessed_next_states[i:i + 1]
+                    elif self.preprocessors[env_id] is not None:
                         next_state = self.preprocessors[env_id].preprocess(next_state)
 
-                    # Extend because next state has a batch dim.
-                    env_sample_next_states.extend(next_state)
-
-                    # Post-process this trajectory via n-step discounting.
-                    # print("processing terminal episode of length:", len(env_sample_states))
-                    post_s, post_a, post_r, post_next_s, post_t = self._truncate_n_step(env_sample_states,
-                        sample_actions[env_id], sample_rewards[env_id], env_sample_next_states,
-                        sample_terminals[env_id], was_terminal=True)
-
-                    # Append to final result trajectories.
-                    batch_states.extend(post_s)
-                    batch_actions.extend(post_a)
-                    batch_rewards.extend(post_r)
-                    batch_next_states.extend(post_next_s)
-                    batch_terminals.extend(post_t)
-
-                    # Reset running trajectory for this env.
-                    sample_states[env_id] = []
-                    sample_actions[env_id] = []
-                    sample_rewards[env_id] = []
-                    sample_terminals[env_id] = []
+                    # End the running trajectory for this env, n-step post-processing happens once for all segments.
+                    self.trajectory_buffer.end_segment(i, ends_episode=True, next_state=next_state[0])
 
                     # Reset this environment and its pre-processor stack.
                     env_states[i] = self.vector_env.reset(i)
-                    if self.preprocessors[env_id] is not None:
+                    if self.vectorized_preprocessing:
+                        # The reset state is preprocessed before the next action.
+                        self.preprocessor.reset([i])
+                        self.is_preprocessed[env_id] = False
+                    elif self.preprocessors[env_id] is not None:
                         self.preprocessors[env_id].reset()
                         # This re-fills the sequence with the reset state.
                         state = self.agent.state_space.force_batch(env_states[i])
@@ -358,32 +373,26 @@ class RayValueWorker(RayActor):
         for i, env_id in enumerate(self.env_ids):
             # This env was not terminal -> need to process remaining trajectory
             if not terminals[i]:
-                env_sample_states = sample_states[env_id]
-                # Get next states for this environment's trajectory.
-                env_sample_next_states = env_sample_states[1:]
                 next_state = self.agent.state_space.force_batch(next_states[i])
-                if self.preprocessors[env_id] is not None:
+                if self.vectorized_preprocessing:
+                    # Already preprocessed into the buffer.
+                    next_state = preprocessed_next_states[i:i + 1]
+                elif self.preprocessors[env_id] is not None:
                     next_state = self.preprocessors[env_id].preprocess(next_state)
                     # This is the env state in the next call so avoid double preprocessing
                     # by adding to buffer.
                     self.preprocessed_states_buffer[i] = np.array(next_state)
                     self.is_preprocessed[env_id] = True
 
-                # Extend because next state has a batch dim.
-                env_sample_next_states.extend(next_state)
-                post_s, post_a, post_r, post_next_s, post_t = self._truncate_n_step(env_sample_states,
-                    sample_actions[env_id], sample_rewards[env_id], env_sample_next_states,
-                    sample_terminals[env_id], was_terminal=False)
-
-                batch_states.extend(post_s)
-                batch_actions.extend(post_a)
-                batch_rewards.extend(post_r)
-                batch_next_states.extend(post_next_s)
-                batch_terminals.extend(post_t)
+                self.trajectory_buffer.end_segment(i, ends_episode=False, next_state=next_state[0])
 
-        # Perform final batch-processing once.
-        sample_batch, batch_size = self._batch_process_sample(batch_states, batch_actions,
-                                                              batch_rewards, batch_next_states, batch_terminals)
+        # Post-process all trajectory segments via n-step discounting and perform final batch-processing once.
+        batch, segment_lengths, segment_terminals = self.trajectory_buffer.get_batch(with_next_states=True)
+        post_s, post_a, post_r, post_next_s, post_t = self._truncate_n_step(
+            batch["states"], batch["actions"], batch["rewards"], batch["next_states"], batch["terminals"],
+            segment_lengths, segment_terminals
+        )
+        sample_batch, batch_size = self._batch_process_sample(post_s, post_a, post_r, post_next_s, post_t)
 
         total_time = (time.monotonic() - start) or 1e-10
         self.sample_steps.append(timesteps_executed)
@@ -400,20 +409,46 @@ class RayValueWorker(RayActor):
                 # Agent act/observe throughput.
                 timesteps_executed=timesteps_executed,
                 ops_per_second=(timesteps_executed / total_time),
+                # Policy version which produced this sample.
+                policy_version=self.weights_version
             )
         )
 
-    @ray.method(num_return_vals=2)
+    @ray_method(num_return_vals=2)
     def execute_and_get_with_count(self):
         sample = self.execute_and_get_timesteps(num_timesteps=self.worker_sample_size)
         return sample, sample.batch_size
 
+    @ray_method(num_return_vals=2)
+    def execute_and_get_with_metrics(self, num_timesteps=None):
+        """
+        Collects a sample and returns its metrics separately, so they can be fetched without the sample.
+
+        Args:
+            num_timesteps (Optional[int]): Env steps to execute. Defaults to the worker sample size.
+
+        Returns:
+            tuple: EnvironmentSample, dict of sample metrics including the batch size.
+        """
+        sample = self.execute_and_get_timesteps(num_timesteps=num_timesteps or self.worker_sample_size)
+        return sample, dict(sample.metrics, batch_size=sample.batch_size)
+
     def set_weights(self, weights):
-        policy_weights = {k: v for k,v in zip(weights.policy_vars, weights.policy_values)}
-        vf_weights = None
-        if weights.has_vf:
-            vf_weights = {k: v for k, v in zip(weights.value_function_vars, weights.value_function_values)}
+        """
+        Sets weights of the local agent.
+
+        Args:
+            weights (RayWeight): Published weights. Delta encoded weights must refer to the version this worker holds.
+        """
+        if weights.version <= self.weights_version:
+            return
+        if weights.encoding == "delta" and weights.base_version != self.weights_version:
+            raise RLGraphError("Received weight delta for version {}, but worker holds version {}.".format(
+                weights.base_version, self.weights_version))
+        self.weights_reference = weights.decode(self.weights_reference)
+        policy_weights, vf_weights = self.weights_reference
         self.agent.set_weights(policy_weights, value_function_weights=vf_weights)
+        self.weights_version = weights.version
 
     def get_workload_statistics(self):
         """
@@ -455,59 +490,37 @@ class RayValueWorker(RayActor):
             mean_worker_env_frames_per_second=sum(adjusted_frames) / sum(self.sample_times)
         )
 
-    def _truncate_n_step(self, states, actions, rewards, next_states, terminals, was_terminal=True):
+    def _truncate_n_step(self, states, actions, rewards, next_states, terminals, segment_lengths,
+                         segment_terminals):
         """
-        Computes n-step truncation for exactly one episode segment of one environment.
+        Computes n-step truncation for concatenated trajectory segments of all environments.
+
+        Args:
+            segment_lengths (list): Length of each segment.
+            segment_terminals (list): Whether each segment ended its episode. Non-terminal segments are shortened
+                by n - 1 records.
 
         Returns:
              n-step truncated (shortened) version.
         """
-        if self.n_step_adjustment > 1:
-            new_len = len(states) - self.n_step_adjustment + 1
-
-            # There are 2 cases. If the trajectory did not end in a terminal,
-            # we just have to move states forward and truncate.
-            if was_terminal:
-                # We know the ONLY last terminal is True.
-                terminal_position = len(rewards) - 1
-                for i in range(len(rewards)):
-                    for j in range(1, self.n_step_adjustment):
-                        # Outside sample data. Stop inner loop and set truncate = True
-                        if i + j >= len(next_states):
-                            break
-                        # Normal case: No terminal ahead (so far) in n-step sequence.
-                        if i + j < terminal_position:
-                            next_states[i] = next_states[i + j]
-                            rewards[i] += self.discount ** j * rewards[i + j]
-                        # Terminal ahead: Don't go beyond it.
-                        # Repeat it for the remaining n-steps and always assume r=0.0.
-                        else:
-                            next_states[i] = next_states[terminal_position]
-                            terminals[i] = True
-                            if i + j <= terminal_position:
-                                rewards[i] += self.discount ** j * rewards[i + j]
-            else:
-                # We know this segment does not contain any terminals so we simply have to adjust next
-                # states and rewards.
-                for i in range_(len(rewards) - self.n_step_adjustment + 1):
-                    for j in range_(1, self.n_step_adjustment):
-                        next_states[i] = next_states[i + j]
-                        rewards[i] += self.discount ** j * rewards[i + j]
-                for arr in [states, actions, rewards, next_states, terminals]:
-                    del arr[new_len:]
+        if self.n_step_adjustment <= 1:
+            return states, actions, rewards, next_states, terminals
 
-        return states, actions, rewards, next_states, terminals
+        rewards, terminals, next_state_indices, keep = n_step_transform(
+            rewards, terminals, segment_lengths, self.n_step_adjustment, self.discount, segment_terminals
+        )
+        return states[keep], actions[keep], rewards[keep], next_states[next_state_indices[keep]], terminals[keep]
 
     def _batch_process_sample(self, states, actions, rewards, next_states, terminals):
         """
         Batch Post-processes sample, e.g. by computing priority weights, and compressing.
 
         Args:
-            states (list): List of states.
-            actions (list): List of actions.
-            rewards (list): List of rewards.
-            next_states: (list): List of next_states.
-            terminals (list): List of terminals.
+            states (ndarray): States.
+            actions (ndarray): Actions.
+            rewards (ndarray): Rewards.
+            next_states: (ndarray): Next states.
+            terminals (ndarray): Terminals.
 
         Returns:
             dict: Sample batch dict.
@@ -529,12 +542,10 @@ class RayValueWorker(RayActor):
             )
             weights = np.abs(loss_per_item) + SMALL_NUMBER
         env_dtype = self.vector_env.state_space.dtype
-        compressed_states = [ray_compress(np.asarray(state, dtype=util.convert_dtype(dtype=env_dtype, to='np')))
-                             for state in states]
-
+        env_dtype = util.convert_dtype(dtype=env_dtype, to='np')
+        compressed_states = self.state_codec.compress_batch(states, dtype=env_dtype)
         compressed_next_states = compressed_states[self.n_step_adjustment:] + \
-                                 [ray_compress(np.asarray(next_s,dtype=util.convert_dtype(dtype=env_dtype, to='np')))
-                                  for next_s in next_states[-self.n_step_adjustment:]]
+            self.state_codec.compress_batch(next_states[-self.n_step_adjustment:], dtype=env_dtype)
         return dict(
             states=compressed_states,
             actions=np.array(actions),
@@ -17,11 +17,13 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import numpy as np
+
 from rlgraph.execution.ray.ray_policy_worker import RayPolicyWorker
 
 from rlgraph import get_distributed_backend
 from rlgraph.execution.ray.ray_executor import RayExecutor
-from rlgraph.execution.ray.ray_util import merge_samples, RayWeight
+from rlgraph.execution.ray.ray_util import merge_samples, WeightPublisher
 
 if get_distributed_backend() == "ray":
     import ray
@@ -61,6 +63,23 @@ class SyncBatchExecutor(RayExecutor):
         # These are the tasks actually interacting with the environment.
         self.worker_sample_size = self.executor_spec["num_worker_samples"]
 
+        # Versioned weights, only sent to workers holding a stale version.
+        self.weight_publisher = WeightPublisher(encoding=self.executor_spec.get("weight_encoding", "none"))
+        self.worker_weight_versions = {}
+        self.weights_updated = True
+
+        # Pipelined mode: Workers sample the next batch with the current weights while the learner updates.
+        self.pipelined = self.executor_spec.get("pipelined", False)
+        # Max. number of weight versions a sample may lag behind the learner, staler samples are discarded.
+        self.max_policy_lag = self.executor_spec.get("max_policy_lag", 1 if self.pipelined else 0)
+        # Fraction of running workers to wait for before proceeding, the others keep sampling in the background.
+        self.min_worker_fraction = self.executor_spec.get("min_worker_fraction", 1.0)
+        # Maps workers to their running sample task.
+        self.sample_tasks = {}
+        # Threads decoding compressed states when merging samples, and whether states are only decoded on access.
+        self.decompression_threads = self.executor_spec.get("decompression_threads", None)
+        self.lazy_decompression = self.executor_spec.get("lazy_decompression", False)
+
         assert not ray_spec, "ERROR: ray_spec still contains items: {}".format(ray_spec)
         self.logger.info("Setting up execution for Apex executor.")
         self.setup_execution()
@@ -85,41 +104,78 @@ class SyncBatchExecutor(RayExecutor):
             self.worker_spec, self.environment_spec, self.worker_frameskip
         )
 
+    def _schedule_sample_tasks(self):
+        """
+        Syncs weights to all idle workers holding a stale version and schedules their next sample task.
+        """
+        for ray_worker in self.ray_env_sample_workers:
+            if ray_worker in self.sample_tasks:
+                continue
+            weights = self.weight_publisher.weights_for(self.worker_weight_versions.get(ray_worker, 0))
+            if weights is not None:
+                ray_worker.set_weights.remote(weights)
+                self.worker_weight_versions[ray_worker] = self.weight_publisher.version
+            self.sample_tasks[ray_worker] = ray_worker.execute_and_get_timesteps.remote(self.worker_sample_size)
+
+    def _wait_for_samples(self):
+        """
+        Blocks until `min_worker_fraction` of the workers (or all running ones) returned samples.
+
+        Returns:
+            list: Completed EnvironmentSamples.
+        """
+        workers = {object_id: ray_worker for ray_worker, object_id in self.sample_tasks.items()}
+        num_returns = int(np.ceil(self.min_worker_fraction * len(self.ray_env_sample_workers)))
+        num_returns = min(max(num_returns, 1), len(workers))
+        ready, _ = ray.wait(list(workers.keys()), num_returns=num_returns)
+        for object_id in ready:
+            del self.sample_tasks[workers[object_id]]
+        return ray.get(ready)
+
     def _execute_step(self):
         """
         Executes a workload on Ray. The main loop performs the following
         steps until the specified number of steps or episodes is finished:
 
-        - Sync weights to policy workers.
-        - Schedule a set of samples
+        - Sync weights to idle policy workers and schedule samples
         - Wait until enough samples tasks are complete to form an update batch
+        - In pipelined mode, schedule the samples of the next step on the idle workers
         - Merge samples
         - Perform local update(s)
         """
         # Env steps done during this rollout.
         env_steps = 0
+        discarded = 0
 
-        # 1. Sync local learners weights to remote workers.
-        weights = ray.put(RayWeight(self.local_agent.get_weights()))
-        for ray_worker in self.ray_env_sample_workers:
-            ray_worker.set_weights.remote(weights)
+        # 1. Publish the local learners weights of the last update.
+        if self.weights_updated:
+            self.weight_publisher.publish(self.local_agent.get_weights())
+            self.weights_updated = False
 
         # 2. Schedule samples and fetch results from RayWorkers.
         sample_batches = []
         num_samples = 0
         while num_samples < self.update_batch_size:
-            batches = ray.get([worker.execute_and_get_timesteps.remote(self.worker_sample_size)
-                              for worker in self.ray_env_sample_workers])
-            # Each batch has exactly worker_sample_size length.
-            num_samples += len(batches) * self.worker_sample_size
-            sample_batches.extend(batches)
-
-        env_steps += num_samples
-        # 3. Merge samples
-        batch = merge_samples(sample_batches, decompress=self.compress_states)
-
-        # 4. Update from merged batch.
+            self._schedule_sample_tasks()
+            for batch in self._wait_for_samples():
+                env_steps += batch.batch_size
+                policy_lag = self.weight_publisher.version - batch.metrics["policy_version"]
+                if policy_lag > self.max_policy_lag:
+                    discarded += 1
+                    continue
+                self.policy_lags.append(policy_lag)
+                num_samples += batch.batch_size
+                sample_batches.append(batch)
+
+        # 3. Workers sample the next batch with the current weights during the update.
+        if self.pipelined:
+            self._schedule_sample_tasks()
+
+        # 4. Merge samples
+        batch = merge_samples(sample_batches, decompress=self.compress_states, lazy=self.lazy_decompression,
+                              num_threads=self.decompression_threads)
+
+        # 5. Update from merged batch.
         self.local_agent.update(batch, apply_postprocessing=False)
-        return env_steps, 1, 0, 0
-
-
+        self.weights_updated = True
+        return env_steps, 1, discarded, 0
@@ -0,0 +1,134 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+class TrajectoryBuffer(object):
+    """
+    Fixed-shape buffer for the trajectories collected by a worker over a vector of environments.
+
+    Each step of all environments is written in place into row `t` of arrays of shape
+    `(num_steps + 1, num_envs) + value_shape`. Episode fragments are tracked as (env, start, end) index ranges
+    and only gathered into contiguous per-fragment batches when a sample is emitted.
+    """
+    def __init__(self, num_envs, state_shape, state_dtype):
+        """
+        Args:
+            num_envs (int): Number of environments stepped together.
+            state_shape (tuple): Shape of a single (preprocessed) state.
+            state_dtype (np.dtype): Dtype of states.
+        """
+        self.num_envs = num_envs
+        self.state_shape = tuple(state_shape)
+        self.state_dtype = state_dtype
+        self.capacity = 0
+        self.states = None
+        # Allocated on the first write, once shape and dtype are known.
+        self.actions = None
+        self.rewards = None
+        self.terminals = None
+
+        self.t = 0
+        self.segment_starts = np.zeros(shape=(num_envs,), dtype=np.int64)
+        # Finished segments as (env index, start, end, ends episode, final next state).
+        self.segments = []
+
+    def reset(self, num_steps):
+        """
+        Clears the buffer, growing it if needed.
+
+        Args:
+            num_steps (int): Max. number of steps (of all environments) written before the next reset.
+        """
+        # One spare row so next states can be read one step ahead.
+        if num_steps + 1 > self.capacity:
+            self.capacity = num_steps + 1
+            self.states = np.zeros(shape=(self.capacity, self.num_envs) + self.state_shape, dtype=self.state_dtype)
+            self.actions = None
+            self.rewards = np.zeros(shape=(self.capacity, self.num_envs))
+            self.terminals = np.zeros(shape=(self.capacity, self.num_envs), dtype=bool)
+        self.t = 0
+        self.segment_starts[:] = 0
+        self.segments = []
+
+    def add(self, states, actions, rewards, terminals):
+        """
+        Writes one step of all environments.
+
+        Args:
+            states (ndarray): States of shape `(num_envs,) + state_shape`.
+            actions (Union[list,ndarray]): Actions.
+            rewards (Union[list,ndarray]): Rewards.
+            terminals (Union[list,ndarray]): Terminals.
+        """
+        if self.actions is None:
+            actions = np.asarray(actions)
+            self.actions = np.zeros(shape=(self.capacity,) + actions.shape, dtype=actions.dtype)
+        self.states[self.t] = states
+        self.actions[self.t] = actions
+        self.rewards[self.t] = rewards
+        self.terminals[self.t] = terminals
+        self.t += 1
+
+    def end_segment(self, env_index, ends_episode=True, next_state=None):
+        """
+        Ends the current fragment of an environment after the last written step.
+
+        Args:
+            env_index (int): Index of the environment.
+            ends_episode (bool): Whether the fragment ends its episode.
+            next_state (Optional[ndarray]): Next state of the last step of the fragment.
+        """
+        start = int(self.segment_starts[env_index])
+        if self.t > start:
+            # Copy, as vector envs may return views of reused state buffers.
+            if next_state is not None:
+                next_state = np.array(next_state)
+            self.segments.append((env_index, start, self.t, ends_episode, next_state))
+        self.segment_starts[env_index] = self.t
+
+    def get_batch(self, with_next_states=False):
+        """
+        Gathers all finished fragments into contiguous arrays, in the order they were ended.
+
+        Args:
+            with_next_states (bool): If True, also returns next states. Requires all fragments to be ended with
+                `next_state`.
+
+        Returns:
+            tuple: Dict of states, actions, rewards, terminals (and next states) arrays, list of fragment lengths,
+                list of flags whether fragments end their episode.
+        """
+        lengths = [end - start for _, start, end, _, _ in self.segments]
+        steps = np.concatenate([np.arange(start, end) for _, start, end, _, _ in self.segments] or [[]])
+        steps = steps.astype(np.int64)
+        envs = np.repeat([env_index for env_index, _, _, _, _ in self.segments], lengths).astype(np.int64)
+        batch = dict(
+            states=self.states[steps, envs],
+            actions=self.actions[steps, envs] if self.actions is not None else np.zeros(shape=(0,)),
+            rewards=self.rewards[steps, envs],
+            terminals=self.terminals[steps, envs]
+        )
+        if with_next_states:
+            next_states = self.states[steps + 1, envs]
+            if len(lengths) > 0:
+                next_states[np.cumsum(lengths) - 1] = [segment[4] for segment in self.segments]
+            batch["next_states"] = next_states
+        return batch, lengths, [segment[3] for segment in self.segments]
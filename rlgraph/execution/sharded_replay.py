@@ -0,0 +1,314 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from six.moves import xrange as range_
+
+from rlgraph.execution.environment_sample import EnvironmentSample
+from rlgraph.utils.rlgraph_errors import RLGraphError
+from rlgraph.utils.specifiable import Specifiable
+
+
+class RateLimiter(object):
+    """
+    Controls the ratio of sampled to inserted records (samples-per-insert).
+
+    The limiter tracks `diff = samples_per_insert * inserted - sampled`. Sampling is allowed while the diff stays
+    above `samples_per_insert * min_size_to_sample - error_buffer`, inserting while it stays below
+    `samples_per_insert * min_size_to_sample + error_buffer`. Thus neither the learner can oversample stale data
+    nor can actors run arbitrarily far ahead of the learner.
+    """
+    def __init__(self, samples_per_insert=None, min_size_to_sample=1, error_buffer=None):
+        """
+        Args:
+            samples_per_insert (Optional[float]): Target number of times each record is sampled on average.
+                None disables rate limiting (only `min_size_to_sample` is enforced).
+            min_size_to_sample (int): Number of inserted records required before sampling.
+            error_buffer (Optional[float]): Tolerated deviation from the target ratio, in sampled records.
+                Defaults to `max(1.0, samples_per_insert) * min_size_to_sample`.
+        """
+        self.samples_per_insert = samples_per_insert
+        self.min_size_to_sample = min_size_to_sample
+        if error_buffer is None and samples_per_insert is not None:
+            error_buffer = max(1.0, samples_per_insert) * min_size_to_sample
+        self.error_buffer = error_buffer
+
+        self.inserted = 0
+        self.sampled = 0
+
+    def diff(self):
+        return self.samples_per_insert * self.inserted - self.sampled
+
+    def can_insert(self, num_records):
+        if self.samples_per_insert is None:
+            return True
+        max_diff = self.samples_per_insert * self.min_size_to_sample + self.error_buffer
+        # Always admit inserts while the memory is still warming up.
+        return self.inserted < self.min_size_to_sample or \
+            self.diff() + self.samples_per_insert * num_records <= max_diff
+
+    def can_sample(self, num_records):
+        if self.inserted < self.min_size_to_sample:
+            return False
+        if self.samples_per_insert is None:
+            return True
+        min_diff = self.samples_per_insert * self.min_size_to_sample - self.error_buffer
+        return self.diff() - num_records >= min_diff
+
+    def insert(self, num_records):
+        self.inserted += num_records
+
+    def sample(self, num_records):
+        self.sampled += num_records
+
+
+class ShardedReplay(Specifiable):
+    """
+    A prioritized replay split into several shards, e.g. one per replay process.
+
+    Implementations route inserted samples explicitly to shards, apply back-pressure via a `RateLimiter`
+    and return one merged batch across all shards via `sample_from_all_shards`. Each record in a merged
+    batch carries the id of its shard ("shard_ids") and its index within that shard ("indices") so
+    priorities can be updated with `update_priorities`.
+    """
+    routing_strategies = ["round_robin", "least_filled", "random"]
+
+    def __init__(self, num_shards, shard_capacity, routing="round_robin", samples_per_insert=None,
+                 min_size_to_sample=1, error_buffer=None):
+        """
+        Args:
+            num_shards (int): Number of shards.
+            shard_capacity (int): Capacity of each shard.
+            routing (str): How samples without an explicit shard id are routed. One of "round_robin",
+                "least_filled" (shard with the fewest records) and "random".
+            samples_per_insert (Optional[float]): Target samples-per-insert ratio, see `RateLimiter`.
+            min_size_to_sample (int): Total number of records required before sampling.
+            error_buffer (Optional[float]): Tolerated deviation from the ratio, see `RateLimiter`.
+        """
+        super(ShardedReplay, self).__init__()
+        if routing not in self.routing_strategies:
+            raise RLGraphError("Unknown routing strategy {}, must be one of {}.".format(
+                routing, self.routing_strategies)
+            )
+        self.num_shards = num_shards
+        self.shard_capacity = shard_capacity
+        self.routing = routing
+        self.rate_limiter = RateLimiter(samples_per_insert, min_size_to_sample, error_buffer)
+
+        self.shard_sizes = np.zeros(shape=(num_shards,), dtype=np.int64)
+        self.next_shard = 0
+
+    def route(self, shard_id=None):
+        """
+        Determines the shard to insert the next sample into.
+
+        Args:
+            shard_id (Optional[int]): Explicit shard id. If given, no routing takes place.
+
+        Returns:
+            int: The shard id.
+        """
+        if shard_id is not None:
+            return shard_id
+        if self.routing == "round_robin":
+            shard_id = self.next_shard
+            self.next_shard = (self.next_shard + 1) % self.num_shards
+        elif self.routing == "least_filled":
+            shard_id = int(np.argmin(self.shard_sizes))
+        else:
+            shard_id = np.random.randint(self.num_shards)
+        return shard_id
+
+    def record_insert(self, shard_id, num_records):
+        """
+        Updates routing and rate limiting state after an insert.
+        """
+        self.shard_sizes[shard_id] = min(self.shard_sizes[shard_id] + num_records, self.shard_capacity)
+        self.rate_limiter.insert(num_records)
+
+    def split_batch_size(self, batch_size, shard_weights=None):
+        """
+        Splits a batch size over shards, proportional to `shard_weights` (e.g. total priority) or, if not given,
+        to shard sizes.
+
+        Returns:
+            ndarray: Number of records to sample per shard.
+        """
+        weights = self.shard_sizes if shard_weights is None else np.asarray(shard_weights, dtype=np.float64)
+        total = np.sum(weights)
+        if total <= 0:
+            return np.zeros(shape=(self.num_shards,), dtype=np.int64)
+        return np.random.multinomial(batch_size, weights / total)
+
+    @staticmethod
+    def merge_shard_batches(shard_batches):
+        """
+        Merges per-shard batches into one batch.
+
+        Args:
+            shard_batches (list): List of tuples (shard_id, batch, indices, weights) as returned by the
+                shards' `get_records`.
+
+        Returns:
+            dict: Merged batch, including "indices", "shard_ids" and "importance_weights".
+        """
+        batch = {}
+        for key in shard_batches[0][1].keys():
+            batch[key] = np.concatenate([shard_batch[key] for _, shard_batch, _, _ in shard_batches])
+        batch["indices"] = np.concatenate([indices for _, _, indices, _ in shard_batches])
+        batch["importance_weights"] = np.concatenate([weights for _, _, _, weights in shard_batches])
+        batch["shard_ids"] = np.concatenate([
+            np.full(shape=(len(indices),), fill_value=shard_id, dtype=np.int64)
+            for shard_id, _, indices, _ in shard_batches
+        ])
+        return batch
+
+    def insert(self, env_sample, shard_id=None, timeout=None):
+        """
+        Inserts a sample into one shard.
+
+        Args:
+            env_sample (EnvironmentSample): Sample to insert.
+            shard_id (Optional[int]): Explicit shard to insert into.
+            timeout (Optional[float]): Max seconds to wait if the rate limiter blocks inserts. None to wait
+                indefinitely.
+
+        Returns:
+            bool: True if inserted, False if the insert was rejected due to back-pressure.
+        """
+        raise NotImplementedError
+
+    def sample_from_all_shards(self, batch_size, timeout=None):
+        """
+        Samples one merged batch across all shards.
+
+        Args:
+            batch_size (int): Total number of records.
+            timeout (Optional[float]): Max seconds to wait if the rate limiter blocks sampling. None to wait
+                indefinitely.
+
+        Returns:
+            Optional[dict]: Merged batch or None if sampling is not (yet) possible.
+        """
+        raise NotImplementedError
+
+    def update_priorities(self, shard_ids, indices, loss):
+        """
+        Updates priorities of sampled records.
+
+        Args:
+            shard_ids (ndarray): Shard of each record.
+            indices (ndarray): Index of each record within its shard.
+            loss (ndarray): Loss values used as new priorities.
+        """
+        raise NotImplementedError
+
+
+class LocalShardedReplay(ShardedReplay):
+    """
+    In-process, multi-threaded sharded replay using one `ApexMemory` per shard. Shards are locked individually,
+    so inserts into and samples from different shards proceed concurrently. Usable without Ray, e.g. for tests.
+    """
+    def __init__(self, num_shards, memory_spec, routing="round_robin", samples_per_insert=None,
+                 min_size_to_sample=1, error_buffer=None, clip_rewards=False, num_threads=None):
+        """
+        Args:
+            num_shards (int): Number of shards.
+            memory_spec (dict): Spec for the `ApexMemory` of each shard. Its "capacity" is the per-shard capacity.
+            clip_rewards (bool): Whether to clip rewards to their sign on insert (as `RayMemoryActor` does).
+            num_threads (Optional[int]): Threads used to sample shards in parallel. Defaults to `num_shards`.
+
+        See `ShardedReplay` for the remaining args.
+        """
+        # Avoid import cycle, Ape-X package imports executors.
+        from rlgraph.execution.ray.apex.apex_memory import ApexMemory
+
+        # As in `RayMemoryActor`, only use the type if it names an Apex memory (not e.g. the agent's memory type).
+        memory_spec = dict(memory_spec)
+        memory_type = memory_spec.pop("type", None)
+        if ApexMemory.lookup_class(memory_type) is None:
+            memory_type = None
+        self.shards = [ApexMemory.from_spec(memory_type, **memory_spec) for _ in range_(num_shards)]
+        super(LocalShardedReplay, self).__init__(
+            num_shards=num_shards, shard_capacity=self.shards[0].capacity, routing=routing,
+            samples_per_insert=samples_per_insert, min_size_to_sample=min_size_to_sample, error_buffer=error_buffer
+        )
+        self.clip_rewards = clip_rewards
+        self.shard_locks = [threading.Lock() for _ in range_(num_shards)]
+        # Guards routing and rate limiter state, notified on every insert and sample.
+        self.condition = threading.Condition()
+        self.thread_pool = ThreadPoolExecutor(max_workers=num_threads or num_shards)
+
+    def insert(self, env_sample, shard_id=None, timeout=None):
+        records = env_sample.get_batch() if isinstance(env_sample, EnvironmentSample) else env_sample
+        num_records = len(records["rewards"])
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.rate_limiter.can_insert(num_records), timeout=timeout):
+                return False
+            shard_id = self.route(shard_id)
+
+        records = dict(records)
+        if self.clip_rewards:
+            records["rewards"] = np.sign(records["rewards"])
+        with self.shard_locks[shard_id]:
+            self.shards[shard_id].insert_batch(records)
+        # Only count records once written, so samplers never see inserts the shards cannot serve yet.
+        with self.condition:
+            self.record_insert(shard_id, num_records)
+            self.condition.notify_all()
+        return True
+
+    def sample_from_all_shards(self, batch_size, timeout=None):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.rate_limiter.can_sample(batch_size), timeout=timeout):
+                return None
+            shard_masses = [shard.merged_segment_tree.sum_segment_tree.get_sum() for shard in self.shards]
+            # Nothing to draw from, the caller retries.
+            if np.sum(shard_masses) <= 0:
+                return None
+            self.rate_limiter.sample(batch_size)
+
+        shard_batch_sizes = self.split_batch_size(batch_size, shard_masses)
+        futures = [
+            (shard_id, self.thread_pool.submit(self._sample_shard, shard_id, int(num_records)))
+            for shard_id, num_records in enumerate(shard_batch_sizes) if num_records > 0
+        ]
+        shard_batches = [(shard_id,) + future.result() for shard_id, future in futures]
+        with self.condition:
+            self.condition.notify_all()
+        return self.merge_shard_batches(shard_batches)
+
+    def _sample_shard(self, shard_id, num_records):
+        with self.shard_locks[shard_id]:
+            return self.shards[shard_id].get_records(num_records)
+
+    def update_priorities(self, shard_ids, indices, loss):
+        shard_ids = np.asarray(shard_ids)
+        indices = np.asarray(indices)
+        loss = np.asarray(loss)
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            with self.shard_locks[shard_id]:
+                self.shards[shard_id].update_records(indices[mask], loss[mask])
+
+    def size(self):
+        return int(np.sum([shard.size for shard in self.shards]))
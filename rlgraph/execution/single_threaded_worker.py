@@ -30,7 +30,22 @@ from rlgraph.execution.worker import Worker
 
 class SingleThreadedWorker(Worker):
 
-    def __init__(self, preprocessing_spec=None, worker_executes_preprocessing=True, **kwargs):
+    def __init__(self, preprocessing_spec=None, worker_executes_preprocessing=True, vectorized_preprocessing=False,
+                 async_envs=False, min_ready_envs=None, ready_timeout=None, **kwargs):
+        """
+        Args:
+            preprocessing_spec (Optional[list]): Preprocessor specs of the worker's preprocessor stacks.
+            worker_executes_preprocessing (bool): Whether the worker preprocesses states instead of the agent.
+            vectorized_preprocessing (bool): If True, one preprocessor stack processes the states of all
+                environments as one batch, instead of one stack per environment.
+            async_envs (bool): If True, environments are stepped asynchronously: The agent acts on whichever
+                environments have finished their last step instead of waiting for all of them, so slow steps or
+                resets do not stall the other environments.
+            min_ready_envs (Optional[int]): Min. number of finished environments to act on in async mode.
+                Defaults to half the environments.
+            ready_timeout (Optional[float]): Max. seconds to wait for `min_ready_envs` environments in async mode,
+                after which the agent acts on the environments ready so far. None to always wait.
+        """
         super(SingleThreadedWorker, self).__init__(**kwargs)
 
         self.logger.info("Initialized single-threaded executor with {} environments '{}' and Agent '{}'".format(
@@ -42,13 +57,20 @@ class SingleThreadedWorker(Worker):
             worker_executes_preprocessing = False
 
         self.worker_executes_preprocessing = worker_executes_preprocessing
+        self.vectorized_preprocessing = vectorized_preprocessing and self.worker_executes_preprocessing
         if self.worker_executes_preprocessing:
-            self.preprocessors = {}
             self.state_is_preprocessed = {}
-            for env_id in self.env_ids:
-                self.preprocessors[env_id] = self.setup_preprocessor(
+            if self.vectorized_preprocessing:
+                self.preprocessor = self.setup_preprocessor(
                     preprocessing_spec, self.vector_env.state_space.with_batch_rank()
                 )
+            else:
+                self.preprocessors = {}
+                for env_id in self.env_ids:
+                    self.preprocessors[env_id] = self.setup_preprocessor(
+                        preprocessing_spec, self.vector_env.state_space.with_batch_rank()
+                    )
+            for env_id in self.env_ids:
                 self.state_is_preprocessed[env_id] = False
 
         self.apply_preprocessing = not self.worker_executes_preprocessing
@@ -75,6 +97,15 @@ class SingleThreadedWorker(Worker):
         # The current state of the running episode.
         self.env_states = [None for _ in range_(self.num_environments)]
 
+        self.async_envs = async_envs
+        self.min_ready_envs = min_ready_envs or max(self.num_environments // 2, 1)
+        self.ready_timeout = ready_timeout
+        # Async mode: Environments waiting for an action, whether an env is being reset, and the preprocessed
+        # state and action of each env's step in flight.
+        self.ready_env_indices = None
+        self.env_resetting = [False for _ in range_(self.num_environments)]
+        self.pending_transitions = [None for _ in range_(self.num_environments)]
+
     @staticmethod
     def setup_preprocessor(preprocessing_spec, in_space):
         if preprocessing_spec is not None:
@@ -168,6 +199,12 @@ class SingleThreadedWorker(Worker):
         max_timesteps_per_episode = [max_timesteps_per_episode or 0 for _ in range_(self.num_environments)]
         frameskip = frameskip or self.frameskip
 
+        if self.async_envs:
+            if frameskip > 1:
+                raise RLGraphError("Async env stepping does not repeat actions, use the environments' frameskip.")
+            return self._execute_async(num_timesteps, num_episodes, max_timesteps_per_episode[0],
+                                       use_exploration, reset)
+
         # Stats.
         timesteps_executed = 0
         episodes_executed = 0
@@ -175,22 +212,7 @@ class SingleThreadedWorker(Worker):
         start = time.perf_counter()
         episode_terminals = self.episode_terminals
         if reset is True:
-            self.env_frames = 0
-            self.episodes_since_update = 0
-            self.finished_episode_rewards = [[] for _ in range_(self.num_environments)]
-            self.finished_episode_durations = [[] for _ in range_(self.num_environments)]
-            self.finished_episode_timesteps = [[] for _ in range_(self.num_environments)]
-
-            for i, env_id in enumerate(self.env_ids):
-                self.episode_returns[i] = 0
-                self.episode_timesteps[i] = 0
-                self.episode_terminals[i] = False
-                self.episode_starts[i] = time.perf_counter()
-                if self.worker_executes_preprocessing:
-                    self.state_is_preprocessed[env_id] = False
-
-            self.env_states = self.vector_env.reset_all()
-            self.agent.reset()
+            self._reset_execution()
         elif self.env_states[0] is None:
             raise RLGraphError("Runner must be reset at the very beginning. Environment is in invalid state.")
 
@@ -202,14 +224,7 @@ class SingleThreadedWorker(Worker):
                 self.vector_env.render()
 
             if self.worker_executes_preprocessing:
-                for i, env_id in enumerate(self.env_ids):
-                    state = self.agent.state_space.force_batch(env_states[i])
-                    if self.preprocessors[env_id] is not None:
-                        if self.state_is_preprocessed[env_id] is False:
-                            self.preprocessed_states_buffer[i] = self.preprocessors[env_id].preprocess(state)
-                            self.state_is_preprocessed[env_id] = True
-                    else:
-                        self.preprocessed_states_buffer[i] = env_states[i]
+                self._preprocess_states(env_states, range_(self.num_environments))
                 # TODO extra returns when worker is not applying preprocessing.
                 actions = self.agent.get_action(
                     states=self.preprocessed_states_buffer, use_exploration=use_exploration,
@@ -225,22 +240,7 @@ class SingleThreadedWorker(Worker):
             # Accumulate the reward over n env-steps (equals one action pick). n=self.frameskip.
             env_rewards = [0 for _ in range_(self.num_environments)]
             next_states = None
-            # For container action spaces, we have to treat each key as an array with batch-rank at index 0.
-            # The action-dict is then translated into a list of dicts where each dict contains the original data
-            # but without the batch-rank.
-            # E.g. {'A': array([0, 1]), 'B': array([2, 3])} -> [{'A': 0, 'B': 2}, {'A': 1, 'B': 3}]
-            if self.agent.flat_action_space is not None:
-                some_key = next(iter(actions))
-                assert isinstance(actions, dict) and isinstance(actions[some_key], np.ndarray),\
-                    "ERROR: Cannot flip container-action batch with dict keys if returned value is not a dict OR " \
-                    "values of returned value are not np.ndarrays!"
-                # TODO: What if actions come as nested dicts (more than one level deep)?
-                env_actions = [{key: value[i] for key, value in actions.items()} for i in range(len(actions[some_key]))]
-            # No flipping necessary.
-            else:
-                env_actions = actions
-                if self.num_environments == 1 and env_actions.shape == ():
-                    env_actions = [env_actions]
+            env_actions = self._env_actions(actions, self.num_environments)
 
             for _ in range_(frameskip):
                 next_states, step_rewards, episode_terminals, _ = self.vector_env.step(actions=env_actions)
@@ -250,6 +250,11 @@ class SingleThreadedWorker(Worker):
                     env_rewards[i] += step_reward
                 if np.any(episode_terminals):
                     break
+            # Vector envs may return views of reused state buffers (ParallelVectorEnv), the agent buffers next states.
+            if isinstance(next_states, np.ndarray):
+                next_states = list(np.array(next_states))
+            if self.vectorized_preprocessing:
+                preprocessed_next_states = np.array(self.preprocessor.preprocess(np.asarray(next_states)))
 
             # Only render once per action.
             #if self.render:
@@ -281,7 +286,10 @@ class SingleThreadedWorker(Worker):
 
                     # Reset this environment and its preprocecssor stack.
                     env_states[i] = self.vector_env.reset(i)
-                    if self.worker_executes_preprocessing and self.preprocessors[env_id] is not None:
+                    if self.vectorized_preprocessing:
+                        # The reset state is preprocessed with the next action's states.
+                        self.preprocessor.reset([i])
+                    elif self.worker_executes_preprocessing and self.preprocessors[env_id] is not None:
                         self.preprocessors[env_id].reset()
                         # This re-fills the sequence with the reset state.
                         state = self.agent.state_space.force_batch(env_states[i])
@@ -295,8 +303,13 @@ class SingleThreadedWorker(Worker):
                 else:
                     # Otherwise assign states to next states
                     env_states[i] = next_states[i]
+                    if self.vectorized_preprocessing:
+                        self.preprocessed_states_buffer[i] = preprocessed_next_states[i]
+                        self.state_is_preprocessed[env_id] = True
 
-                if self.worker_executes_preprocessing and self.preprocessors[env_id] is not None:
+                if self.vectorized_preprocessing:
+                    next_states[i] = preprocessed_next_states[i]
+                elif self.worker_executes_preprocessing and self.preprocessors[env_id] is not None:
                     #next_state = self.agent.state_space.force_batch(env_states[i])
                     next_states[i] = np.array(self.preprocessors[env_id].preprocess(env_states[i]))  # next_state
                 self._observe(
@@ -310,6 +323,17 @@ class SingleThreadedWorker(Worker):
             if 0 < num_episodes <= episodes_executed or num_timesteps_reached:
                 break
 
+        self.episode_terminals = episode_terminals
+        self.env_states = env_states
+        return self._get_results(start, timesteps_executed, episodes_executed)
+
+    def _get_results(self, start, timesteps_executed, episodes_executed):
+        """
+        Summarizes an execution started at `start` and logs its statistics.
+
+        Returns:
+            dict: Execution statistics.
+        """
         total_time = (time.perf_counter() - start) or 1e-10
 
         # Return values for current episode(s) if None have been completed.
@@ -329,8 +353,6 @@ class SingleThreadedWorker(Worker):
             max_episode_reward = np.max(all_finished_rewards)
             final_episode_reward = all_finished_rewards[-1]
 
-        self.episode_terminals = episode_terminals
-        self.env_states = env_states
         results = dict(
             runtime=total_time,
             # Agent act/observe throughput.
@@ -365,6 +387,193 @@ class SingleThreadedWorker(Worker):
 
         return results
 
+    def _preprocess_states(self, env_states, env_indices):
+        """
+        Preprocesses the states of the environments `env_indices` which are not preprocessed yet into the
+        preprocessed states buffer.
+        """
+        if self.vectorized_preprocessing:
+            rows = [i for i in env_indices if self.state_is_preprocessed[self.env_ids[i]] is False]
+            if len(rows) == self.num_environments:
+                self.preprocessed_states_buffer[:] = self.preprocessor.preprocess(np.asarray(env_states))
+            elif len(rows) > 0:
+                self.preprocessed_states_buffer[rows] = self.preprocessor.preprocess_envs(
+                    np.asarray([env_states[i] for i in rows]), rows
+                )
+            for i in rows:
+                self.state_is_preprocessed[self.env_ids[i]] = True
+        else:
+            for i in env_indices:
+                env_id = self.env_ids[i]
+                state = self.agent.state_space.force_batch(env_states[i])
+                if self.preprocessors[env_id] is not None:
+                    if self.state_is_preprocessed[env_id] is False:
+                        self.preprocessed_states_buffer[i] = self.preprocessors[env_id].preprocess(state)
+                        self.state_is_preprocessed[env_id] = True
+                else:
+                    self.preprocessed_states_buffer[i] = env_states[i]
+
+    def _reset_execution(self):
+        """
+        Resets the environments, the running episodes and the Worker's internal counters.
+        """
+        self.env_frames = 0
+        self.episodes_since_update = 0
+        self.finished_episode_rewards = [[] for _ in range_(self.num_environments)]
+        self.finished_episode_durations = [[] for _ in range_(self.num_environments)]
+        self.finished_episode_timesteps = [[] for _ in range_(self.num_environments)]
+
+        for i, env_id in enumerate(self.env_ids):
+            self.episode_returns[i] = 0
+            self.episode_timesteps[i] = 0
+            self.episode_terminals[i] = False
+            self.episode_starts[i] = time.perf_counter()
+            if self.worker_executes_preprocessing:
+                self.state_is_preprocessed[env_id] = False
+
+        self.env_states = self.vector_env.reset_all()
+        if self.vectorized_preprocessing:
+            self.preprocessor.reset()
+        self.agent.reset()
+
+    def _env_actions(self, actions, num_envs):
+        """
+        Splits a batch of actions into one action per environment.
+        """
+        # For container action spaces, we have to treat each key as an array with batch-rank at index 0.
+        # The action-dict is then translated into a list of dicts where each dict contains the original data
+        # but without the batch-rank.
+        # E.g. {'A': array([0, 1]), 'B': array([2, 3])} -> [{'A': 0, 'B': 2}, {'A': 1, 'B': 3}]
+        if self.agent.flat_action_space is not None:
+            some_key = next(iter(actions))
+            assert isinstance(actions, dict) and isinstance(actions[some_key], np.ndarray),\
+                "ERROR: Cannot flip container-action batch with dict keys if returned value is not a dict OR " \
+                "values of returned value are not np.ndarrays!"
+            # TODO: What if actions come as nested dicts (more than one level deep)?
+            return [{key: value[i] for key, value in actions.items()} for i in range(len(actions[some_key]))]
+        # No flipping necessary.
+        if num_envs == 1 and np.shape(actions) == ():
+            return [actions]
+        return actions
+
+    def _execute_async(self, num_timesteps, num_episodes, max_timesteps_per_episode, use_exploration, reset):
+        """
+        Asynchronous variant of `_execute`: The agent acts on a partial batch of the environments which have
+        finished their last step or reset (at least `min_ready_envs`, unless `ready_timeout` passes), while the
+        other environments keep stepping.
+
+        Returns:
+            dict: Execution statistics.
+        """
+        timesteps_executed = 0
+        episodes_executed = 0
+
+        start = time.perf_counter()
+        if reset is True:
+            self._reset_execution()
+            self.ready_env_indices = list(range_(self.num_environments))
+            self.env_resetting = [False for _ in range_(self.num_environments)]
+        elif self.ready_env_indices is None:
+            raise RLGraphError("Runner must be reset at the very beginning. Environment is in invalid state.")
+
+        env_states = self.env_states
+        while not (0 < num_timesteps <= timesteps_executed or 0 < num_episodes <= episodes_executed):
+            ready_env_indices = self.ready_env_indices
+            if len(ready_env_indices) > 0:
+                if self.worker_executes_preprocessing:
+                    self._preprocess_states(env_states, ready_env_indices)
+                    preprocessed_states = self.preprocessed_states_buffer[ready_env_indices]
+                    actions = self.agent.get_action(
+                        states=preprocessed_states, use_exploration=use_exploration,
+                        apply_preprocessing=self.apply_preprocessing
+                    )
+                else:
+                    actions, preprocessed_states = self.agent.get_action(
+                        states=np.array([env_states[i] for i in ready_env_indices]), use_exploration=use_exploration,
+                        apply_preprocessing=True, extra_returns="preprocessed_states"
+                    )
+                env_actions = self._env_actions(actions, len(ready_env_indices))
+                for i, state, action in zip(ready_env_indices, preprocessed_states, env_actions):
+                    self.pending_transitions[i] = (state, action)
+                self.vector_env.send(env_actions, ready_env_indices)
+                self.ready_env_indices = []
+
+            env_indices, next_states, step_rewards, step_terminals, _ = self.vector_env.recv(
+                min_ready=self.min_ready_envs, timeout=self.ready_timeout
+            )
+            if self.vectorized_preprocessing:
+                # Preprocess the next states of the stepped (not reset) environments in one batch.
+                stepped = [(i, next_state) for i, next_state in zip(env_indices, next_states)
+                           if not self.env_resetting[i]]
+                if len(stepped) > 0:
+                    stepped_env_indices = [i for i, _ in stepped]
+                    preprocessed_next_states = dict(zip(stepped_env_indices, np.array(
+                        self.preprocessor.preprocess_envs(np.asarray([state for _, state in stepped]),
+                                                          stepped_env_indices)
+                    )))
+            reset_env_indices = []
+            for i, next_state, step_reward, terminal in zip(env_indices, next_states, step_rewards, step_terminals):
+                env_id = self.env_ids[i]
+                env_states[i] = next_state
+                if self.env_resetting[i]:
+                    # Reset state arrived, the env starts a new episode.
+                    self.env_resetting[i] = False
+                    if self.worker_executes_preprocessing:
+                        self.state_is_preprocessed[env_id] = False
+                    self.episode_starts[i] = time.perf_counter()
+                    self.ready_env_indices.append(i)
+                    continue
+
+                self.env_frames += 1
+                timesteps_executed += 1
+                self.episode_returns[i] += step_reward
+                self.episode_timesteps[i] += 1
+                if 0 < max_timesteps_per_episode <= self.episode_timesteps[i]:
+                    terminal = True
+
+                if self.vectorized_preprocessing:
+                    next_state = preprocessed_next_states[i]
+                    self.preprocessed_states_buffer[i] = next_state
+                    self.state_is_preprocessed[env_id] = True
+                elif self.worker_executes_preprocessing and self.preprocessors[env_id] is not None:
+                    state = self.agent.state_space.force_batch(next_state)
+                    self.preprocessed_states_buffer[i] = self.preprocessors[env_id].preprocess(state)
+                    self.state_is_preprocessed[env_id] = True
+                    next_state = np.array(self.preprocessed_states_buffer[i])
+                state, action = self.pending_transitions[i]
+                self._observe(env_id, state, action, step_reward, next_state, terminal)
+
+                if terminal:
+                    episodes_executed += 1
+                    self.episodes_since_update += 1
+                    episode_duration = time.perf_counter() - self.episode_starts[i]
+                    self.finished_episode_rewards[i].append(self.episode_returns[i])
+                    self.finished_episode_durations[i].append(episode_duration)
+                    self.finished_episode_timesteps[i].append(self.episode_timesteps[i])
+                    self.log_finished_episode(
+                        reward=self.episode_returns[i],
+                        duration=episode_duration,
+                        timesteps=self.episode_timesteps[i],
+                        env_num=i
+                    )
+                    self.episode_returns[i] = 0
+                    self.episode_timesteps[i] = 0
+                    if self.vectorized_preprocessing:
+                        self.preprocessor.reset([i])
+                    elif self.worker_executes_preprocessing and self.preprocessors[env_id] is not None:
+                        self.preprocessors[env_id].reset()
+                    # The reset runs in the background as well.
+                    self.env_resetting[i] = True
+                    reset_env_indices.append(i)
+                else:
+                    self.ready_env_indices.append(i)
+            if len(reset_env_indices) > 0:
+                self.vector_env.send_reset(reset_env_indices)
+            self.update_if_necessary()
+
+        self.env_states = env_states
+        return self._get_results(start, timesteps_executed, episodes_executed)
+
     def _observe(self, env_ids, states, actions, rewards, next_states, terminals):
         # TODO: If worker does not execute preprocessing, next state is not preprocessed here.
         # Observe per environment.
@@ -22,7 +22,7 @@ import logging
 from six.moves import xrange as range_
 
 from rlgraph.utils.specifiable import Specifiable
-from rlgraph.environments import SequentialVectorEnv
+from rlgraph.environments import Environment
 
 
 class Worker(Specifiable):
@@ -30,7 +30,8 @@ class Worker(Specifiable):
     Generic worker to locally interact with simulator environments.
     """
     def __init__(self, agent, env_spec=None, num_envs=1, frameskip=1, render=False,
-                 worker_executes_exploration=True, exploration_epsilon=0.1, episode_finish_callback=None):
+                 worker_executes_exploration=True, exploration_epsilon=0.1, episode_finish_callback=None,
+                 vector_env_spec=None):
         """
         Args:
             agent (Agent): Agent to execute environment on.
@@ -43,13 +44,17 @@ class Worker(Specifiable):
                 Default: False.
             worker_executes_exploration (bool): If worker executes exploration by sampling.
             exploration_epsilon (Optional[float]): Epsilon to use if worker executes exploration.
+            vector_env_spec (Optional[dict]): Spec of the VectorEnv running the environments, e.g.
+                `dict(type="parallel_vector", num_processes=4)`. Defaults to a SequentialVectorEnv.
         """
         super(Worker, self).__init__()
         self.num_environments = num_envs
         self.logger = logging.getLogger(__name__)
         if env_spec is not None:
             self.env_ids = ["env_{}".format(i) for i in range_(self.num_environments)]
-            self.vector_env = SequentialVectorEnv(env_spec=env_spec, num_envs=self.num_environments)
+            self.vector_env = Environment.from_spec(
+                vector_env_spec or dict(type="sequential_vector"), env_spec=env_spec, num_envs=self.num_environments
+            )
         else:
             self.env_ids = []
             self.vector_env = None
@@ -138,6 +138,16 @@ class GraphExecutor(Specifiable):
         """
         pass
 
+    def assign_variable_values(self, variables, values):
+        """
+        Overwrites the values of graph variables, e.g. to restore non-trainable state such as memory contents.
+
+        Args:
+            variables (dict): Variable objects by name.
+            values (dict): New values by name, must match the variables' shapes and types.
+        """
+        raise NotImplementedError
+
     def init_execution(self):
         """
         Sets up backend-dependent execution, e.g. server for distributed TensorFlow
@@ -174,6 +174,13 @@ class PyTorchExecutor(GraphExecutor):
             # Attempt to read as single var.
             return Component.read_variable(variables)
 
+    def assign_variable_values(self, variables, values):
+        for name, variable in variables.items():
+            # Only tensors can be updated in place, other define-by-run state lives in component attributes.
+            if isinstance(variable, torch.Tensor):
+                with torch.no_grad():
+                    variable.copy_(torch.as_tensor(values[name], dtype=variable.dtype))
+
     def init_execution(self): \
         # TODO Import guards here are annoying but otherwise breaks if torch is not installed.
         if get_backend() == "torch":
@@ -278,6 +278,11 @@ class TensorFlowExecutor(GraphExecutor):
         self.logger.debug('Fetching values of variables {} from graph.'.format(variables))
         return self.monitored_session.run(variables, feed_dict=dict())
 
+    def assign_variable_values(self, variables, values):
+        self.logger.debug('Assigning values of variables {}.'.format(list(variables.keys())))
+        for name, variable in variables.items():
+            variable.load(values[name], session=self.session)
+
     def init_execution(self):
         """
         Creates and sets up the distributed backend.
@@ -18,9 +18,16 @@ from __future__ import division
 from __future__ import print_function
 
 import logging
+import os
+import shutil
+import tempfile
 import unittest
 
+import numpy as np
+
+from rlgraph import get_backend
 from rlgraph.agents import Agent, PPOAgent
+from rlgraph.components.helpers.mem_checkpoint import load_arrays
 from rlgraph.environments import GridWorld, OpenAIGymEnv
 from rlgraph.tests.test_util import config_from_path, recursive_assert_almost_equal
 from rlgraph.utils import root_logger
@@ -79,3 +86,58 @@ class TestBaseAgentFunctionality(unittest.TestCase):
 
         recursive_assert_almost_equal(new_actual_weights["value_function_weights"],
                                       value_function_weights)
+
+    def test_memory_storing_loading(self):
+        """
+        Tests storing and loading of replay, prioritized replay and ring buffer memories of an agent.
+        """
+        env = GridWorld(world="2x2")
+        prioritized_replay = "prioritized_replay" if get_backend() == "tf" else "mem_prioritized_replay"
+        configs = [
+            ("configs/dqn_agent_for_functionality_test.json", env.state_space, dict(type="replay", capacity=8)),
+            ("configs/dqn_agent_for_functionality_test.json", env.state_space,
+             dict(type=prioritized_replay, capacity=8)),
+            ("configs/ppo_agent_for_2x2_gridworld.json", GridWorld.grid_world_2x2_flattened_state_space,
+             dict(type="ring-buffer", capacity=8))
+        ]
+        # 9 records in 3 episodes, so all memories wrap around.
+        states = np.eye(4)[[0, 1, 3, 0, 2, 3, 0, 1, 3]]
+        actions = np.asarray([1, 3, 0, 2, 3, 1, 1, 0, 2])
+        rewards = np.arange(9, dtype=np.float32)
+        terminals = np.asarray([False, False, True] * 3)
+
+        for config_path, state_space, memory_spec in configs:
+            path = tempfile.mkdtemp()
+            try:
+                agent_config = config_from_path(config_path)
+                agent_config["memory_spec"] = memory_spec
+                agent_config["observe_spec"] = dict(buffer_size=memory_spec["capacity"])
+                agent_config["optimizer_spec"] = dict(type="adam", learning_rate=0.01)
+                agent = Agent.from_spec(agent_config, state_space=state_space, action_space=env.action_space)
+                for i in range(len(rewards)):
+                    agent.observe(states[i], actions[i], [], rewards[i], states[i], terminals[i])
+                agent.store_memory(path)
+                stored, _ = load_arrays(path)
+                if get_backend() == "pytorch" and memory_spec["type"] == "ring-buffer":
+                    self.assertEqual(stored["state/num_episodes"], 3)
+
+                restored_agent = Agent.from_spec(agent_config, state_space=state_space, action_space=env.action_space)
+                restored_agent.load_memory(path)
+                restored_agent.store_memory(path)
+                restored, _ = load_arrays(path)
+                recursive_assert_almost_equal(restored, stored)
+
+                # Incremental snapshots only rewrite changed chunks and match a full snapshot.
+                agent.store_memory(path, chunk_size=2)
+                chunk_times = {f: os.stat(os.path.join(path, f)).st_mtime_ns for f in os.listdir(path)}
+                # One more episode, flushed into the memory by its terminal.
+                for i in range(3):
+                    agent.observe(states[i], actions[i], [], rewards[i], states[i], terminals[i])
+                agent.store_memory(path, incremental=True, chunk_size=2)
+                full_path = os.path.join(path, "full")
+                agent.store_memory(full_path, chunk_size=2)
+                recursive_assert_almost_equal(load_arrays(path)[0], load_arrays(full_path)[0])
+                self.assertTrue(any(os.stat(os.path.join(path, f)).st_mtime_ns == chunk_time
+                                    for f, chunk_time in chunk_times.items() if f.endswith(".npz")))
+            finally:
+                shutil.rmtree(path)
@@ -23,11 +23,12 @@ import os
 import unittest
 
 from rlgraph.components.layers import GrayScale, ReShape, Multiply, Divide, Clip, ImageBinary, ImageResize, ImageCrop, \
-    MovingStandardize
+    MovingStandardize, AtariPreprocessing, Sequence
 from rlgraph.environments import OpenAIGymEnv
 from rlgraph.spaces import *
 from rlgraph.tests import ComponentTest, recursive_assert_almost_equal
 from rlgraph.utils import SMALL_NUMBER
+from rlgraph.utils.rlgraph_errors import RLGraphError
 
 
 class TestPreprocessLayers(unittest.TestCase):
@@ -103,6 +104,58 @@ class TestPreprocessLayers(unittest.TestCase):
         out = grayscale._graph_fn_apply(input_)
         recursive_assert_almost_equal(out, expected)
 
+    def test_atari_preprocessing_python(self):
+        space = IntBox(256, shape=(210, 160, 3), dtype="uint8", add_batch_rank=True)
+        atari_preprocessing = AtariPreprocessing(width=84, height=84, sequence_length=4, backend="python")
+        atari_preprocessing.create_variables(input_spaces=dict(preprocessing_inputs=space), action_space=None)
+        out_space = atari_preprocessing.get_preprocessed_space(space)
+        self.assertEqual(out_space.shape, (84, 84, 4))
+        self.assertEqual(out_space.dtype, np.uint8)
+
+        # Compare against the separate layers.
+        grayscale = GrayScale(keep_rank=True, backend="python")
+        image_resize = ImageResize(width=84, height=84, backend="python")
+        sequence = Sequence(sequence_length=4, add_rank=False, backend="python")
+        sequence.create_variables(input_spaces=dict(
+            preprocessing_inputs=IntBox(256, shape=(84, 84, 1), dtype="uint8", add_batch_rank=True)
+        ), action_space=None)
+        atari_preprocessing._graph_fn_reset()
+        sequence._graph_fn_reset()
+        for _ in range(6):
+            frames = space.sample(size=3)
+            out = atari_preprocessing._graph_fn_apply(frames)
+            expected = sequence._graph_fn_apply(image_resize._graph_fn_apply(grayscale._graph_fn_apply(frames)))
+            self.assertEqual(out.dtype, np.uint8)
+            recursive_assert_almost_equal(out, expected)
+
+        # Per-env reset.
+        atari_preprocessing.reset_envs([2])
+        frames = space.sample(size=1)
+        out = atari_preprocessing.apply_envs(frames, [2])
+        frame = image_resize._graph_fn_apply(grayscale._graph_fn_apply(frames))
+        recursive_assert_almost_equal(out, np.concatenate([frame] * 4, axis=-1))
+
+    def test_atari_preprocessing(self):
+        space = IntBox(256, shape=(210, 160, 3), dtype="uint8", add_batch_rank=True)
+        atari_preprocessing = AtariPreprocessing(width=84, height=84, sequence_length=4)
+        test = ComponentTest(component=atari_preprocessing, input_spaces=dict(preprocessing_inputs=space))
+
+        # Compare against the python backend (TF and cv2 may round gray values and area averages differently).
+        python_preprocessing = AtariPreprocessing(width=84, height=84, sequence_length=4, backend="python")
+        python_preprocessing.create_variables(input_spaces=dict(preprocessing_inputs=space), action_space=None)
+        for _ in range(2):
+            test.test("reset")
+            python_preprocessing._graph_fn_reset()
+            for _ in range(6):
+                frames = space.sample(size=1)
+                out = test.test(("apply", frames), expected_outputs=None)
+                expected = python_preprocessing._graph_fn_apply(frames)
+                self.assertEqual(out.dtype, np.uint8)
+                self.assertEqual(out.shape, (1, 84, 84, 4))
+                self.assertLessEqual(np.max(np.abs(out.astype(np.int64) - expected.astype(np.int64))), 1)
+
+        test.terminate()
+
     def test_split_inputs_on_grayscale(self):
         # last rank is always the color rank (its dim must match len(grayscale-weights))
         space = Dict.from_spec(dict(
@@ -265,3 +318,43 @@ class TestPreprocessLayers(unittest.TestCase):
         # Final output.
         expected_out = (samples[-1] - moving_standardize.mean_est) / std
         self.assertTrue(np.allclose(out, expected_out))
+
+    def test_moving_standardize_python_per_env(self):
+        space = FloatBox(shape=(2,), add_batch_rank=True)
+        # One vectorized instance vs. one instance per env.
+        moving_standardize = MovingStandardize(batch_size=3, backend="python")
+        moving_standardize.create_variables(input_spaces=dict(preprocessing_inputs=space), action_space=None)
+        single_standardizes = []
+        for _ in range(3):
+            single_standardize = MovingStandardize(backend="python")
+            single_standardize.create_variables(input_spaces=dict(preprocessing_inputs=space), action_space=None)
+            single_standardizes.append(single_standardize)
+
+        for _ in range(5):
+            batch = np.random.random(size=(3, 2))
+            out = moving_standardize._graph_fn_apply(batch)
+            for i, single_standardize in enumerate(single_standardizes):
+                recursive_assert_almost_equal(out[i], single_standardize._graph_fn_apply(batch[i:i+1])[0], decimals=5)
+
+        # Reset and advance env 1 only.
+        moving_standardize.reset_envs([1])
+        single_standardizes[1]._graph_fn_reset()
+        self.assertEqual(moving_standardize.sample_count[1], 0.0)
+        self.assertEqual(moving_standardize.sample_count[0], 5.0)
+        for _ in range(3):
+            rows = np.random.random(size=(2, 2))
+            out = moving_standardize.apply_envs(rows, [1, 2])
+            for row, i in enumerate([1, 2]):
+                recursive_assert_almost_equal(
+                    out[row], single_standardizes[i]._graph_fn_apply(rows[row:row+1])[0], decimals=5
+                )
+        self.assertEqual(list(moving_standardize.sample_count), [5.0, 3.0, 8.0])
+
+        # Changing the batch size would discard the estimates of all envs.
+        with self.assertRaises(RLGraphError):
+            moving_standardize._graph_fn_apply(np.random.random(size=(2, 2)))
+        self.assertEqual(list(moving_standardize.sample_count), [5.0, 3.0, 8.0])
+        # After a reset, the estimates follow the new batch size.
+        moving_standardize._graph_fn_reset()
+        moving_standardize._graph_fn_apply(np.random.random(size=(2, 2)))
+        self.assertEqual(list(moving_standardize.sample_count), [1.0, 1.0])
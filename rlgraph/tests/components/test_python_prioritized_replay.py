@@ -17,13 +17,24 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+import shutil
+import tempfile
 import unittest
 import numpy as np
 from six.moves import xrange as range_
+from rlgraph import get_backend
 from rlgraph.components.memories.mem_prioritized_replay import MemPrioritizedReplay
+from rlgraph.execution.environment_sample import EnvironmentSample
+from rlgraph.execution.ray.apex.apex_frame_memory import ApexFrameMemory
 from rlgraph.execution.ray.apex.apex_memory import ApexMemory
+from rlgraph.execution.ray.apex.memmap_apex_memory import MemmapApexMemory
+from rlgraph.execution.ray.apex.ray_memory_actor import RayMemoryActor
+from rlgraph.execution.ray.apex.shared_apex_memory import SharedApexMemory
 from rlgraph.execution.ray.ray_util import ray_compress
 from rlgraph.spaces import Dict, IntBox, BoolBox, FloatBox
+from rlgraph.tests import ComponentTest
+from rlgraph.tests.test_util import recursive_assert_almost_equal
 
 
 # TODO (Michael): Clean up memory semantics and tests re:
@@ -48,6 +59,20 @@ class TestPythonPrioritizedReplay(unittest.TestCase):
         add_batch_rank=True
     )
 
+    stratified_record_space = Dict(
+        states=dict(state1=float, state2=float),
+        actions=dict(action1=float),
+        rewards=float,
+        terminals=BoolBox(),
+        add_batch_rank=True
+    )
+    stratified_input_spaces = dict(
+        records=stratified_record_space,
+        num_records=int,
+        indices=IntBox(add_batch_rank=True),
+        update=FloatBox(add_batch_rank=True)
+    )
+
     memory_variables = ["size", "index", "max-priority"]
 
     capacity = 10
@@ -206,6 +231,49 @@ class TestPythonPrioritizedReplay(unittest.TestCase):
             self.assertEqual(min_segment_values[start], 1.0)
             start = int(start / 2)
 
+    @unittest.skipIf(get_backend() != "pytorch", "MemPrioritizedReplay is built for the PyTorch backend.")
+    def test_seeded_sampling(self):
+        """
+        Tests that memories with the same seed sample the same indices.
+        """
+        sampled_indices = []
+        for _ in range_(2):
+            memory = MemPrioritizedReplay(capacity=self.capacity, alpha=self.alpha, beta=self.beta, seed=10)
+            test = ComponentTest(component=memory, input_spaces=self.stratified_input_spaces)
+            test.test(("insert_records", self.stratified_record_space.sample(size=self.capacity)),
+                      expected_outputs=None)
+            test.test(("update_records", [np.arange(self.capacity), np.random.uniform(0.1, 2.0, self.capacity)]),
+                      expected_outputs=None)
+            sampled_indices.append([test.test(("get_records", 4), expected_outputs=None)[1] for _ in range_(3)])
+        recursive_assert_almost_equal(sampled_indices[0], sampled_indices[1])
+
+    @unittest.skipIf(get_backend() != "pytorch", "MemPrioritizedReplay is built for the PyTorch backend.")
+    def test_stratified_sampling(self):
+        """
+        Tests that each sample is drawn from its own segment of the priority mass.
+        """
+        memory = MemPrioritizedReplay(capacity=self.capacity, alpha=self.alpha, beta=self.beta, seed=10)
+        test = ComponentTest(component=memory, input_spaces=self.stratified_input_spaces)
+        test.test(("insert_records", self.stratified_record_space.sample(size=self.capacity)), expected_outputs=None)
+
+        # Uniform priorities: Sampling as many records as stored returns every record once.
+        _, indices, _ = test.test(("get_records", self.capacity), expected_outputs=None)
+        self.assertEqual(sorted(indices), list(range_(self.capacity)))
+
+        # Skewed priorities: Sample i falls into [i, i + 1) * total / num_samples of the priority mass.
+        priorities = np.asarray([8.0, 1.0, 1.0, 4.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0])
+        test.test(("update_records", [np.arange(self.capacity), priorities]), expected_outputs=None)
+        num_samples = 5
+        cumulative = np.cumsum(priorities)
+        segment_size = cumulative[-1] / num_samples
+        for _ in range_(10):
+            _, indices, _ = test.test(("get_records", num_samples), expected_outputs=None)
+            for i, index in enumerate(indices):
+                self.assertLess(i * segment_size, cumulative[index] + 1e-6)
+                self.assertGreater((i + 1) * segment_size, cumulative[index] - priorities[index] - 1e-6)
+            # Record 0 holds the first two segments.
+            self.assertEqual(list(indices[:2]), [0, 0])
+
     def test_tree_insert(self):
         """
         Tests inserting into the segment tree and querying segments.
@@ -255,3 +323,339 @@ class TestPythonPrioritizedReplay(unittest.TestCase):
         self.assertEqual(tree.index_of_prefixsum(1.51), 2)
         self.assertEqual(tree.index_of_prefixsum(3.0), 3)
         self.assertEqual(tree.index_of_prefixsum(5.50), 3)
+
+    def test_tree_insert_batch(self):
+        """
+        Tests that batched inserts produce the same trees as sequential inserts.
+        """
+        batch_memory = ApexMemory(capacity=10)
+        memory = ApexMemory(capacity=10)
+        indices = np.asarray([0, 3, 4, 9, 3])
+        priorities = np.asarray([0.5, 1.0, 2.0, 0.1, 3.0])
+
+        batch_memory.merged_segment_tree.insert_batch(indices, priorities)
+        for index, priority in zip(indices, priorities):
+            memory.merged_segment_tree.insert(index, priority)
+
+        self.assertTrue(np.allclose(
+            batch_memory.merged_segment_tree.sum_segment_tree.values,
+            memory.merged_segment_tree.sum_segment_tree.values
+        ))
+        self.assertTrue(np.array_equal(
+            batch_memory.merged_segment_tree.min_segment_tree.values,
+            memory.merged_segment_tree.min_segment_tree.values
+        ))
+        self.assertTrue(np.isclose(batch_memory.merged_segment_tree.sum_segment_tree.get_sum(), 5.6))
+        self.assertTrue(np.isclose(batch_memory.merged_segment_tree.min_segment_tree.get_min_value(), 0.1))
+
+    def test_prefixsum_idx_batch(self):
+        """
+        Tests fetching the indices corresponding to a batch of prefix sums.
+        """
+        memory = ApexMemory(
+            capacity=4
+        )
+        merged_tree = memory.merged_segment_tree
+        merged_tree.insert_batch(np.asarray([0, 1, 2, 3]), np.asarray([0.5, 1.0, 1.0, 3.0]))
+
+        indices = merged_tree.find_prefixsum_batch(np.asarray([0.0, 0.55, 0.99, 1.51, 3.0, 5.50]))
+        self.assertEqual(list(indices), [0, 1, 1, 2, 3, 3])
+
+    def test_apex_columnar_insert(self):
+        """
+        Tests that columnar storage matches the tuple storage, including wrap-around.
+        """
+        memory = ApexMemory(capacity=self.capacity, alpha=self.alpha, beta=self.beta, columnar=True)
+        tuple_memory = ApexMemory(capacity=self.capacity, alpha=self.alpha, beta=self.beta)
+
+        for batch_size in [3, 6, 12]:
+            observation = self.apex_space.sample(size=batch_size)
+            records = dict(
+                states=observation["states"],
+                actions=observation["actions"],
+                rewards=observation["reward"],
+                terminals=observation["terminals"],
+                next_states=observation["states"],
+                importance_weights=observation["weights"]
+            )
+            memory.insert_batch(records)
+            tuple_memory.insert_batch(records)
+            self.assertEqual(memory.index, tuple_memory.index)
+            self.assertEqual(memory.size, tuple_memory.size)
+
+            indices = np.arange(memory.size)
+            columnar_batch = memory.read_records(indices)
+            tuple_batch = tuple_memory.read_records(indices)
+            for key in columnar_batch:
+                self.assertTrue(np.allclose(columnar_batch[key], tuple_batch[key]))
+
+    def test_apex_insert_without_weights(self):
+        """
+        Tests that records without importance weights are inserted with max priority in both storage modes.
+        """
+        for columnar in [False, True]:
+            memory = ApexMemory(capacity=self.capacity, alpha=self.alpha, beta=self.beta, columnar=columnar)
+            memory.update_records(np.asarray([0]), np.asarray([2.0]))
+            observation = self.apex_space.sample(size=3)
+            memory.insert_batch(dict(
+                states=observation["states"],
+                actions=observation["actions"],
+                rewards=observation["reward"],
+                terminals=observation["terminals"],
+                next_states=observation["states"],
+                importance_weights=None
+            ))
+            memory.insert_records((observation["states"][0], observation["actions"][0], observation["reward"][0],
+                                   observation["terminals"][0], observation["states"][0], None))
+            self.assertEqual(memory.size, 4)
+
+            priorities = memory.merged_segment_tree.sum_segment_tree.values[
+                memory.priority_capacity:memory.priority_capacity + memory.size
+            ]
+            self.assertTrue(np.allclose(priorities, 2.0 ** self.alpha))
+            batch, indices, weights = memory.get_records(4)
+            self.assertFalse(np.any(np.isnan(weights)))
+
+    def test_apex_frame_memory(self):
+        """
+        Tests that frame-deduplicated storage rebuilds the inserted state stacks.
+        """
+        stack_size = 4
+        n_step = 2
+        num_records = 8
+        frames = np.random.randint(0, 255, size=(num_records + stack_size + n_step, 6, 6)).astype(np.uint8)
+        stacks = np.stack([np.moveaxis(frames[i:i + stack_size], 0, -1) for i in range(num_records + n_step)])
+        states = stacks[:num_records]
+        next_states = stacks[n_step:num_records + n_step]
+
+        memory = ApexFrameMemory(capacity=self.capacity, frame_capacity=2 * self.capacity, n_step=n_step)
+        memory.insert_batch(dict(
+            states=states,
+            actions=np.zeros(num_records),
+            rewards=np.ones(num_records),
+            terminals=np.zeros(num_records, dtype=bool),
+            next_states=next_states,
+            importance_weights=np.ones(num_records)
+        ))
+        # First stack in full, then one frame per state plus the last n-step next-state frames.
+        self.assertEqual(memory.num_frames, stack_size + (num_records - 1) + n_step)
+
+        indices = np.arange(num_records)
+        records = memory.read_records(indices)
+        self.assertTrue(np.array_equal(records["states"], states))
+        self.assertTrue(np.array_equal(records["next_states"], next_states))
+
+    def test_apex_frame_memory_eviction(self):
+        """
+        Tests that evicted transitions are excluded from the size used for importance weights.
+        """
+        memory = ApexFrameMemory(capacity=3, beta=1.0, frame_capacity=8)
+        # Unrelated stacks, states and next-states are stored in full: The frame ring holds 1 transition.
+        for i in range(3):
+            stacks = np.random.randint(0, 255, size=(2, 6, 6, 4)).astype(np.uint8)
+            memory.insert_batch(dict(
+                states=stacks[:1], actions=np.zeros(1), rewards=np.ones(1), terminals=np.zeros(1, dtype=bool),
+                next_states=stacks[1:], importance_weights=np.ones(1)
+            ))
+        self.assertEqual((memory.size, memory.num_live_records()), (3, 1))
+
+        # With uniform priorities over the live records, all weights are 1.
+        memory.update_records(np.asarray([2]), np.asarray([3.0]))
+        _, indices, weights = memory.get_records(8)
+        self.assertTrue(np.all(indices == 2))
+        recursive_assert_almost_equal(weights, np.ones(8), decimals=5)
+
+        # Overwriting an evicted slot adds a live transition (and evicts the previous one).
+        stacks = np.random.randint(0, 255, size=(2, 6, 6, 4)).astype(np.uint8)
+        memory.insert_batch(dict(
+            states=stacks[:1], actions=np.zeros(1), rewards=np.ones(1), terminals=np.zeros(1, dtype=bool),
+            next_states=stacks[1:], importance_weights=np.ones(1)
+        ))
+        self.assertEqual((memory.size, memory.num_live_records()), (3, 1))
+
+    def test_apex_memory_checkpoint(self):
+        """
+        Tests full and incremental checkpoints of columnar, tuple and frame-deduplicating Apex memories.
+        """
+        path = tempfile.mkdtemp()
+        try:
+            for columnar in [True, False]:
+                memory_path = os.path.join(path, "columnar" if columnar else "tuples")
+                memory = ApexMemory(capacity=self.capacity, alpha=self.alpha, beta=self.beta, columnar=columnar)
+                # The memory fills up and wraps around in between incremental snapshots.
+                for batch_size, incremental in [(6, False), (3, True), (2, True)]:
+                    observation = self.apex_space.sample(size=batch_size)
+                    memory.insert_batch(dict(
+                        states=observation["states"],
+                        actions=observation["actions"],
+                        rewards=observation["reward"],
+                        terminals=observation["terminals"],
+                        next_states=observation["states"],
+                        importance_weights=observation["weights"]
+                    ))
+                    memory.update_records(np.asarray([0]), np.asarray([5.0]))
+                    memory.store_memory(memory_path, incremental=incremental, chunk_size=4)
+
+                restored = ApexMemory(capacity=self.capacity, alpha=self.alpha, beta=self.beta, columnar=columnar)
+                restored.load_memory(memory_path)
+                self.assertEqual((restored.index, restored.size, restored.max_priority),
+                                 (memory.index, memory.size, memory.max_priority))
+                self.assertTrue(np.array_equal(restored.merged_segment_tree.sum_segment_tree.values,
+                                               memory.merged_segment_tree.sum_segment_tree.values))
+                indices = np.arange(memory.size)
+                batch = memory.read_records(indices)
+                restored_batch = restored.read_records(indices)
+                for key in batch:
+                    self.assertTrue(np.array_equal(batch[key], restored_batch[key]))
+
+            frames = np.random.randint(0, 255, size=(12, 6, 6)).astype(np.uint8)
+            stacks = np.stack([np.moveaxis(frames[i:i + 4], 0, -1) for i in range(9)])
+            frame_memory = ApexFrameMemory(capacity=self.capacity)
+            frame_memory.insert_batch(dict(
+                states=stacks[:8],
+                actions=np.zeros(8),
+                rewards=np.ones(8),
+                terminals=np.zeros(8, dtype=bool),
+                next_states=stacks[1:9],
+                importance_weights=np.ones(8)
+            ))
+            frame_path = os.path.join(path, "frames")
+            frame_memory.store_memory(frame_path)
+            restored = ApexFrameMemory(capacity=self.capacity)
+            restored.load_memory(frame_path)
+            self.assertTrue(np.array_equal(restored.read_records(np.arange(8))["next_states"], stacks[1:9]))
+        finally:
+            shutil.rmtree(path)
+
+    def test_memmap_apex_memory(self):
+        """
+        Tests that file-backed storage with a partial chunk cache matches in-memory columnar storage.
+        """
+        memory = MemmapApexMemory(capacity=self.capacity, alpha=self.alpha, beta=self.beta, chunk_size=3,
+                                  cache_chunks=1)
+        in_memory = ApexMemory(capacity=self.capacity, alpha=self.alpha, beta=self.beta, columnar=True)
+        try:
+            for batch_size in [4, 7, 12]:
+                observation = self.apex_space.sample(size=batch_size)
+                records = dict(
+                    states=observation["states"],
+                    actions=observation["actions"],
+                    rewards=observation["reward"],
+                    terminals=observation["terminals"],
+                    next_states=observation["states"],
+                    importance_weights=observation["weights"]
+                )
+                memory.insert_batch(records)
+                in_memory.insert_batch(records)
+                self.assertEqual(len(memory.chunk_cache), 1)
+
+                indices = np.random.randint(0, memory.size, size=16)
+                memmap_batch = memory.read_records(indices)
+                batch = in_memory.read_records(indices)
+                for key in batch:
+                    self.assertTrue(np.allclose(memmap_batch[key], batch[key]))
+        finally:
+            memory.close()
+
+    def test_memmap_apex_memory_single_inserts(self):
+        """
+        Tests single-record inserts: Cached chunks are updated in place instead of being reloaded from disk.
+        """
+        memory = MemmapApexMemory(capacity=self.capacity, alpha=self.alpha, beta=self.beta, chunk_size=4,
+                                  cache_chunks=2)
+        in_memory = ApexMemory(capacity=self.capacity, alpha=self.alpha, beta=self.beta, columnar=True)
+        try:
+            observation = self.apex_space.sample(size=2 * self.capacity + 3)
+            for i in range_(2 * self.capacity + 3):
+                records = dict(
+                    states=observation["states"][i:i + 1],
+                    actions=observation["actions"][i:i + 1],
+                    rewards=observation["reward"][i:i + 1],
+                    terminals=observation["terminals"][i:i + 1],
+                    next_states=observation["states"][i:i + 1],
+                    importance_weights=observation["weights"][i:i + 1]
+                )
+                memory.insert_batch(records)
+                in_memory.insert_batch(records)
+                indices = np.arange(memory.size)
+                memmap_batch = memory.read_records(indices)
+                batch = in_memory.read_records(indices)
+                for key in batch:
+                    self.assertTrue(np.allclose(memmap_batch[key], batch[key]))
+            # The most recently written chunk holds slots 0 - 3, written up to slot 2.
+            self.assertEqual(list(memory.chunk_cache.keys()), [2, 0])
+
+            # Changing slot 1 on disk behind the cache is not picked up by the next insert (into slot 3).
+            memory.columns["rewards"][1] = -1.0
+            memory.insert_batch(dict(
+                states=observation["states"][:1],
+                actions=observation["actions"][:1],
+                rewards=observation["reward"][:1],
+                terminals=observation["terminals"][:1],
+                next_states=observation["states"][:1],
+                importance_weights=observation["weights"][:1]
+            ))
+            self.assertNotEqual(memory.read_records(np.asarray([1]))["rewards"][0], -1.0)
+        finally:
+            memory.close()
+
+    def test_shared_apex_memory(self):
+        """
+        Tests that an attached shared memory sees inserts and priority updates of the owner.
+        """
+        memory = SharedApexMemory(capacity=self.capacity, alpha=self.alpha, beta=self.beta, state_shape=(4,),
+                                  action_shape=(2,), action_dtype="float32")
+        reader = SharedApexMemory.attach(memory.handle(), max_batch_size=4)
+        try:
+            observation = self.apex_space.sample(size=12)
+            memory.insert_batch(dict(
+                states=observation["states"],
+                actions=observation["actions"],
+                rewards=observation["reward"],
+                terminals=observation["terminals"],
+                next_states=observation["states"],
+                importance_weights=observation["weights"]
+            ))
+            self.assertEqual(reader.size, self.capacity)
+            self.assertEqual(reader.index, 2)
+            self.assertEqual(reader.num_inserted, 12)
+
+            batch, indices, weights = reader.get_records(4)
+            self.assertEqual(len(weights), 4)
+            # Rows 0, 1 were overwritten by the last two records.
+            expected = observation["states"][np.where(indices < 2, indices + 10, indices)]
+            self.assertTrue(np.allclose(batch["states"], expected))
+
+            reader.update_records(np.arange(self.capacity), np.full(self.capacity, 2.0))
+            self.assertTrue(np.isclose(memory.merged_segment_tree.sum_segment_tree.get_sum(), 2.0 * self.capacity))
+            self.assertEqual(memory.max_priority, 2.0)
+        finally:
+            reader.close()
+            memory.close()
+
+    def test_shared_memory_actor_close(self):
+        """
+        Tests that closing a replay actor frees the shared memory blocks it owns.
+        """
+        memory_actor = RayMemoryActor(dict(
+            memory_spec=dict(type="shared_apex_memory", capacity=self.capacity, state_shape=(4,), action_shape=(2,),
+                             action_dtype="float32"),
+            min_sample_memory_size=1,
+            sample_batch_size=4
+        ))
+        handle = memory_actor.memory.handle()
+        observation = self.apex_space.sample(size=3)
+        memory_actor.observe(EnvironmentSample(sample_batch=dict(
+            states=observation["states"],
+            actions=observation["actions"],
+            rewards=observation["reward"],
+            terminals=observation["terminals"],
+            next_states=observation["states"],
+            importance_weights=observation["weights"]
+        ), batch_size=3))
+        reader = SharedApexMemory.attach(handle)
+        self.assertEqual(reader.num_inserted, 3)
+        reader.close()
+
+        memory_actor.close()
+        self.assertRaises(FileNotFoundError, SharedApexMemory.attach, handle)
@@ -19,10 +19,13 @@ from __future__ import print_function
 
 import unittest
 
+import numpy as np
+
+from rlgraph import get_backend
 from rlgraph.components.memories.replay_memory import ReplayMemory
 from rlgraph.spaces import Dict, BoolBox
 from rlgraph.tests import ComponentTest
-from rlgraph.tests.test_util import non_terminal_records, terminal_records
+from rlgraph.tests.test_util import non_terminal_records, terminal_records, recursive_assert_almost_equal
 
 
 class TestReplayMemory(unittest.TestCase):
@@ -123,3 +126,38 @@ class TestReplayMemory(unittest.TestCase):
         num_records = self.capacity
         batch, _, _ = test.test(("get_records", num_records), expected_outputs=None)
         self.assertEqual(self.capacity, len(batch['terminals']))
+
+    @unittest.skipIf(get_backend() != "pytorch", "Tests the preallocated PyTorch record buffers.")
+    def test_pytorch_preallocated_records(self):
+        """
+        Tests slice inserts into the preallocated record tensors, including wrap-around, and indexed reads.
+        """
+        memory = ReplayMemory(capacity=self.capacity)
+        test = ComponentTest(component=memory, input_spaces=self.input_spaces)
+        rewards = memory.record_registry["reward"]
+        self.assertEqual(tuple(rewards.shape), (self.capacity,))
+
+        # Overwrite records inserted while building, this wraps around once.
+        start = memory.index
+        observation = non_terminal_records(self.record_space, self.capacity)
+        test.test(("insert_records", observation), expected_outputs=None)
+        self.assertEqual(memory.size, self.capacity)
+        self.assertEqual(memory.index, start)
+        positions = (start + np.arange(self.capacity)) % self.capacity
+        recursive_assert_almost_equal(rewards.numpy()[positions], observation["reward"], decimals=5)
+
+        # Inserts wrapping around at capacity write two slices into the same tensors.
+        observation = non_terminal_records(self.record_space, self.capacity - 2)
+        test.test(("insert_records", observation), expected_outputs=None)
+        self.assertIs(memory.record_registry["reward"], rewards)
+        positions = (start + np.arange(self.capacity - 2)) % self.capacity
+        recursive_assert_almost_equal(rewards.numpy()[positions], observation["reward"], decimals=5)
+        state1 = memory.record_registry["states/state1"].numpy()
+        recursive_assert_almost_equal(state1[positions], observation["states"]["state1"], decimals=5)
+
+        # Sampled records are read at the returned indices.
+        batch, indices, weights = test.test(("get_records", 6), expected_outputs=None)
+        self.assertEqual(len(batch["terminals"]), 6)
+        recursive_assert_almost_equal(batch["reward"], rewards.numpy()[indices], decimals=5)
+        recursive_assert_almost_equal(batch["next_states"]["state2"],
+                                      memory.record_registry["next_states/state2"].numpy()[indices], decimals=5)
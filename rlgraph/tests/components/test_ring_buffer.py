@@ -21,6 +21,7 @@ import unittest
 import numpy as np
 from six.moves import xrange as range_
 
+from rlgraph import get_backend
 from rlgraph.components.memories.ring_buffer import RingBuffer
 from rlgraph.spaces import Dict, BoolBox
 from rlgraph.tests import ComponentTest
@@ -253,3 +254,73 @@ class TestRingBufferMemory(unittest.TestCase):
         retrieved_action = batch['actions']['action1']
         for action_value in observation['actions']['action1']:
             self.assertTrue(action_value in retrieved_action)
+
+    @unittest.skipIf(get_backend() != "pytorch", "Tests the preallocated PyTorch record buffers.")
+    def test_pytorch_latest_records_wrap_around(self):
+        """
+        Tests that the most recent records are read in insertion order across the end of the record tensors.
+        """
+        ring_buffer = RingBuffer(capacity=self.capacity)
+        test = ComponentTest(component=ring_buffer, input_spaces=self.input_spaces)
+        # Overwrite records inserted while building.
+        test.test(("insert_records", non_terminal_records(self.record_space, self.capacity)), expected_outputs=None)
+
+        for num_records in [3, 6, 9]:
+            observation = non_terminal_records(self.record_space, num_records)
+            test.test(("insert_records", observation), expected_outputs=None)
+            self.assertEqual(ring_buffer.size, self.capacity)
+            self.assertEqual(len(ring_buffer.record_registry["rewards"]), self.capacity)
+
+            batch = test.test(("get_records", num_records), expected_outputs=None)
+            recursive_assert_almost_equal(batch["rewards"], observation["rewards"], decimals=5)
+            recursive_assert_almost_equal(batch["states"]["state1"], observation["states"]["state1"], decimals=5)
+
+        # More than capacity: Only the last `capacity` records are kept.
+        observation = non_terminal_records(self.record_space, self.capacity + 3)
+        test.test(("insert_records", observation), expected_outputs=None)
+        batch = test.test(("get_records", self.capacity), expected_outputs=None)
+        recursive_assert_almost_equal(batch["rewards"], observation["rewards"][3:], decimals=5)
+
+    @unittest.skipIf(get_backend() != "pytorch", "Tests the PyTorch episode index.")
+    def test_pytorch_episode_index(self):
+        """
+        Tests the circular episode-end deque: Episode ends are popped when overwritten and episodes are read
+        from the deque across wrap-around of both records and the deque.
+        """
+        ring_buffer = RingBuffer(capacity=self.capacity)
+        test = ComponentTest(component=ring_buffer, input_spaces=self.input_spaces)
+        test.test(("insert_records", non_terminal_records(self.record_space, self.capacity)), expected_outputs=None)
+        self.assertEqual(ring_buffer.num_episodes, 0)
+
+        # Three episodes of lengths 3, 4 and 2.
+        episodes = []
+        for length in [3, 4, 2]:
+            observation = non_terminal_records(self.record_space, length)
+            observation["terminals"][-1] = True
+            test.test(("insert_records", observation), expected_outputs=None)
+            episodes.append(observation)
+        self.assertEqual(ring_buffer.num_episodes, 3)
+
+        batch = test.test(("get_episodes", 2), expected_outputs=None)
+        expected_rewards = np.concatenate([episodes[1]["rewards"], episodes[2]["rewards"]])
+        recursive_assert_almost_equal(batch["rewards"], expected_rewards, decimals=5)
+
+        # Overwrites the end of the first episode and the start of the second.
+        test.test(("insert_records", non_terminal_records(self.record_space, 6)), expected_outputs=None)
+        self.assertEqual(ring_buffer.num_episodes, 2)
+        batch = test.test(("get_episodes", 1), expected_outputs=None)
+        recursive_assert_almost_equal(batch["rewards"], episodes[2]["rewards"], decimals=5)
+        # All stored episodes start at the oldest stored record.
+        batch = test.test(("get_episodes", 2), expected_outputs=None)
+        recursive_assert_almost_equal(batch["rewards"], np.concatenate([
+            episodes[1]["rewards"][2:], episodes[2]["rewards"]
+        ]), decimals=5)
+
+        # Single-step episodes fill the deque and wrap around its end.
+        for _ in range_(3):
+            observation = terminal_records(self.record_space, 4)
+            test.test(("insert_records", observation), expected_outputs=None)
+        self.assertEqual(ring_buffer.num_episodes, self.capacity)
+        batch = test.test(("get_episodes", 3), expected_outputs=None)
+        recursive_assert_almost_equal(batch["rewards"], observation["rewards"][1:], decimals=5)
+        self.assertTrue(np.all(batch["terminals"]))
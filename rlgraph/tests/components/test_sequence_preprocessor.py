@@ -100,6 +100,75 @@ class TestSequencePreprocessor(unittest.TestCase):
                 out, np.asarray([[[1.1, 1.11, 10]], [[2.2, 2.22, 20]], [[3.3, 3.33, 30]], [[4.4, 4.44, 40]]])
             )
 
+    def test_python_sequence_preprocessor_per_env(self):
+        space = FloatBox(shape=(1,), add_batch_rank=True)
+        sequencer = Sequence(sequence_length=3, batch_size=3, add_rank=True, backend="python")
+        sequencer.create_variables(input_spaces=dict(preprocessing_inputs=space))
+
+        sequencer._graph_fn_reset()
+        sequencer._graph_fn_apply(np.asarray([[1.0], [2.0], [3.0]]))
+        out = sequencer._graph_fn_apply(np.asarray([[1.1], [2.2], [3.3]]))
+        recursive_assert_almost_equal(
+            out, np.asarray([[[1.0, 1.0, 1.1]], [[2.0, 2.0, 2.2]], [[3.0, 3.0, 3.3]]])
+        )
+
+        # Env 1 terminated: Its sequence gets refilled with its next input, the others are shifted.
+        sequencer.reset_envs([1])
+        out = sequencer.apply_envs(np.asarray([[20.0], [30.0]]), [1, 2])
+        recursive_assert_almost_equal(out, np.asarray([[[20.0, 20.0, 20.0]], [[3.0, 3.3, 30.0]]]))
+
+        # Env 0 was not advanced, a full batch advances all envs.
+        out = sequencer._graph_fn_apply(np.asarray([[1.11], [22.0], [33.0]]))
+        recursive_assert_almost_equal(
+            out, np.asarray([[[1.0, 1.1, 1.11]], [[20.0, 20.0, 22.0]], [[3.3, 30.0, 33.0]]])
+        )
+
+        # Resets pending at the next full batch refill that row.
+        sequencer.reset_envs([0])
+        out = sequencer._graph_fn_apply(np.asarray([[5.0], [23.0], [34.0]]))
+        recursive_assert_almost_equal(
+            out, np.asarray([[[5.0, 5.0, 5.0]], [[20.0, 22.0, 23.0]], [[30.0, 33.0, 34.0]]])
+        )
+
+    def test_python_sequence_preprocessor_ring_buffer(self):
+        space = IntBox(256, shape=(2, 2), dtype="uint8", add_batch_rank=True)
+        sequencer = Sequence(sequence_length=3, batch_size=2, add_rank=True, return_view=True, backend="python")
+        sequencer.create_variables(input_spaces=dict(preprocessing_inputs=space))
+
+        sequencer._graph_fn_reset()
+        frames = [np.full((2, 2, 2), i, dtype=np.uint8) for i in range_(5)]
+        for frame in frames[:4]:
+            out = sequencer._graph_fn_apply(frame)
+        # A view into the preallocated buffer, inputs are not converted.
+        self.assertTrue(np.shares_memory(out, sequencer.ring_buffer))
+        self.assertEqual(out.dtype, np.uint8)
+        self.assertEqual(out.shape, (2, 2, 2, 3))
+        recursive_assert_almost_equal(out[0, 0, 0], [1, 2, 3])
+
+        # Rows advanced separately are out of step, outputs are copies gathered per row.
+        out = sequencer.apply_envs(frames[4][:1], [0])
+        recursive_assert_almost_equal(out[0, 0, 0], [2, 3, 4])
+        out = sequencer._graph_fn_apply(frames[0])
+        self.assertFalse(np.shares_memory(out, sequencer.ring_buffer))
+        recursive_assert_almost_equal(out[:, 0, 0], [[3, 4, 0], [2, 3, 0]])
+
+    def test_python_sequence_preprocessor_copies(self):
+        space = FloatBox(shape=(2, 2), add_batch_rank=True)
+        frames = [np.random.random(size=(2, 2, 2)) for _ in range_(4)]
+        for add_rank in [True, False]:
+            sequencer = Sequence(sequence_length=3, batch_size=2, add_rank=add_rank, backend="python")
+            sequencer.create_variables(input_spaces=dict(preprocessing_inputs=space))
+            sequencer._graph_fn_reset()
+            for frame in frames:
+                out = sequencer._graph_fn_apply(frame)
+            # Copies are contiguous and independent of the buffer.
+            self.assertFalse(np.shares_memory(out, sequencer.ring_buffer))
+            self.assertTrue(out.flags["C_CONTIGUOUS"])
+            if add_rank:
+                recursive_assert_almost_equal(out, np.stack(frames[1:], axis=-1))
+            else:
+                recursive_assert_almost_equal(out, np.concatenate(frames[1:], axis=-1))
+
     def test_sequence_preprocessor_with_batch(self):
         space = FloatBox(shape=(2,), add_batch_rank=True)
         sequencer = Sequence(sequence_length=2, batch_size=3, add_rank=True)
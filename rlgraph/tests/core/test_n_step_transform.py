@@ -0,0 +1,127 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import unittest
+
+import numpy as np
+
+from rlgraph.agents import Agent
+from rlgraph.environments import GridWorld
+from rlgraph.tests.test_util import config_from_path
+from rlgraph.utils.numpy import n_step_transform
+
+
+def n_step_reference(rewards, next_states, terminals, n_step, discount, was_terminal):
+    """
+    Loop-based n-step truncation of a single segment.
+    """
+    rewards, next_states, terminals = list(rewards), list(next_states), list(terminals)
+    terminal_position = len(rewards) - 1
+    if was_terminal:
+        for i in range(len(rewards)):
+            for j in range(1, n_step):
+                if i + j >= len(next_states):
+                    break
+                if i + j < terminal_position:
+                    next_states[i] = next_states[i + j]
+                    rewards[i] += discount ** j * rewards[i + j]
+                else:
+                    next_states[i] = next_states[terminal_position]
+                    terminals[i] = True
+                    if i + j <= terminal_position:
+                        rewards[i] += discount ** j * rewards[i + j]
+        return rewards, next_states, terminals
+    for i in range(len(rewards) - n_step + 1):
+        for j in range(1, n_step):
+            next_states[i] = next_states[i + j]
+            rewards[i] += discount ** j * rewards[i + j]
+    new_len = max(len(rewards) - n_step + 1, 0)
+    return rewards[:new_len], next_states[:new_len], terminals[:new_len]
+
+
+class TestNStepTransform(unittest.TestCase):
+    """
+    Tests the vectorized n-step transform against a loop-based implementation and its use in `Agent.observe`.
+    """
+    def test_against_reference(self):
+        np.random.seed(10)
+        for n_step in [1, 2, 3, 5]:
+            segment_lengths = [7, 1, 4, 12, 2]
+            segment_terminals = [True, False, False, True, True]
+            rewards = np.random.random(size=sum(segment_lengths))
+            terminals = np.zeros(shape=(len(rewards),), dtype=bool)
+            terminals[np.cumsum(segment_lengths)[np.asarray(segment_terminals)] - 1] = True
+            next_states = np.arange(len(rewards)) + 100
+
+            n_step_rewards, n_step_terminals, next_state_indices, keep = n_step_transform(
+                rewards, terminals, segment_lengths, n_step, 0.9, segment_terminals
+            )
+
+            expected_rewards, expected_next_states, expected_terminals = [], [], []
+            start = 0
+            for length, was_terminal in zip(segment_lengths, segment_terminals):
+                r, s, t = n_step_reference(rewards[start:start + length], next_states[start:start + length],
+                                           terminals[start:start + length], n_step, 0.9, was_terminal)
+                expected_rewards.extend(r)
+                expected_next_states.extend(s)
+                expected_terminals.extend(t)
+                start += length
+
+            np.testing.assert_allclose(n_step_rewards[keep], expected_rewards)
+            np.testing.assert_array_equal(next_states[next_state_indices[keep]], expected_next_states)
+            np.testing.assert_array_equal(n_step_terminals[keep], expected_terminals)
+
+    def test_agent_observe(self):
+        env = GridWorld(world="2x2")
+        agent_config = config_from_path("configs/dqn_agent_for_functionality_test.json")
+        agent_config["observe_spec"] = dict(buffer_size=6, n_step=2)
+        agent_config["optimizer_spec"] = dict(type="adam", learning_rate=0.01)
+        agent = Agent.from_spec(agent_config, state_space=env.state_space, action_space=env.action_space)
+
+        # Record every flush into the graph.
+        flushes = []
+        observe_graph = agent._observe_graph
+
+        def record_flush(**kwargs):
+            flushes.append(kwargs)
+            observe_graph(**kwargs)
+        agent._observe_graph = record_flush
+
+        # 13 records, the last one terminal. States encode their record index.
+        num_records = 13
+        rewards = np.arange(1, num_records + 1, dtype=np.float32)
+        terminals = [False] * (num_records - 1) + [True]
+        for i in range(num_records):
+            agent.observe(np.full(4, i), i % 2, [], rewards[i], np.full(4, i + 1), terminals[i])
+
+        # Full buffers insert the records with a complete 2-step lookahead and keep the last one, the episode end
+        # flushes all remaining records.
+        self.assertEqual([len(flush["rewards"]) for flush in flushes], [5, 5, 3])
+        self.assertEqual(len(agent.rewards_buffer[agent.default_env]), 0)
+        states = np.concatenate([flush["preprocessed_states"][:, 0] for flush in flushes])
+        next_states = np.concatenate([flush["next_states"][:, 0] for flush in flushes])
+        n_step_rewards = np.concatenate([flush["rewards"] for flush in flushes])
+        n_step_terminals = np.concatenate([flush["terminals"] for flush in flushes])
+
+        np.testing.assert_array_equal(states, np.arange(num_records))
+        np.testing.assert_array_equal(next_states, np.minimum(np.arange(num_records) + 2, num_records))
+        np.testing.assert_allclose(n_step_rewards, rewards + agent.discount * np.append(rewards[1:], 0.0),
+                                   rtol=1e-6)
+        # Records whose lookahead reaches the episode end become terminal.
+        np.testing.assert_array_equal(n_step_terminals, [False] * (num_records - 2) + [True] * 2)
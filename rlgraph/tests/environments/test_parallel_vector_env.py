@@ -0,0 +1,112 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import unittest
+
+import numpy as np
+
+from rlgraph.environments import Environment, ParallelVectorEnv, SequentialVectorEnv
+from rlgraph.tests.test_util import recursive_assert_almost_equal
+
+
+class TestParallelVectorEnv(unittest.TestCase):
+    """
+    Tests stepping environments in worker processes against a SequentialVectorEnv.
+    """
+    env_spec = dict(type="deterministic", state_start=0.0, reward_start=-10.0, steps_to_terminal=3)
+
+    def test_parallel_vector_env(self):
+        # 5 envs in 2 processes (groups of 3 and 2).
+        parallel_env = Environment.from_spec(dict(type="parallel_vector", num_processes=2),
+                                             num_envs=5, env_spec=self.env_spec)
+        sequential_env = SequentialVectorEnv(num_envs=5, env_spec=self.env_spec)
+        try:
+            self.assertIsInstance(parallel_env, ParallelVectorEnv)
+            self.assertEqual(parallel_env.state_space, sequential_env.state_space)
+
+            states = parallel_env.reset_all()
+            recursive_assert_almost_equal(states, np.reshape(sequential_env.reset_all(), (5,)))
+
+            actions = [1, 0, 1, 0, 1]
+            previous_states = None
+            for _ in range(3):
+                parallel_step = parallel_env.step(actions)
+                sequential_step = sequential_env.step(actions)
+                # States arrive as one batch in the shared buffer.
+                self.assertIsInstance(parallel_step[0], np.ndarray)
+                self.assertEqual(parallel_step[0].shape, (5,))
+                recursive_assert_almost_equal(parallel_step[0], np.reshape(sequential_step[0], (5,)))
+                for parallel_values, sequential_values in zip(parallel_step[1:3], sequential_step[1:3]):
+                    self.assertEqual(parallel_values, sequential_values)
+                # Double-buffering: States of the previous step are not overwritten.
+                if previous_states is not None:
+                    recursive_assert_almost_equal(previous_states, parallel_step[0] - 1.0)
+                previous_states = parallel_step[0]
+            self.assertTrue(all(parallel_step[2]))
+
+            # Resetting a single env (index 3 lives in the second process).
+            recursive_assert_almost_equal(parallel_env.reset(3), [0.0])
+            # The reset-all copy is not overwritten by steps.
+            recursive_assert_almost_equal(states, np.zeros(5))
+        finally:
+            parallel_env.terminate()
+
+    def test_async_send_recv(self):
+        for vector_env_spec in [dict(type="parallel_vector", num_processes=4), dict(type="sequential_vector")]:
+            env = Environment.from_spec(vector_env_spec, num_envs=4, env_spec=self.env_spec)
+            try:
+                env.reset_all()
+
+                # Step a subset of the envs, results come back with their env indices.
+                env.send([1, 0], env_ids=[0, 2])
+                env_ids, states, rewards, terminals, _ = env.recv(min_ready=2)
+                self.assertEqual(sorted(env_ids), [0, 2])
+                recursive_assert_almost_equal(np.reshape(states, (2,)), [1.0, 1.0])
+                self.assertEqual(rewards, [-10.0, -10.0])
+                self.assertEqual(terminals, [False, False])
+
+                # Nothing in flight.
+                env_ids, states, _, _, _ = env.recv(min_ready=1, timeout=0.1)
+                self.assertEqual(len(env_ids), 0)
+
+                env.send_reset([2])
+                env.send([0, 0, 0], env_ids=[0, 1, 3])
+                env_ids = []
+                while len(env_ids) < 4:
+                    env_ids.extend(env.recv(min_ready=1)[0])
+                self.assertEqual(sorted(env_ids), [0, 1, 2, 3])
+            finally:
+                env.terminate()
+
+    def test_unterminated_env(self):
+        from multiprocessing import shared_memory
+
+        env = ParallelVectorEnv(num_envs=2, env_spec=self.env_spec)
+        block_name = env.block.name
+        env.reset_all()
+        # Workers exit cleanly once the parent's pipes are gone.
+        for pipe in env.pipes:
+            pipe.close()
+        for process in env.processes:
+            process.join(timeout=10)
+            self.assertEqual(process.exitcode, 0)
+        # The shared state buffers are freed without `terminate` (here on garbage collection, else at exit).
+        del env
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=block_name)
@@ -0,0 +1,91 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+import unittest
+
+from rlgraph.execution.ray.adaptive_sample_controller import AdaptiveSampleController
+
+
+class TestAdaptiveSampleController(unittest.TestCase):
+    """
+    Tests online adaptation of sample sizes, task depths and worker counts.
+    """
+    @staticmethod
+    def end_interval(controller, seconds):
+        # Pretend the current interval started `seconds` ago.
+        controller.interval_start = time.monotonic() - seconds
+
+    def test_sample_sizes_and_task_depths(self):
+        controller = AdaptiveSampleController(task_depth=1, target_task_seconds=0.5, min_sample_size=10,
+                                              max_sample_size=400, max_task_depth=2, adapt_interval=1.0)
+        controller.add_worker("fast")
+        controller.add_worker("slow")
+        self.assertIsNone(controller.sample_size("fast"))
+        self.assertFalse(controller.should_adapt())
+
+        # The fast worker delivers 1000 records in 1 second at 1000 ops/s, the slow worker idles half the time.
+        controller.record_sample("fast", 1000, 1000.0)
+        controller.record_sample("slow", 5, 10.0)
+        self.end_interval(controller, 1.0)
+        self.assertTrue(controller.should_adapt())
+        self.assertEqual(controller.adapt(), 0)
+
+        self.assertEqual(controller.sample_size("fast"), 400)
+        self.assertEqual(controller.sample_size("slow"), 10)
+        self.assertEqual(controller.task_depth("fast"), 1)
+        self.assertEqual(controller.task_depth("slow"), 2)
+
+        # Depths are bounded.
+        controller.record_sample("slow", 5, 10.0)
+        self.end_interval(controller, 1.0)
+        controller.adapt()
+        self.assertEqual(controller.task_depth("slow"), 2)
+        self.assertEqual(controller.retirement_candidates(1), ["slow"])
+
+    def test_worker_scaling(self):
+        controller = AdaptiveSampleController(target_samples_per_update=1.0, tolerance=0.2, min_workers=1,
+                                              max_workers=2)
+        controller.add_worker("worker_0")
+
+        # Too few samples per update: Add a worker.
+        controller.record_sample("worker_0", 50, 100.0)
+        controller.record_updates(100)
+        self.assertEqual(controller.adapt(), 1)
+        self.assertEqual(controller.get_statistics()["samples_per_update"], 0.5)
+
+        controller.add_worker("worker_1")
+        controller.record_sample("worker_0", 100, 100.0)
+        controller.record_updates(100)
+        self.assertEqual(controller.adapt(), 0)
+        # The max. number of workers is reached.
+        controller.record_updates(1000)
+        self.assertEqual(controller.adapt(), 0)
+
+        # Too many samples per update: Retire one.
+        controller.record_sample("worker_1", 300, 100.0)
+        controller.record_updates(100)
+        self.assertEqual(controller.adapt(), -1)
+        controller.remove_worker("worker_1")
+        controller.record_sample("worker_0", 300, 100.0)
+        controller.record_updates(100)
+        self.assertEqual(controller.adapt(), 0)
+
+        # No updates, no scaling.
+        self.assertEqual(controller.adapt(), 0)
@@ -23,9 +23,13 @@ from copy import deepcopy
 import numpy as np
 
 from rlgraph import get_backend
+from rlgraph.agents import Agent
 from rlgraph.components import PreprocessorStack
 from rlgraph.environments import OpenAIGymEnv
 from rlgraph.execution.ray.apex import ApexExecutor
+from rlgraph.execution.ray.apex.apex_executor import UpdateWorker
+from rlgraph.execution.ray.ray_util import StateCodec
+from rlgraph.spaces import FloatBox, IntBox
 from rlgraph.tests.test_util import config_from_path, recursive_assert_almost_equal
 
 
@@ -34,6 +38,47 @@ class TestApexExecutor(unittest.TestCase):
     Tests the ApexExecutor which provides an interface for distributing Apex-style workloads
     via Ray.
     """
+    def test_update_worker(self):
+        """
+        Tests preparing sampled batches with compressed states on feeder threads and updating on them, without
+        a Ray cluster.
+        """
+        agent_config = config_from_path("configs/apex_agent_cartpole.json")
+        agent_config["execution_spec"].pop("ray_spec")
+        agent = Agent.from_spec(agent_config, state_space=FloatBox(shape=(4,)), action_space=IntBox(2))
+
+        batch_size = 8
+        states = np.random.random(size=(batch_size + 1, 4))
+        codec = StateCodec("none")
+        sample_batch = dict(
+            states=codec.compress_batch(states[:-1], dtype=np.float64),
+            actions=list(np.random.randint(0, 2, size=batch_size)),
+            rewards=list(np.ones(batch_size)),
+            terminals=list(np.zeros(batch_size, dtype=bool)),
+            next_states=codec.compress_batch(states[1:], dtype=np.float64),
+            importance_weights=np.ones(batch_size),
+            indices=np.arange(batch_size)
+        )
+
+        update_worker = UpdateWorker(agent, in_queue_size=2, num_feeder_threads=2, prefetch_depth=1)
+        batch = update_worker.prepare_batch(sample_batch)
+        self.assertEqual(batch["states"].dtype, np.float32)
+        recursive_assert_almost_equal(batch["next_states"], states[1:], decimals=5)
+        for key, value in batch.items():
+            self.assertTrue(value.flags["C_CONTIGUOUS"])
+            self.assertEqual(len(value), batch_size)
+
+        update_worker.start()
+        for i in range(3):
+            update_worker.input_queue.put(("memory-{}".format(i), sample_batch))
+        updates = [update_worker.output_queue.get(timeout=60) for _ in range(3)]
+        # Feeder threads may reorder batches.
+        self.assertEqual(sorted(memory for memory, _, _ in updates), ["memory-0", "memory-1", "memory-2"])
+        for _, indices, loss_per_item in updates:
+            recursive_assert_almost_equal(indices, np.arange(batch_size))
+            self.assertEqual(len(loss_per_item), batch_size)
+        self.assertTrue(update_worker.update_done)
+
     def test_learning_2x2_grid_world(self):
         """
         Tests if apex can learn a simple environment using a single worker, thus replicating
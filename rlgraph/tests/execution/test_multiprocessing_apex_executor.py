@@ -0,0 +1,140 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import threading
+import unittest
+
+import numpy as np
+from six.moves import queue
+
+from rlgraph.execution.environment_sample import EnvironmentSample
+from rlgraph.execution.ray.apex import MultiprocessingApexExecutor, SharedApexMemory, SharedMemoryShardedReplay
+from rlgraph.execution.ray.apex.multiprocessing_apex_executor import _run_replay_memory
+from rlgraph.tests.test_util import config_from_path
+
+
+class TestMultiprocessingApexExecutor(unittest.TestCase):
+    """
+    Tests the Ray-free Ape-X executor running workers and replay shards in local processes.
+    """
+    def test_shared_memory_sharded_replay(self):
+        memory_spec = dict(type="shared_apex_memory", capacity=20, alpha=1.0, beta=1.0, state_shape=(2,),
+                           state_dtype="float32", action_shape=(), action_dtype="int64")
+        memories = [SharedApexMemory(max_batch_size=4, **{
+            key: value for key, value in memory_spec.items() if key != "type"
+        }) for _ in range(2)]
+        sample_queues = [queue.Queue() for _ in range(2)]
+        # Run the replay loops in threads, they attach to the shards the same way as from another process.
+        threads = []
+        for memory, sample_queue in zip(memories, sample_queues):
+            replay_spec = dict(memory_spec=dict(memory_spec, _attach_handle=memory.handle()),
+                               min_sample_memory_size=1, sample_batch_size=4, clip_rewards=True)
+            thread = threading.Thread(target=_run_replay_memory, args=(replay_spec, sample_queue))
+            thread.start()
+            threads.append(thread)
+
+        replay = SharedMemoryShardedReplay(memories, sample_queues, min_sample_memory_size=3, min_size_to_sample=6)
+        self.assertIsNone(replay.sample_shard(0, 4))
+        for i in range(4):
+            replay.insert(EnvironmentSample(sample_batch=dict(
+                states=np.full(shape=(3, 2), fill_value=i, dtype=np.float32),
+                actions=np.zeros(shape=(3,), dtype=np.int64),
+                rewards=np.full(shape=(3,), fill_value=3.0),
+                terminals=np.zeros(shape=(3,), dtype=bool),
+                next_states=np.ones(shape=(3, 2), dtype=np.float32),
+                importance_weights=np.ones(shape=(3,))
+            ), batch_size=3))
+        for sample_queue in sample_queues:
+            sample_queue.put(None)
+        for thread in threads:
+            thread.join()
+        self.assertEqual([memory.size for memory in memories], [6, 6])
+
+        batch = replay.sample_shard(0, 4)
+        # Round robin: Samples 0 and 2 went to shard 0, rewards are clipped.
+        self.assertTrue(np.all(np.isin(batch["states"], [0, 2])))
+        self.assertTrue(np.all(batch["rewards"] == 1.0))
+        self.assertEqual(len(batch["indices"]), 4)
+        # Batches are copied out of the reused sample buffers.
+        self.assertFalse(np.shares_memory(batch["states"], replay.sample_shard(0, 4)["states"]))
+
+        merged_batch = replay.sample_from_all_shards(batch_size=6)
+        replay.update_priorities(merged_batch["shard_ids"], merged_batch["indices"], np.full(6, 0.5))
+        for memory in memories:
+            memory.close()
+
+    def test_replay_process(self):
+        """
+        Tests inserting into a shared memory shard from a replay process started with the executor's default
+        start method.
+        """
+        mp_context = multiprocessing.get_context("spawn")
+        memory_spec = dict(type="shared_apex_memory", capacity=10, state_shape=(2,), state_dtype="float32")
+        memory = SharedApexMemory(max_batch_size=4, mp_context=mp_context, **{
+            key: value for key, value in memory_spec.items() if key != "type"
+        })
+        try:
+            replay_spec = dict(memory_spec=dict(memory_spec, _attach_handle=memory.handle()),
+                               min_sample_memory_size=1, sample_batch_size=4)
+            sample_queue = mp_context.Queue()
+            process = mp_context.Process(target=_run_replay_memory, args=(replay_spec, sample_queue))
+            process.start()
+            sample_queue.put(EnvironmentSample(sample_batch=dict(
+                states=np.full(shape=(3, 2), fill_value=2.0, dtype=np.float32),
+                actions=np.ones(shape=(3,), dtype=np.int64),
+                rewards=np.full(shape=(3,), fill_value=-2.0),
+                terminals=np.zeros(shape=(3,), dtype=bool),
+                next_states=np.ones(shape=(3, 2), dtype=np.float32),
+                importance_weights=np.ones(shape=(3,))
+            ), batch_size=3))
+            sample_queue.put(None)
+            process.join(timeout=120)
+            self.assertEqual(process.exitcode, 0)
+
+            self.assertEqual((memory.size, memory.num_inserted), (3, 3))
+            batch, _, _ = memory.get_records(4)
+            self.assertTrue(np.all(batch["states"] == 2.0))
+            self.assertTrue(np.all(batch["rewards"] == -1.0))
+        finally:
+            memory.close()
+
+    def test_learning_cartpole(self):
+        """
+        Tests if the multiprocessing executor can learn a simple environment.
+        """
+        env_spec = dict(
+            type="openai",
+            gym_env="CartPole-v0"
+        )
+        agent_config = config_from_path("configs/apex_agent_cartpole.json")
+        executor = MultiprocessingApexExecutor(
+            environment_spec=env_spec,
+            agent_config=agent_config,
+        )
+        print("Successfully created executor.")
+
+        # Executes actual workload.
+        result = executor.execute_workload(workload=dict(num_timesteps=20000, report_interval=1000,
+                                                         report_interval_min_seconds=1))
+        print("Finished executing workload:")
+        print(result)
+        self.assertGreaterEqual(result["timesteps_executed"], 20000)
+        self.assertIsNotNone(result["mean_policy_lag"])
+        executor.stop()
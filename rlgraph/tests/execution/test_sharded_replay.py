@@ -0,0 +1,121 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import unittest
+
+import numpy as np
+
+from rlgraph.execution.sharded_replay import LocalShardedReplay, RateLimiter
+
+
+class TestShardedReplay(unittest.TestCase):
+    """
+    Tests the in-process sharded replay.
+    """
+    memory_spec = dict(type="prioritized_replay", capacity=16, alpha=1.0, beta=1.0)
+
+    @staticmethod
+    def get_records(num_records, offset=0):
+        return dict(
+            states=np.arange(offset, offset + num_records, dtype=np.float32)[:, None],
+            actions=np.zeros(shape=(num_records,), dtype=np.int32),
+            rewards=np.ones(shape=(num_records,), dtype=np.float32),
+            terminals=np.zeros(shape=(num_records,), dtype=bool),
+            next_states=np.arange(offset + 1, offset + num_records + 1, dtype=np.float32)[:, None],
+            importance_weights=None
+        )
+
+    def test_routing_and_merged_sampling(self):
+        replay = LocalShardedReplay(num_shards=2, memory_spec=self.memory_spec, routing="round_robin")
+        for i in range(4):
+            self.assertTrue(replay.insert(self.get_records(3, offset=10 * i)))
+        self.assertEqual([shard.size for shard in replay.shards], [6, 6])
+
+        # Explicit shard ids bypass routing.
+        replay.insert(self.get_records(3, offset=100), shard_id=1)
+        self.assertEqual([shard.size for shard in replay.shards], [6, 9])
+
+        batch = replay.sample_from_all_shards(batch_size=8)
+        self.assertEqual(len(batch["states"]), 8)
+        self.assertEqual(len(batch["indices"]), 8)
+        self.assertEqual(len(batch["importance_weights"]), 8)
+        # Round robin: Offsets 0 and 20 went to shard 0, all others to shard 1.
+        for shard_id, state in zip(batch["shard_ids"], batch["states"]):
+            self.assertEqual(int(state[0]) // 10 in (0, 2), shard_id == 0)
+
+        replay.update_priorities(batch["shard_ids"], batch["indices"], np.full(8, 0.5))
+
+    def test_least_filled_routing(self):
+        replay = LocalShardedReplay(num_shards=3, memory_spec=self.memory_spec, routing="least_filled")
+        replay.insert(self.get_records(5), shard_id=0)
+        replay.insert(self.get_records(2), shard_id=1)
+        replay.insert(self.get_records(1))
+        self.assertEqual([shard.size for shard in replay.shards], [5, 2, 1])
+        replay.insert(self.get_records(4))
+        self.assertEqual([shard.size for shard in replay.shards], [5, 2, 5])
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(samples_per_insert=2.0, min_size_to_sample=4, error_buffer=8)
+        self.assertFalse(limiter.can_sample(1))
+        limiter.insert(4)
+        self.assertTrue(limiter.can_sample(8))
+        # Inserting too far ahead of sampling is blocked.
+        self.assertFalse(limiter.can_insert(5))
+        limiter.sample(8)
+        self.assertFalse(limiter.can_sample(1))
+        self.assertTrue(limiter.can_insert(4))
+
+    def test_back_pressure(self):
+        replay = LocalShardedReplay(num_shards=2, memory_spec=self.memory_spec, samples_per_insert=1.0,
+                                    min_size_to_sample=4, error_buffer=4)
+        self.assertIsNone(replay.sample_from_all_shards(batch_size=2, timeout=0.01))
+        self.assertTrue(replay.insert(self.get_records(4)))
+        self.assertTrue(replay.insert(self.get_records(4)))
+        # Inserts are too far ahead.
+        self.assertFalse(replay.insert(self.get_records(4), timeout=0.01))
+
+        # A blocked insert resumes once the learner catches up.
+        results = []
+        thread = threading.Thread(target=lambda: results.append(replay.insert(self.get_records(4), timeout=5.0)))
+        thread.start()
+        self.assertIsNotNone(replay.sample_from_all_shards(batch_size=4))
+        thread.join()
+        self.assertEqual(results, [True])
+        self.assertEqual(replay.size(), 12)
+
+    def test_inserts_counted_after_write(self):
+        replay = LocalShardedReplay(num_shards=2, memory_spec=self.memory_spec, min_size_to_sample=4)
+        # Block the shard write of an insert.
+        replay.shard_locks[0].acquire()
+        thread = threading.Thread(target=lambda: replay.insert(self.get_records(4), shard_id=0))
+        thread.start()
+        try:
+            thread.join(timeout=0.1)
+            self.assertEqual(replay.rate_limiter.inserted, 0)
+            self.assertIsNone(replay.sample_from_all_shards(batch_size=2, timeout=0.01))
+        finally:
+            replay.shard_locks[0].release()
+        thread.join()
+        self.assertEqual(replay.rate_limiter.inserted, 4)
+
+        # No shard has priority mass: Nothing is sampled or counted.
+        replay.shards[0].merged_segment_tree.sum_segment_tree.values[:] = 0.0
+        self.assertIsNone(replay.sample_from_all_shards(batch_size=2))
+        self.assertEqual(replay.rate_limiter.sampled, 0)
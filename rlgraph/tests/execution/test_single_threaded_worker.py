@@ -71,3 +71,30 @@ class TestSingleThreadedWorker(unittest.TestCase):
         self.assertEqual(result['episodes_executed'], 5)
         self.assertLessEqual(result['env_frames'], 50)
         self.assertGreaterEqual(result['runtime'], 0.0)
+
+    def test_async_envs(self):
+        """
+        Tests acting on partial batches of asynchronously stepped environments.
+        """
+        agent = RandomAgent(
+            action_space=self.environment.action_space,
+            state_space=self.environment.state_space
+        )
+        worker = SingleThreadedWorker(
+            env_spec=dict(type="openai", gym_env="CartPole-v0"),
+            vector_env_spec=dict(type="parallel_vector", num_processes=2),
+            num_envs=4,
+            agent=agent,
+            frameskip=1,
+            worker_executes_preprocessing=False,
+            async_envs=True,
+            min_ready_envs=2
+        )
+
+        result = worker.execute_timesteps(100)
+        self.assertGreaterEqual(result['timesteps_executed'], 100)
+        self.assertGreater(result['episodes_executed'], 0)
+
+        result = worker.execute_episodes(5, reset=False)
+        self.assertGreaterEqual(result['episodes_executed'], 5)
+        worker.vector_env.terminate()
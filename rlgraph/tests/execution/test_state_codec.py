@@ -0,0 +1,101 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import unittest
+
+import numpy as np
+
+from rlgraph.execution.environment_sample import EnvironmentSample
+from rlgraph.execution.ray.ray_util import LazyStates, StateCodec, decompress_states, merge_samples
+
+
+class TestStateCodec(unittest.TestCase):
+    """
+    Tests encoding and decoding states with the binary state codec.
+    """
+    def test_encode_decode(self):
+        codec = StateCodec("none")
+        state = np.random.randint(0, 255, size=(4, 3, 2)).astype(np.uint8)
+        decoded = StateCodec.decompress(codec.compress(state))
+        self.assertEqual(decoded.dtype, np.uint8)
+        np.testing.assert_array_equal(decoded, state)
+
+    def test_batch_encode_decode(self):
+        codec = StateCodec("none")
+        states = np.random.random(size=(5, 3, 2))
+        encoded = codec.compress_batch(states, dtype=np.float32)
+        self.assertEqual(len(encoded), 5)
+        # Single states decode independently of the batch.
+        np.testing.assert_array_equal(StateCodec.decompress(encoded[3]), states[3].astype(np.float32))
+
+        out = np.zeros(shape=(5, 3, 2), dtype=np.float32)
+        decoded = decompress_states(encoded, out=out)
+        self.assertIs(decoded, out)
+        np.testing.assert_array_equal(out, states.astype(np.float32))
+
+        # Uncompressed states are stacked.
+        np.testing.assert_array_equal(decompress_states(list(states)), states)
+
+        # Empty batches (e.g. of an idle worker) encode to no states.
+        self.assertEqual(codec.compress_batch([]), [])
+        self.assertEqual(codec.compress_batch(np.zeros(shape=(0, 3, 2))), [])
+
+    def test_merge_samples(self):
+        codec = StateCodec("none")
+        samples = [
+            EnvironmentSample(dict(states=codec.compress_batch(np.full((2, 3), i)), rewards=np.full(2, i)))
+            for i in range(3)
+        ]
+        batch = merge_samples(samples, decompress=True)
+        self.assertEqual(batch["states"].shape, (6, 3))
+        np.testing.assert_array_equal(batch["rewards"], [0, 0, 1, 1, 2, 2])
+        np.testing.assert_array_equal(batch["states"][2:4], np.ones((2, 3)))
+
+        # Parallel decoding.
+        batch = merge_samples(samples, decompress=True, num_threads=3)
+        np.testing.assert_array_equal(batch["states"][:, 0], [0, 0, 1, 1, 2, 2])
+
+        # Encoded states are kept as is without decompression.
+        batch = merge_samples(samples)
+        self.assertEqual(len(batch["states"]), 6)
+        self.assertIsInstance(batch["states"][0], bytes)
+
+    def test_lazy_states(self):
+        codec = StateCodec("none")
+        # Trailing zero bytes must survive merging.
+        samples = [
+            EnvironmentSample(dict(states=codec.compress_batch(np.full((2, 3), i, dtype=np.uint8)),
+                                   rewards=np.full(2, i)))
+            for i in range(3)
+        ]
+        batch = merge_samples(samples, decompress=True, lazy=True)
+        states = batch["states"]
+        self.assertIsInstance(states, LazyStates)
+        self.assertEqual(states.shape, (6, 3))
+        self.assertEqual(len(states), 6)
+
+        # Only accessed states are decoded.
+        np.testing.assert_array_equal(states[[1, 4]], [[0, 0, 0], [2, 2, 2]])
+        self.assertEqual(list(states.decoded), [False, True, False, False, True, False])
+        np.testing.assert_array_equal(states[-1], [2, 2, 2])
+
+        decoded = np.asarray(states, dtype=np.float32)
+        self.assertEqual(decoded.dtype, np.float32)
+        np.testing.assert_array_equal(decoded[:, 0], [0, 0, 1, 1, 2, 2])
+        self.assertTrue(np.all(states.decoded))
@@ -50,6 +50,30 @@ class TestSyncBatchExecutor(unittest.TestCase):
         print("Finished executing workload:")
         print(result)
 
+    def test_pipelined_ppo_learning_cartpole(self):
+        """
+        Tests sync-batch ppo on cartpole with sampling overlapping updates and straggling workers.
+        """
+        env_spec = dict(
+            type="openai",
+            gym_env="CartPole-v0"
+        )
+        agent_config = config_from_path("configs/sync_batch_ppo_cartpole.json")
+        executor_spec = agent_config["execution_spec"]["ray_spec"]["executor_spec"]
+        executor_spec["pipelined"] = True
+        executor_spec["max_policy_lag"] = 1
+        executor_spec["min_worker_fraction"] = 0.5
+
+        executor = SyncBatchExecutor(
+            environment_spec=env_spec,
+            agent_config=agent_config,
+        )
+        result = executor.execute_workload(workload=dict(num_timesteps=20000, report_interval=1000,
+                                                         report_interval_min_seconds=1))
+        print("Finished executing workload:")
+        print(result)
+        self.assertLessEqual(result["max_policy_lag"], 1)
+
     def test_ppo_learning_pendulum(self):
         """
         Tests if sync-batch ppo can solve Pendulum.
@@ -0,0 +1,55 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import unittest
+
+import numpy as np
+
+from rlgraph.execution.ray.trajectory_buffer import TrajectoryBuffer
+
+
+class TestTrajectoryBuffer(unittest.TestCase):
+    """
+    Tests splitting in-place written steps of several environments into fragments.
+    """
+    def test_fragments(self):
+        buffer = TrajectoryBuffer(num_envs=2, state_shape=(1,), state_dtype=np.float32)
+        buffer.reset(num_steps=4)
+        for t in range(4):
+            # State encodes env (tens) and step.
+            states = np.asarray([[t], [10 + t]], dtype=np.float32)
+            buffer.add(states, actions=[t, 10 + t], rewards=[1.0, 2.0], terminals=[t == 1, False])
+            if t == 1:
+                buffer.end_segment(0, ends_episode=True, next_state=np.asarray([-1.0]))
+        buffer.end_segment(0, ends_episode=False, next_state=np.asarray([4.0]))
+        buffer.end_segment(1, ends_episode=False, next_state=np.asarray([14.0]))
+
+        batch, lengths, ends_episode = buffer.get_batch(with_next_states=True)
+        self.assertEqual(lengths, [2, 2, 4])
+        self.assertEqual(ends_episode, [True, False, False])
+        np.testing.assert_array_equal(batch["states"][:, 0], [0, 1, 2, 3, 10, 11, 12, 13])
+        np.testing.assert_array_equal(batch["next_states"][:, 0], [1, -1, 3, 4, 11, 12, 13, 14])
+        np.testing.assert_array_equal(batch["actions"], [0, 1, 2, 3, 10, 11, 12, 13])
+        np.testing.assert_array_equal(batch["terminals"], [False, True] + [False] * 6)
+
+        # Reset clears fragments and reuses the arrays.
+        states = buffer.states
+        buffer.reset(num_steps=2)
+        self.assertIs(buffer.states, states)
+        self.assertEqual(len(buffer.get_batch()[0]["rewards"]), 0)
@@ -0,0 +1,77 @@
+# Copyright 2018/2019 The RLgraph authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import unittest
+
+import numpy as np
+
+from rlgraph import get_distributed_backend
+from rlgraph.execution.ray.ray_util import WeightPublisher
+
+
+@unittest.skipIf(get_distributed_backend() == "ray", "Weights are put into the Ray object store.")
+class TestWeightPublisher(unittest.TestCase):
+    """
+    Tests versioned weight publication and transport encodings.
+    """
+    @staticmethod
+    def get_weights(scale):
+        return dict(
+            policy_weights=dict(w=np.full((3, 2), scale, dtype=np.float32), step=np.asarray(7, dtype=np.int64)),
+            value_function_weights=dict(v=np.full((2,), -scale, dtype=np.float32))
+        )
+
+    def test_versions(self):
+        publisher = WeightPublisher()
+        self.assertIsNone(publisher.weights_for(0))
+        publisher.publish(self.get_weights(1.0))
+        weights = publisher.weights_for(0)
+        self.assertEqual(weights.version, 1)
+        # Up to date workers fetch nothing.
+        self.assertIsNone(publisher.weights_for(1))
+
+    def test_float16_encoding(self):
+        publisher = WeightPublisher(encoding="float16")
+        publisher.publish(self.get_weights(0.1))
+        weights = publisher.weights_for(0)
+        self.assertEqual(weights.policy_values[0].dtype, np.float16)
+        policy_weights, vf_weights = weights.decode()
+        self.assertEqual(policy_weights["w"].dtype, np.float32)
+        self.assertEqual(policy_weights["step"], 7)
+        np.testing.assert_allclose(vf_weights["v"], -0.1, rtol=1e-3)
+
+    def test_delta_encoding(self):
+        publisher = WeightPublisher(encoding="delta")
+        publisher.publish(self.get_weights(1.0))
+        reference = publisher.weights_for(0).decode()
+
+        for version in range(2, 6):
+            publisher.publish(self.get_weights(1.0 + 0.01 * version))
+            delta = publisher.weights_for(version - 1)
+            self.assertEqual(delta.encoding, "delta")
+            self.assertEqual(delta.base_version, version - 1)
+            reference = delta.decode(reference)
+            # Workers decode exactly what the publisher bases the next delta on.
+            np.testing.assert_array_equal(reference[0]["w"], publisher.reference[0]["w"])
+            np.testing.assert_allclose(reference[0]["w"], 1.0 + 0.01 * version, rtol=1e-3)
+
+        # Workers further behind receive full weights.
+        full = publisher.weights_for(1)
+        self.assertEqual(full.encoding, "none")
+        np.testing.assert_array_equal(full.decode()[1]["v"], publisher.reference[1]["v"])
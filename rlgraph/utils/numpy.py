@@ -186,3 +186,54 @@ def lstm_layer(x, weights, biases=None, initial_internal_states=None, time_major
             unrolled_outputs[:, t, :] = h_states
 
     return unrolled_outputs, (c_states, h_states)
+
+
+def n_step_transform(rewards, terminals, segment_lengths, n_step, discount, segment_terminals=None):
+    """
+    Computes n-step returns for a batch of concatenated trajectory segments (e.g. episode fragments of several
+    environments) in one pass.
+
+    For record i of a segment ending at position T, the n-step reward is the discounted sum of rewards i to
+    min(i + n - 1, T) and its next state is the next state of record min(i + n - 1, T). If a segment ends in a
+    terminal, records whose n-step lookahead reaches its end become terminal. Otherwise, the last n - 1 records
+    lack a full lookahead and are dropped.
+
+    Args:
+        rewards (ndarray): Rewards of all segments, concatenated.
+        terminals (ndarray): Terminals of all segments, concatenated.
+        segment_lengths (Union[list,ndarray]): Length of each segment.
+        n_step (int): Number of steps n.
+        discount (float): Discount factor.
+        segment_terminals (Optional[Union[list,ndarray]]): Whether each segment ends an episode. Defaults to True
+            for all segments.
+
+    Returns:
+        tuple: n-step rewards, n-step terminals, indices of the n-step next states (into the next states
+            corresponding to `rewards`) and indices of the records to keep. Rewards, terminals and next state
+            indices are not yet filtered by the kept indices.
+    """
+    rewards = np.asarray(rewards, dtype=np.float64)
+    terminals = np.asarray(terminals, dtype=bool)
+    segment_lengths = np.asarray(segment_lengths, dtype=np.int64)
+    num_records = len(rewards)
+    positions = np.arange(num_records)
+    if n_step <= 1 or num_records == 0:
+        return rewards, terminals, positions, positions
+
+    if segment_terminals is None:
+        segment_terminals = np.ones(shape=(len(segment_lengths),), dtype=bool)
+    segment_ends = np.repeat(np.cumsum(segment_lengths) - 1, segment_lengths)
+    lookahead_ends = np.minimum(positions + n_step - 1, segment_ends)
+
+    # Discounted sums as n shifted vector adds, masked at segment ends.
+    padded_rewards = np.concatenate([rewards, np.zeros(shape=(n_step - 1,))])
+    n_step_rewards = rewards.copy()
+    for j in range(1, n_step):
+        n_step_rewards += (discount ** j) * np.where(positions + j <= lookahead_ends,
+                                                     padded_rewards[j:j + num_records], 0.0)
+
+    ends_episode = np.repeat(np.asarray(segment_terminals, dtype=bool), segment_lengths)
+    reaches_end = positions + n_step - 1 >= segment_ends
+    n_step_terminals = terminals | (ends_episode & reaches_end & (positions < segment_ends))
+    keep = np.flatnonzero(ends_episode | (positions + n_step - 1 <= segment_ends))
+    return n_step_rewards, n_step_terminals, lookahead_ends, keep
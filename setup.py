@@ -44,7 +44,7 @@ extras_require = {
     'pytorch': ['torch', 'torchvision'],  # TODO platform dependent.
     'gym': ['gym', 'atari-py'],
     'horovod': 'horovod',
-    'ray': ['ray', 'lz4', 'pyarrow']
+    'ray': ['ray', 'lz4']
 }
 
 setup(